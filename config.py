@@ -16,6 +16,42 @@ if not OPENAI_API_KEY:
 
 # Database
 DATABASE_PATH = "data/petmagix.db"
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))  # Idle connections kept open
+DATABASE_STATEMENT_CACHE_SIZE = 128  # Prepared statements cached per connection
+DATABASE_PRAGMAS = {
+    "journal_mode": "WAL",  # Readers no longer block the writer
+    "synchronous": "NORMAL",  # Safe with WAL, far fewer fsyncs
+    "cache_size": -16000,  # Negative means KiB, so 16 MB page cache
+    "mmap_size": 268435456,  # 256 MB memory-mapped reads
+    "temp_store": "MEMORY",
+    "busy_timeout": int(os.getenv("DATABASE_BUSY_TIMEOUT_MS", "5000")),
+}
+DATABASE_BUSY_RETRIES = 5  # Extra attempts after "database is locked"
+DATABASE_BUSY_BACKOFF = 0.05  # Seconds, doubled on each retry
+PETS_CACHE_SIZE = 2048  # Users whose pet lists stay in memory
+PETS_CACHE_TTL = 300  # Seconds
+ENTITLEMENT_CACHE_SIZE = 10000  # Users whose subscription tier stays in memory
+ENTITLEMENT_CACHE_TTL = 600  # Seconds
+SUBSCRIPTION_SWEEP_INTERVAL = 300  # Seconds between expiry downgrade sweeps
+
+# AI quota
+FREE_DAILY_AI_MESSAGES = 3
+QUOTA_FLUSH_INTERVAL = 30  # Seconds between batched writes of usage counters
+
+# Analytics
+ANALYTICS_DB_PATH = "data/analytics.db"
+ANALYTICS_BUFFER_SIZE = 100  # Records buffered before an append to disk
+ANALYTICS_FLUSH_INTERVAL = 5.0  # Seconds a buffered record may wait
+ANALYTICS_QUEUE_SIZE = 10000  # Events queued in memory before new ones are dropped
+ANALYTICS_ROLLUP_CACHE_DAYS = 31  # Closed daily rollups kept in memory
+ANALYTICS_HLL_PRECISION = 12  # 4 KB HyperLogLog per day, ~1.6% error on distinct users
+ANALYTICS_TOP_K = 50  # Counters kept for most-active users
+ANALYTICS_MAX_FILE_BYTES = 50 * 1024 * 1024  # Raw JSONL rotates to a new segment at this size
+ANALYTICS_RAW_RETENTION_DAYS = int(os.getenv("ANALYTICS_RAW_RETENTION_DAYS", "14"))  # Then gzipped into analytics/archive
+ANALYTICS_ARCHIVE_RETENTION_DAYS = int(os.getenv("ANALYTICS_ARCHIVE_RETENTION_DAYS", "365"))  # Then deleted; rollups are kept forever
+ANALYTICS_RETENTION_INTERVAL = 6 * 3600  # Seconds between retention runs
+ANALYTICS_EXPORT_SPOOL_BYTES = 1024 * 1024  # Exports larger than this spill from memory to a temp file
+ANALYTICS_EXPORT_MAX_BYTES = 50 * 1024 * 1024  # Telegram's upload limit for bots
 
 # Persian Text Constants
 MESSAGES = {
@@ -32,3 +68,65 @@ MESSAGES = {
 # OpenAI Settings
 OPENAI_MODEL = "gpt-4.1-nano-2025-04-14"
 OPENAI_MAX_TOKENS = 500
+OPENAI_CONTEXT_WINDOW = 1047576  # Context window of OPENAI_MODEL, in tokens
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))  # Max concurrent HTTP connections to the API
+OPENAI_KEEPALIVE_CONNECTIONS = 10  # Idle connections kept open for reuse
+OPENAI_KEEPALIVE_EXPIRY = 60.0  # Seconds an idle connection stays in the pool
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))  # Seconds per request
+OPENAI_CONNECT_TIMEOUT = 10.0
+
+# Per-model concurrency caps and rate limits (keep below the account's provider limits)
+OPENAI_DEFAULT_RATE_LIMITS = {
+    "concurrency": int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+    "rpm": int(os.getenv("OPENAI_RPM", "500")),
+    "tpm": int(os.getenv("OPENAI_TPM", "200000"))
+}
+OPENAI_RATE_LIMITS = {
+    OPENAI_MODEL: OPENAI_DEFAULT_RATE_LIMITS
+}
+OPENAI_PRIORITY_AGING = 10.0  # Seconds a free request yields to premium ones before it is served in arrival order
+
+# AI resilience
+OPENAI_MAX_RETRIES = 3  # Retries for timeouts, 429s and 5xx errors
+OPENAI_BACKOFF_BASE = 0.5  # Seconds; doubles per attempt, with full jitter
+OPENAI_BACKOFF_MAX = 20.0
+OPENAI_BREAKER_THRESHOLD = 5  # Consecutive provider failures that open the circuit
+OPENAI_BREAKER_RESET = 30.0  # Seconds the circuit stays open before a trial call
+STREAM_EDIT_INTERVAL = 1.0  # Seconds between edits while streaming a reply (Telegram allows ~1 per chat per second)
+
+# Chat prompt budget
+CHAT_PROMPT_TOKENS = 700  # Prompt tokens per chat call, well under the context window
+CHAT_PET_SHARE = 0.2  # Shares of what is left after the system prompt and new message
+CHAT_HEALTH_SHARE = 0.4  # Of what is left after the pet profile; dialogue gets the rest
+CHAT_HEALTH_ROWS = 5  # Most recent health logs considered
+CHAT_NOTE_TOKENS = 30  # Per health-log note
+CHAT_RECAP_TOKENS = 80  # One-line recap of turns dropped from the prompt
+CHAT_HISTORY_TOKENS = 2000  # Hard cap on verbatim turns kept per session if summaries fail
+CHAT_SUMMARY_TOKENS = 150  # Running summary of older turns in the prompt
+
+# Chat memory (rolling summary of long sessions, stored in ai_session_memory)
+MEMORY_RECENT_TURNS = 4  # Newest turns always kept verbatim (2 exchanges)
+MEMORY_SUMMARIZE_AT_TOKENS = int(os.getenv('MEMORY_SUMMARIZE_AT_TOKENS', '600'))  # Verbatim turns that trigger a summary
+MEMORY_SUMMARY_TOKENS = 200  # Completion budget for a summary
+MEMORY_CACHE_SIZE = 1000  # Sessions held in memory
+MEMORY_CACHE_TTL = 3600  # Seconds
+
+# Local intent answers (common questions answered without an API call)
+INTENT_MIN_CONFIDENCE = float(os.getenv('INTENT_MIN_CONFIDENCE', '0.45'))  # Cosine similarity to the intent centroid
+INTENT_MAX_WORDS = 12  # Longer messages always go to the model
+INTENT_TRAINING_LIMIT = 5000  # Logged chat messages used to refit at startup
+
+# Semantic answer cache (model answers reused for near-duplicate standalone questions)
+SEMANTIC_CACHE_DIM = 4096  # Hashed n-gram buckets per question vector
+SEMANTIC_CACHE_SIZE = 1000  # Questions held; ~32 MB of vectors
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9'))  # Cosine similarity needed to reuse an answer
+SEMANTIC_CACHE_TTL = 3 * 24 * 3600  # Seconds before an answer is considered stale
+
+# Premium health analysis coalescing
+ANALYSIS_CACHE_TTL = 900  # Seconds a finished analysis is reused (a new health log changes the key sooner)
+ANALYSIS_CACHE_SIZE = 500  # Finished analyses kept
+
+# AI response cache
+AI_CACHE_DB_PATH = "data/ai_cache.db"
+AI_CACHE_TTL = 30 * 24 * 3600  # Seconds a cached response stays valid
+AI_CACHE_MAX_BYTES = 50 * 1024 * 1024  # Least recently used responses are evicted past this size
@@ -1,9 +1,19 @@
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.analytics import analytics
+from utils.analytics import analytics, ROLLUP_KINDS
+from utils.analytics_export import build_export, count_records, export_size, iter_days, iter_file_records
+from utils.database import db
+from utils.openai_client import scheduler as ai_scheduler
+from utils.response_cache import response_cache
+from utils.semantic_cache import semantic_cache
+from handlers.health_analysis import premium_analyses
 from datetime import date, timedelta
-import json
+import asyncio
+import config
 import os
+import re
+
+DATE_ARG = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
 # Admin user ID - @AshHTehrani
 ADMIN_USER_ID = 691122097  # @AshHTehrani's user ID
@@ -50,6 +60,23 @@ async def admin_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for user_id, actions in today_summary['top_users'].items():
             report += f"• کاربر {user_id}: {actions} اقدام\n"
     
+    pets_cache = db.pets_cache.stats()
+    report += f"\n🗃️ **کش حیوانات:** {pets_cache['hits']} hit / {pets_cache['misses']} miss ({pets_cache['hit_rate']:.0%})\n"
+    
+    ai_cache = response_cache.stats()
+    report += f"🍽️ **کش برنامه غذایی:** {ai_cache['hits']} hit / {ai_cache['misses']} miss ({ai_cache['hit_rate']:.0%})، {ai_cache['entries']} مورد\n"
+    
+    answers = semantic_cache.stats()
+    report += f"🧠 **کش پاسخ‌های مشابه:** {answers['hits']} hit / {answers['misses']} miss ({answers['hit_rate']:.0%})، "
+    report += f"{answers['entries']} مورد، {answers['stale']} منقضی، میانگین عمر پاسخ {answers['avg_age'] / 3600:.1f} ساعت\n"
+    
+    flights = premium_analyses.stats()
+    report += f"📈 **تحلیل پریمیوم:** {flights['executions']} اجرا، {flights['coalesced']} درخواست هم‌زمان ادغام شد، {flights['cached']} از کش\n"
+    
+    for model, lane in ai_scheduler.stats().items():
+        report += f"🤖 **صف AI ({model}):** {lane['active']} فعال، {lane['queued_premium']} پریمیوم / {lane['queued_free']} رایگان در صف، "
+        report += f"میانگین انتظار {lane['avg_wait']:.1f}s (حداکثر {lane['max_wait']:.1f}s)\n"
+    
     await update.message.reply_text(report, parse_mode='Markdown')
 
 async def admin_detailed_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -80,7 +107,10 @@ async def admin_detailed_analytics(update: Update, context: ContextTypes.DEFAULT
         total_actions += summary['total_actions']
         total_chats += summary['ai_chats']
     
+    weekly_summary = analytics.generate_period_summary(7)
+    
     weekly_report += f"📊 **خلاصه هفته:**\n"
+    weekly_report += f"• کاربران یکتا: {weekly_summary['total_users']}\n"
     weekly_report += f"• کل اقدامات: {total_actions}\n"
     weekly_report += f"• کل چت‌های AI: {total_chats}\n"
     weekly_report += f"• میانگین روزانه: {total_actions/7:.1f} اقدام\n"
@@ -101,10 +131,11 @@ async def admin_export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
     analytics_files = []
     if os.path.exists("analytics"):
         for filename in os.listdir("analytics"):
-            if filename.endswith('.json'):
+            if filename.endswith(('.jsonl', '.json')):
                 analytics_files.append(filename)
+    archived_files = analytics.retention.archived_segments()
     
-    if not analytics_files:
+    if not analytics_files and not archived_files:
         await update.message.reply_text("📁 هیچ فایل تحلیلی یافت نشد.")
         return
     
@@ -113,13 +144,27 @@ async def admin_export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_size = os.path.getsize(f"analytics/{filename}")
         file_list += f"• {filename} ({file_size} bytes)\n"
     
+    if archived_files:
+        file_list += f"\n🗄 **بایگانی فشرده ({len(archived_files)} فایل):**\n"
+        for filename, file_size in archived_files[-10:]:
+            file_list += f"• {filename} ({file_size} bytes)\n"
+    
     file_list += f"\n💡 برای دریافت فایل‌ها از دستور زیر استفاده کنید:\n"
-    file_list += f"`/get_analytics_file filename.json`"
+    file_list += f"`/get_analytics_file filename.jsonl`\n"
+    file_list += f"یا خروجی یک بازه زمانی (CSV و فشرده‌سازی اختیاری):\n"
+    file_list += f"`/get_analytics_file user_actions {(date.today() - timedelta(days=7)).isoformat()} {today} csv gz`"
     
     await update.message.reply_text(file_list, parse_mode='Markdown')
 
+def parse_export_args(args):
+    """Split /get_analytics_file arguments into target, dates, format and compression"""
+    target = args[0]
+    days = sorted(arg for arg in args[1:] if DATE_ARG.match(arg))
+    options = {arg.lower() for arg in args[1:]}
+    return target, days, "csv" if "csv" in options else "jsonl", "gz" in options
+
 async def admin_get_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Get specific analytics file"""
+    """Send an analytics file, or a filtered export of one log kind, as a document"""
     user_id = update.effective_user.id
     
     if user_id != ADMIN_USER_ID:
@@ -127,36 +172,79 @@ async def admin_get_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     if not context.args:
-        await update.message.reply_text("❌ نام فایل را مشخص کنید.\nمثال: `/get_analytics_file user_actions_2024-01-15.json`", parse_mode='Markdown')
+        await update.message.reply_text(
+            "❌ نام فایل یا نوع داده را مشخص کنید.\n"
+            "مثال: `/get_analytics_file user_actions_2024-01-15.jsonl`\n"
+            "یا: `/get_analytics_file ai_chats 2024-01-01 2024-01-31 csv gz`",
+            parse_mode='Markdown'
+        )
         return
     
-    filename = context.args[0]
-    filepath = f"analytics/{filename}"
+    target, days, fmt, compress = parse_export_args(context.args)
+    loop = asyncio.get_running_loop()
+    analytics.flush()
     
-    if not os.path.exists(filepath):
-        await update.message.reply_text(f"❌ فایل {filename} یافت نشد.")
+    if target in ROLLUP_KINDS:
+        # Date-range export of one log kind, streamed day by day
+        start_day = days[0] if days else date.today().isoformat()
+        end_day = days[-1] if days else start_day
+        records = (record for day in iter_days(start_day, end_day)
+                   for record in analytics.iter_records(target, day))
+        filename = f"{target}_{start_day}_{end_day}.{fmt}"
+    else:
+        filepath = f"analytics/{target}"
+        
+        # Only files inside analytics/ (including archive/) may be fetched
+        analytics_root = os.path.realpath("analytics")
+        if not os.path.realpath(filepath).startswith(analytics_root + os.sep) or not os.path.isfile(filepath):
+            await update.message.reply_text(f"❌ فایل {target} یافت نشد.")
+            return
+        
+        if fmt == "jsonl" and (not compress or target.endswith('.gz')):
+            # Send the file untouched, streamed straight from disk
+            if os.path.getsize(filepath) > config.ANALYTICS_EXPORT_MAX_BYTES:
+                await update.message.reply_text("❌ فایل برای تلگرام بزرگ است. با گزینه `gz` دوباره امتحان کنید.", parse_mode='Markdown')
+                return
+            try:
+                record_count = await loop.run_in_executor(None, count_records, filepath)
+                with open(filepath, 'rb') as f:
+                    await update.message.reply_document(
+                        document=f,
+                        filename=os.path.basename(target),
+                        caption=f"📄 {target}\n• تعداد رکوردها: {record_count}"
+                    )
+            except Exception as e:
+                await update.message.reply_text(f"❌ خطا در ارسال فایل: {str(e)}")
+            return
+        
+        records = iter_file_records(filepath)
+        filename = f"{os.path.basename(target).split('.')[0]}.{fmt}"
+    
+    if compress:
+        filename += ".gz"
+    
+    try:
+        export_file, record_count = await loop.run_in_executor(None, build_export, records, fmt, compress)
+    except Exception as e:
+        await update.message.reply_text(f"❌ خطا در خواندن فایل: {str(e)}")
         return
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # If file is too large, send summary instead
-        if len(content) > 4000:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            summary = f"📄 **خلاصه {filename}:**\n"
-            summary += f"• تعداد رکوردها: {len(data)}\n"
-            summary += f"• حجم فایل: {len(content)} کاراکتر\n\n"
-            summary += "🔗 فایل بزرگ است. برای دریافت کامل از ربات فایل درخواست کنید."
-            
-            await update.message.reply_text(summary, parse_mode='Markdown')
+        if record_count == 0:
+            await update.message.reply_text("📁 رکوردی برای این بازه یافت نشد.")
+        elif export_size(export_file) > config.ANALYTICS_EXPORT_MAX_BYTES:
+            hint = "بازه کوتاه‌تری انتخاب کنید." if compress else "با گزینه `gz` دوباره امتحان کنید."
+            await update.message.reply_text(f"❌ خروجی برای تلگرام بزرگ است. {hint}", parse_mode='Markdown')
         else:
-            await update.message.reply_text(f"📄 **محتوای {filename}:**\n\n```json\n{content}\n```", parse_mode='Markdown')
-    
+            await update.message.reply_document(
+                document=export_file,
+                filename=filename,
+                caption=f"📄 {filename}\n• تعداد رکوردها: {record_count}"
+            )
     except Exception as e:
-        await update.message.reply_text(f"❌ خطا در خواندن فایل: {str(e)}")
+        await update.message.reply_text(f"❌ خطا در ارسال فایل: {str(e)}")
+    finally:
+        export_file.close()
 
 async def admin_clear_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clear old analytics data"""
@@ -180,6 +268,9 @@ async def admin_clear_analytics(update: Update, context: ContextTypes.DEFAULT_TY
             import shutil
             shutil.rmtree("analytics")
             analytics.ensure_analytics_dir()
+            analytics.reset_rollups()
+        # The SQLite store backs popularity, active users and AI volume, so it is cleared too
+        analytics.store.clear()
         
         await update.message.reply_text("✅ تمام داده‌های تحلیلی پاک شدند.")
     except Exception as e:
@@ -1,7 +1,14 @@
+from contextlib import aclosing
+from datetime import date
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from utils.openai_client import get_ai_chat_response
-from utils.database import db
+from utils.openai_client import stream_ai_chat_response, AIUnavailableError, AI_UNAVAILABLE_MESSAGE
+from utils.stream_editor import ThrottledEditor
+from utils.session_memory import session_memory
+from utils.intents import answer_locally
+from utils.semantic_cache import semantic_cache
+from utils.database import async_db
+from utils.quota import quota
 from utils.keyboards import *
 from utils.persian_utils import *
 from utils.analytics import analytics
@@ -19,14 +26,13 @@ async def start_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Check daily limit for free users
-    if is_premium_feature_blocked(user_id, 'unlimited_ai_chat'):
-        usage_count = db.get_ai_usage(user_id)
-        if usage_count >= 3:
+    if await is_premium_feature_blocked(user_id, 'unlimited_ai_chat'):
+        if quota.remaining(user_id) == 0:
             await show_ai_limit_reached(update, context)
             return ConversationHandler.END
     
     # Get user's pets for context
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     pet_info = ""
     if pets:
         pet_info = f"\n\n🐾 **حیوانات شما:**\n"
@@ -34,7 +40,7 @@ async def start_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pet_info += f"• {pet[2]} ({pet[3]}) - {format_age(pet[5], pet[6])}\n"
     
     # Check if premium for pet selection
-    is_premium = not is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
+    is_premium = not await is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
     
     if is_premium and pets:
         # Premium users can select which pet to discuss
@@ -54,8 +60,7 @@ async def start_ai_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CHAT_MESSAGE
     else:
         # Free users get simple chat
-        usage_count = db.get_ai_usage(user_id) if not is_premium else 0
-        remaining = max(0, 3 - usage_count) if not is_premium else "نامحدود"
+        remaining = quota.remaining(user_id) if not is_premium else "نامحدود"
         
         await query.edit_message_text(
             f"🤖 **مشاوره دامپزشک هوشمند**\n\n"
@@ -93,14 +98,14 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return CHAT_MESSAGE
     
     # Check premium status
-    is_premium = not is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
+    is_premium = not await is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
     
-    # Check daily limit for free users
-    if not is_premium:
-        usage_count = db.get_ai_usage(user_id)
-        if usage_count >= 3:
-            await show_ai_limit_reached(update, context)
-            return ConversationHandler.END
+    # Claim one of today's messages for free users up front, so two concurrent
+    # messages can't both pass the check on the last one
+    reserved = not is_premium
+    if reserved and not quota.try_consume(user_id):
+        await show_ai_limit_reached(update, context)
+        return ConversationHandler.END
     
     # Get pet context if selected
     pet_info = {}
@@ -108,8 +113,7 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     selected_pet_id = context.user_data.get('selected_pet_id')
     
     if is_premium and selected_pet_id:
-        pets = db.get_user_pets(user_id)
-        pet = next((p for p in pets if p[0] == selected_pet_id), None)
+        pet = await async_db.get_user_pet(user_id, selected_pet_id)
         if pet:
             pet_info = {
                 "name": pet[2],
@@ -125,7 +129,7 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             }
             
             # Get recent health history for premium users
-            health_logs = db.get_pet_health_logs(selected_pet_id, 10)
+            health_logs = await async_db.get_pet_health_logs(selected_pet_id, 10)
             health_history = [
                 {
                     "date": log[2],
@@ -142,41 +146,54 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     processing_msg = await update.message.reply_text("🤖 در حال پردازش...")
     
     try:
-        # Get conversation context
-        conversation_context = context.user_data.get('conversation_history', [])
+        # Session memory: running summary of older turns plus recent turns verbatim
+        # (the prompt builder picks what fits its token budget)
+        session_pet_id = selected_pet_id if is_premium else None
+        summary, conversation_context = await session_memory.load(user_id, session_pet_id)
         
-        # Add current message to context
-        conversation_context.append(f"کاربر: {user_message}")
-        
-        # Keep only last 6 messages (3 exchanges)
-        if len(conversation_context) > 6:
-            conversation_context = conversation_context[-6:]
-        
-        # Format context for AI
-        context_text = "\n".join(conversation_context[-4:]) if conversation_context else ""
-        
-        # Get AI response
-        ai_response = await get_ai_chat_response(
-            user_message, pet_info, health_history, is_premium, context_text
-        )
+        editor = ThrottledEditor(processing_msg)
+        # Common questions (vaccines, feeding, age...) get a canned answer without an API call
+        local = answer_locally(user_message, pet_info)
+        # Standalone questions without pet data can reuse an earlier answer to a near-duplicate
+        standalone = not pet_info and not conversation_context and not summary
+        cached = semantic_cache.lookup(user_message) if standalone and not local else None
+        if local:
+            intent, ai_response = local
+            model_name = f"intent:{intent}"
+        elif cached:
+            ai_response = cached
+            model_name = "semantic_cache"
+        else:
+            # Stream the AI response into the processing message as it is written
+            model_name = config.OPENAI_MODEL
+            ai_response = ""
+            # aclosing: if an edit fails mid-stream, the stream is closed right away
+            async with aclosing(stream_ai_chat_response(
+                user_message, pet_info, health_history, is_premium, conversation_context, summary
+            )) as stream:
+                async for delta in stream:
+                    ai_response += delta
+                    await editor.update(f"🩺 پاسخ دامپزشک:\n\n{ai_response} ▌")
+            if standalone and ai_response:
+                semantic_cache.add(user_message, ai_response)
         
-        # Add AI response to context
-        conversation_context.append(f"دامپزشک: {ai_response}")
-        context.user_data['conversation_history'] = conversation_context
+        # Remember this exchange; older turns get summarized in the background, off the reply path
+        await session_memory.append(user_id, session_pet_id, user_message, ai_response)
         
-        # Log usage
+        # Log usage; ai_sessions also feeds the intent classifier
         username = update.effective_user.username or update.effective_user.first_name
         analytics.log_ai_chat(user_id, username, user_message, ai_response, is_premium)
+        await async_db.log_ai_session(user_id, session_pet_id, date.today().isoformat(),
+                                      user_message, ai_response, model_name, 'chat')
         
-        # Increment usage for free users
-        if not is_premium:
-            db.increment_ai_usage(user_id)
-            remaining = max(0, 3 - db.get_ai_usage(user_id))
-        else:
+        # The claimed message is spent now; local answers cost no API call, so theirs is given back
+        if is_premium:
             remaining = "نامحدود"
-        
-        # Delete processing message
-        await processing_msg.delete()
+        else:
+            if local:
+                quota.refund(user_id)
+            reserved = False
+            remaining = quota.remaining(user_id)
         
         # Create response
         response_text = f"🩺 **پاسخ دامپزشک:**\n\n{ai_response}"
@@ -193,13 +210,28 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         if not is_premium:
             keyboard.insert(0, [InlineKeyboardButton("🚀 ارتقاء به پریمیوم", callback_data="upgrade_premium")])
         
-        await update.message.reply_text(
+        await editor.finish(
             response_text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='Markdown'
         )
         
+    except AIUnavailableError as e:
+        # Degraded mode: no answer, so the message doesn't count against the quota
+        print(f"AI chat unavailable: {e}")
+        if reserved:
+            quota.refund(user_id)
+        await processing_msg.delete()
+        await update.message.reply_text(
+            AI_UNAVAILABLE_MESSAGE,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔄 تلاش مجدد", callback_data="continue_chat")],
+                [InlineKeyboardButton("❌ پایان چت", callback_data="end_chat")]
+            ])
+        )
     except Exception as e:
+        if reserved:
+            quota.refund(user_id)
         await processing_msg.delete()
         await update.message.reply_text(
             f"❌ خطا در پردازش: {str(e)}\n"
@@ -226,8 +258,7 @@ async def select_pet_for_chat(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Get pet name
         user_id = update.effective_user.id
-        pets = db.get_user_pets(user_id)
-        pet = next((p for p in pets if p[0] == pet_id), None)
+        pet = await async_db.get_user_pet(user_id, pet_id)
         pet_name = pet[2] if pet else "نامشخص"
     
     await query.edit_message_text(
@@ -254,11 +285,10 @@ async def continue_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    is_premium = not is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
+    is_premium = not await is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
     
     if not is_premium:
-        usage_count = db.get_ai_usage(user_id)
-        remaining = max(0, 3 - usage_count)
+        remaining = quota.remaining(user_id)
         if remaining == 0:
             await show_ai_limit_reached(update, context)
             return ConversationHandler.END
@@ -278,6 +308,7 @@ async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     context.user_data.clear()
+    await session_memory.clear(update.effective_user.id)
     
     await query.edit_message_text(
         "✅ **چت پایان یافت**\n\n"
@@ -292,6 +323,7 @@ async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel AI chat"""
     context.user_data.clear()
+    await session_memory.clear(update.effective_user.id)
     
     if update.callback_query:
         await update.callback_query.edit_message_text(
@@ -311,14 +343,13 @@ async def handle_chat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Check premium status
-    is_premium = not is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
+    is_premium = not await is_premium_feature_blocked(user_id, 'unlimited_ai_chat')
     
-    # Check daily limit for free users
-    if not is_premium:
-        usage_count = db.get_ai_usage(user_id)
-        if usage_count >= 3:
-            await show_ai_limit_reached(update, context)
-            return CHAT_MESSAGE
+    # Claim one of today's messages for free users before answering
+    reserved = not is_premium
+    if reserved and not quota.try_consume(user_id):
+        await show_ai_limit_reached(update, context)
+        return CHAT_MESSAGE
     
     # Show processing message
     processing_msg = await update.message.reply_text("📸 در حال تحلیل عکس...")
@@ -333,8 +364,7 @@ async def handle_chat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         selected_pet_id = context.user_data.get('selected_pet_id')
         
         if is_premium and selected_pet_id:
-            pets = db.get_user_pets(user_id)
-            pet = next((p for p in pets if p[0] == selected_pet_id), None)
+            pet = await async_db.get_user_pet(user_id, selected_pet_id)
             if pet:
                 pet_info = {
                     "name": pet[2],
@@ -364,16 +394,13 @@ async def handle_chat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         username = update.effective_user.username or update.effective_user.first_name
         analytics.log_ai_chat(user_id, username, "📸 عکس آپلود شد", ai_response, is_premium)
         
-        # Increment usage for free users
+        # The claimed message is spent now
         if not is_premium:
-            db.increment_ai_usage(user_id)
-            remaining = max(0, 3 - db.get_ai_usage(user_id))
+            reserved = False
+            remaining = quota.remaining(user_id)
         else:
             remaining = "نامحدود"
         
-        # Delete processing message
-        await processing_msg.delete()
-        
         # Create response
         response_text = f"🩺 **پاسخ دامپزشک:**\n\n{ai_response}"
         
@@ -389,6 +416,7 @@ async def handle_chat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not is_premium:
             keyboard.insert(0, [InlineKeyboardButton("🚀 ارتقاء به پریمیوم", callback_data="upgrade_premium")])
         
+        await processing_msg.delete()
         await update.message.reply_text(
             response_text,
             reply_markup=InlineKeyboardMarkup(keyboard),
@@ -396,6 +424,8 @@ async def handle_chat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     except Exception as e:
+        if reserved:
+            quota.refund(user_id)
         await processing_msg.delete()
         await update.message.reply_text(
             f"❌ خطا در پردازش عکس: {str(e)}\n"
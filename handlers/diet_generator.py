@@ -1,6 +1,6 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from utils.database import db
+from utils.database import async_db
 from utils.keyboards import *
 from utils.persian_utils import *
 from utils.openai_client import generate_diet_plan
@@ -19,12 +19,12 @@ async def start_diet_generator(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = update.effective_user.id
     
     # Check if premium feature
-    if is_premium_feature_blocked(user_id, 'diet_generator'):
+    if await is_premium_feature_blocked(user_id, 'diet_generator'):
         await show_premium_blocked_feature(update, context, "تولید برنامه غذایی")
         return ConversationHandler.END
     
     # Get user's pets
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     if not pets:
         await query.edit_message_text(
@@ -60,8 +60,7 @@ async def select_pet_for_diet(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         # Get pet info
         user_id = update.effective_user.id
-        pets = db.get_user_pets(user_id)
-        selected_pet = next((pet for pet in pets if pet[0] == pet_id), None)
+        selected_pet = await async_db.get_user_pet(user_id, pet_id)
         
         if not selected_pet:
             await query.edit_message_text(
@@ -355,7 +354,7 @@ async def generate_and_show_diet_plan(query, context):
         pet_info = diet_data['pet_info']
         
         # Get recent health data if available
-        health_logs = db.get_pet_health_logs(diet_data['pet_id'], 5)
+        health_logs = await async_db.get_pet_health_logs(diet_data['pet_id'], 5)
         
         # Prepare data for AI
         pet_details = {
@@ -422,7 +421,7 @@ async def generate_and_show_diet_plan(query, context):
         
         # Save diet plan to database
         user_id = query.from_user.id
-        plan_id = db.save_diet_plan(user_id, diet_data['pet_id'], diet_data, diet_plan)
+        plan_id = await async_db.save_diet_plan(user_id, diet_data['pet_id'], diet_data, diet_plan)
         
         # Log the diet generation
         username = query.from_user.username or query.from_user.first_name
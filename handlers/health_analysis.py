@@ -1,22 +1,27 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from utils.database import db
+from telegram.error import BadRequest
+from utils.database import async_db
 from utils.keyboards import *
-from utils.openai_client import analyze_health
+from utils.openai_client import analyze_health, AIUnavailableError, HEALTH_ANALYSIS_ERROR
 from utils.persian_utils import *
+from utils.singleflight import SingleFlight
 from handlers.subscription import check_user_subscription, is_premium_feature_blocked
 import config
 import json
 import hashlib
 from datetime import datetime, timedelta
 
+# Premium analyses in flight or finished recently, keyed by (tier, pet_id, latest health log id)
+premium_analyses = SingleFlight(ttl=config.ANALYSIS_CACHE_TTL, maxsize=config.ANALYSIS_CACHE_SIZE)
+
 async def start_health_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start direct health analysis - no second menu"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     if not pets:
         await query.edit_message_text(
@@ -59,12 +64,11 @@ async def analyze_pet_health_direct(update, pet_id):
     user_id = update.effective_user.id
     
     # Check subscription status
-    subscription = check_user_subscription(user_id)
+    subscription = await check_user_subscription(user_id)
     is_premium = subscription['is_premium']
     
     # Get pet info
-    pets = db.get_user_pets(user_id)
-    selected_pet = next((pet for pet in pets if pet[0] == pet_id), None)
+    selected_pet = await async_db.get_user_pet(user_id, pet_id)
     
     if not selected_pet:
         await query.edit_message_text(
@@ -74,7 +78,7 @@ async def analyze_pet_health_direct(update, pet_id):
         return
     
     # Get health logs
-    health_logs = db.get_pet_health_logs(pet_id, 10)
+    health_logs = await async_db.get_pet_health_logs(pet_id, 10)
     
     if not health_logs:
         await query.edit_message_text(
@@ -160,11 +164,20 @@ async def show_free_analysis(query, pet_id, selected_pet, health_logs):
             ])
         )
 
+async def edit_unless_unchanged(query, text, **kwargs):
+    """Edit the message, ignoring Telegram's error when a coalesced double tap already shows this text"""
+    try:
+        await query.edit_message_text(text, **kwargs)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
 async def show_premium_analysis(query, pet_id, selected_pet, health_logs):
     """🧠 Enhanced Premium Analysis with Learning & Multi-Factor Reasoning"""
     user_id = query.from_user.id
     
-    await query.edit_message_text(
+    await edit_unless_unchanged(
+        query,
         f"🧠 **تحلیل هوشمند سلامت {selected_pet[2]}**\n\n"
         "🤖 تحلیل چندعاملی در حال انجام...\n"
         "🔗 بررسی ارتباطات غذا/فعالیت/حالت...\n"
@@ -179,148 +192,14 @@ async def show_premium_analysis(query, pet_id, selected_pet, health_logs):
     try:
         print(f"🔍 DEBUG: Starting premium analysis for pet_id={pet_id}, user_id={user_id}")
         
-        # 🧠 Enhanced Multi-Factor Analysis
-        print("🔍 DEBUG: Getting correlation data...")
-        try:
-            correlation_data = db.get_correlation_data(pet_id, 30)
-            print(f"🔍 DEBUG: Correlation data retrieved: {len(correlation_data) if correlation_data else 0} records")
-        except Exception as e:
-            print(f"❌ DEBUG: Error getting correlation data: {e}")
-            correlation_data = []
-        
-        print("🔍 DEBUG: Getting learning patterns...")
-        try:
-            learning_patterns = db.get_ai_learning_patterns(pet_id)
-            print(f"🔍 DEBUG: Learning patterns retrieved: {len(learning_patterns) if learning_patterns else 0} patterns")
-        except Exception as e:
-            print(f"❌ DEBUG: Error getting learning patterns: {e}")
-            learning_patterns = []
-        
-        print("🔍 DEBUG: Getting historical patterns...")
-        try:
-            historical_patterns = db.get_pet_historical_patterns(pet_id)
-            print(f"🔍 DEBUG: Historical patterns retrieved: {len(historical_patterns) if historical_patterns else 0} patterns")
-        except Exception as e:
-            print(f"❌ DEBUG: Error getting historical patterns: {e}")
-            historical_patterns = []
-        
-        # Analyze correlations between diet/activity/mood
-        print("🔍 DEBUG: Analyzing correlations...")
-        try:
-            correlations = analyze_diet_activity_correlations(correlation_data)
-            print(f"🔍 DEBUG: Correlations analyzed successfully")
-        except Exception as e:
-            print(f"❌ DEBUG: Error analyzing correlations: {e}")
-            correlations = {"diet_mood_links": [], "activity_symptoms_links": [], "food_intake_patterns": [], "detected_triggers": []}
-        
-        # Multi-factor reasoning analysis
-        print("🔍 DEBUG: Calculating enhanced health score...")
-        try:
-            health_score, alerts, trends, root_causes = calculate_enhanced_health_score(
-                health_logs, selected_pet, correlations, learning_patterns
-            )
-            print(f"🔍 DEBUG: Health score calculated: {health_score}")
-        except Exception as e:
-            print(f"❌ DEBUG: Error calculating health score: {e}")
-            health_score, alerts, trends, root_causes = 75, ["خطا در محاسبه"], "خطا در تحلیل روند", []
-        
-        # Convert selected_pet tuple to dictionary for AI analysis
-        print("🔍 DEBUG: Converting pet data to dictionary...")
-        try:
-            pet_dict = {
-                "id": selected_pet[0],
-                "user_id": selected_pet[1],
-                "name": selected_pet[2],
-                "species": selected_pet[3],
-                "breed": selected_pet[4] if selected_pet[4] else "نامشخص",
-                "age_years": selected_pet[5] if selected_pet[5] else 0,
-                "age_months": selected_pet[6] if selected_pet[6] else 0,
-                "weight": selected_pet[7] if selected_pet[7] else 0,
-                "gender": selected_pet[8] if selected_pet[8] else "نامشخص",
-                "is_neutered": selected_pet[9] if len(selected_pet) > 9 else False,
-                "diseases": selected_pet[10] if len(selected_pet) > 10 and selected_pet[10] else "ندارد",
-                "medications": selected_pet[11] if len(selected_pet) > 11 and selected_pet[11] else "ندارد",
-                "vaccine_status": selected_pet[12] if len(selected_pet) > 12 and selected_pet[12] else "نامشخص"
-            }
-            print(f"🔍 DEBUG: Pet dictionary created successfully")
-        except Exception as e:
-            print(f"❌ DEBUG: Error creating pet dictionary: {e}")
-            pet_dict = {"name": "نامشخص", "species": "نامشخص", "breed": "نامشخص"}
-        
-        # Check for uploaded images in latest health logs
-        print("🔍 DEBUG: Checking for uploaded images...")
-        image_analysis_context = ""
-        try:
-            from utils.openai_client import extract_image_insights_for_health_analysis
-            # Pass both health_logs and pet_dict as required arguments
-            image_insights = await extract_image_insights_for_health_analysis(health_logs[:3], pet_dict)
-            
-            if image_insights and "امکان تحلیل تصویر موجود نیست" not in image_insights:
-                print(f"🔍 DEBUG: Image analysis completed successfully")
-                image_analysis_context = f"\n\n📸 **تحلیل تصاویر آپلود شده:**\n{image_insights}\n"
-            else:
-                print("🔍 DEBUG: No images found in recent health logs or analysis failed")
-        except Exception as e:
-            print(f"❌ DEBUG: Error analyzing images: {e}")
-            image_analysis_context = "\n\n⚠️ تصویر آپلود شده قابل تحلیل نبود یا نامشخص بود"
-
-        # Enhanced AI analysis with learning context and image insights
-        print("🔍 DEBUG: Getting AI analysis...")
-        try:
-            ai_analysis = await get_enhanced_ai_analysis(
-                pet_dict, health_logs, correlations, learning_patterns, user_id, image_analysis_context
-            )
-            print(f"🔍 DEBUG: AI analysis completed: {len(ai_analysis) if ai_analysis else 0} characters")
-        except Exception as e:
-            print(f"❌ DEBUG: Error in AI analysis: {e}")
-            ai_analysis = f"❌ خطا در تحلیل هوش مصنوعی: {str(e)[:100]}..."
-        
-        # Generate consultation ID for feedback
-        print("🔍 DEBUG: Generating consultation ID...")
-        try:
-            consultation_id = generate_consultation_id(user_id, pet_id, "health_analysis")
-            print(f"🔍 DEBUG: Consultation ID generated: {consultation_id}")
-        except Exception as e:
-            print(f"❌ DEBUG: Error generating consultation ID: {e}")
-            consultation_id = "error_id"
-        
-        # Store analysis for learning
-        print("🔍 DEBUG: Storing analysis for learning...")
-        try:
-            await store_analysis_for_learning(pet_id, ai_analysis, correlations, consultation_id)
-            print("🔍 DEBUG: Analysis stored successfully")
-        except Exception as e:
-            print(f"❌ DEBUG: Error storing analysis: {e}")
-        
-        # Create enhanced analysis text
-        print("🔍 DEBUG: Creating analysis text...")
-        try:
-            analysis_text = f"""🧠 **تحلیل هوشمند سلامت {selected_pet[2]}**
-
-🤖 **تحلیل هوش مصنوعی با یادگیری**:
-{ai_analysis}
-
-🔗 **ارتباطات شناسایی شده**:
-{format_correlations(correlations)}
-
-🎯 **علل ریشه‌ای احتمالی**:
-{format_root_causes(root_causes)}
-
-📈 **تحلیل روندها**:
-{trends}
-
-⚠️ **هشدارهای هوشمند**:
-{chr(10).join(f'• {alert}' for alert in alerts[:3]) if alerts else '• هیچ هشدار خاصی نیست'}
-
-💡 **توصیه‌های تخصصی**:
-{generate_smart_recommendations(correlations, root_causes)}
-
-📊 **آمار**: {english_to_persian_numbers(str(len(health_logs)))} ثبت | 🧠 {len(learning_patterns)} الگو یادگیری
-            """
-            print("🔍 DEBUG: Analysis text created successfully")
-        except Exception as e:
-            print(f"❌ DEBUG: Error creating analysis text: {e}")
-            analysis_text = f"❌ خطا در تولید متن تحلیل: {str(e)}"
+        # Double taps share one run, and the result is reused until a new health log is written
+        analysis = await premium_analyses.run(
+            ("premium", pet_id, max(log[0] for log in health_logs)),
+            lambda: build_premium_analysis(user_id, pet_id, selected_pet, health_logs),
+            cacheable=lambda analysis: not analysis["degraded"]
+        )
+        analysis_text = analysis["text"]
+        consultation_id = analysis["consultation_id"]
         
         # Add feedback buttons for AI quality assessment
         print("🔍 DEBUG: Creating feedback keyboard...")
@@ -334,7 +213,8 @@ async def show_premium_analysis(query, pet_id, selected_pet, health_logs):
             ])
         
         print("🔍 DEBUG: Sending final analysis message...")
-        await query.edit_message_text(
+        await edit_unless_unchanged(
+            query,
             analysis_text,
             reply_markup=feedback_keyboard,
             parse_mode='Markdown'
@@ -360,6 +240,161 @@ async def show_premium_analysis(query, pet_id, selected_pet, health_logs):
             ])
         )
 
+async def build_premium_analysis(user_id, pet_id, selected_pet, health_logs):
+    """Run the multi-factor pipeline and AI analysis; returns the report text and its consultation id"""
+    # 🧠 Enhanced Multi-Factor Analysis
+    degraded = False  # Fallback results are not cached
+    print("🔍 DEBUG: Getting correlation data...")
+    try:
+        correlation_data = await async_db.get_correlation_data(pet_id, 30)
+        print(f"🔍 DEBUG: Correlation data retrieved: {len(correlation_data) if correlation_data else 0} records")
+    except Exception as e:
+        print(f"❌ DEBUG: Error getting correlation data: {e}")
+        correlation_data = []
+    
+    print("🔍 DEBUG: Getting learning patterns...")
+    try:
+        learning_patterns = await async_db.get_ai_learning_patterns(pet_id)
+        print(f"🔍 DEBUG: Learning patterns retrieved: {len(learning_patterns) if learning_patterns else 0} patterns")
+    except Exception as e:
+        print(f"❌ DEBUG: Error getting learning patterns: {e}")
+        learning_patterns = []
+    
+    print("🔍 DEBUG: Getting historical patterns...")
+    try:
+        historical_patterns = await async_db.get_pet_historical_patterns(pet_id)
+        print(f"🔍 DEBUG: Historical patterns retrieved: {len(historical_patterns) if historical_patterns else 0} patterns")
+    except Exception as e:
+        print(f"❌ DEBUG: Error getting historical patterns: {e}")
+        historical_patterns = []
+    
+    # Analyze correlations between diet/activity/mood
+    print("🔍 DEBUG: Analyzing correlations...")
+    try:
+        correlations = analyze_diet_activity_correlations(correlation_data)
+        print(f"🔍 DEBUG: Correlations analyzed successfully")
+    except Exception as e:
+        print(f"❌ DEBUG: Error analyzing correlations: {e}")
+        correlations = {"diet_mood_links": [], "activity_symptoms_links": [], "food_intake_patterns": [], "detected_triggers": []}
+    
+    # Multi-factor reasoning analysis
+    print("🔍 DEBUG: Calculating enhanced health score...")
+    try:
+        health_score, alerts, trends, root_causes = calculate_enhanced_health_score(
+            health_logs, selected_pet, correlations, learning_patterns
+        )
+        print(f"🔍 DEBUG: Health score calculated: {health_score}")
+    except Exception as e:
+        print(f"❌ DEBUG: Error calculating health score: {e}")
+        health_score, alerts, trends, root_causes = 75, ["خطا در محاسبه"], "خطا در تحلیل روند", []
+    
+    # Convert selected_pet tuple to dictionary for AI analysis
+    print("🔍 DEBUG: Converting pet data to dictionary...")
+    try:
+        pet_dict = {
+            "id": selected_pet[0],
+            "user_id": selected_pet[1],
+            "name": selected_pet[2],
+            "species": selected_pet[3],
+            "breed": selected_pet[4] if selected_pet[4] else "نامشخص",
+            "age_years": selected_pet[5] if selected_pet[5] else 0,
+            "age_months": selected_pet[6] if selected_pet[6] else 0,
+            "weight": selected_pet[7] if selected_pet[7] else 0,
+            "gender": selected_pet[8] if selected_pet[8] else "نامشخص",
+            "is_neutered": selected_pet[9] if len(selected_pet) > 9 else False,
+            "diseases": selected_pet[10] if len(selected_pet) > 10 and selected_pet[10] else "ندارد",
+            "medications": selected_pet[11] if len(selected_pet) > 11 and selected_pet[11] else "ندارد",
+            "vaccine_status": selected_pet[12] if len(selected_pet) > 12 and selected_pet[12] else "نامشخص"
+        }
+        print(f"🔍 DEBUG: Pet dictionary created successfully")
+    except Exception as e:
+        print(f"❌ DEBUG: Error creating pet dictionary: {e}")
+        pet_dict = {"name": "نامشخص", "species": "نامشخص", "breed": "نامشخص"}
+    
+    # Check for uploaded images in latest health logs
+    print("🔍 DEBUG: Checking for uploaded images...")
+    image_analysis_context = ""
+    try:
+        from utils.openai_client import extract_image_insights_for_health_analysis
+        # Pass both health_logs and pet_dict as required arguments
+        image_insights = await extract_image_insights_for_health_analysis(health_logs[:3], pet_dict)
+        
+        if image_insights and "امکان تحلیل تصویر موجود نیست" not in image_insights:
+            print(f"🔍 DEBUG: Image analysis completed successfully")
+            image_analysis_context = f"\n\n📸 **تحلیل تصاویر آپلود شده:**\n{image_insights}\n"
+        else:
+            print("🔍 DEBUG: No images found in recent health logs or analysis failed")
+    except Exception as e:
+        print(f"❌ DEBUG: Error analyzing images: {e}")
+        image_analysis_context = "\n\n⚠️ تصویر آپلود شده قابل تحلیل نبود یا نامشخص بود"
+
+    # Enhanced AI analysis with learning context and image insights
+    print("🔍 DEBUG: Getting AI analysis...")
+    try:
+        ai_analysis = await get_enhanced_ai_analysis(
+            pet_dict, health_logs, correlations, learning_patterns, user_id, image_analysis_context
+        )
+        print(f"🔍 DEBUG: AI analysis completed: {len(ai_analysis) if ai_analysis else 0} characters")
+    except AIUnavailableError as e:
+        print(f"❌ DEBUG: AI unavailable, using local analysis: {e}")
+        ai_analysis = format_local_health_analysis(health_score, alerts, trends)
+        degraded = True
+    except Exception as e:
+        print(f"❌ DEBUG: Error in AI analysis: {e}")
+        ai_analysis = f"❌ خطا در تحلیل هوش مصنوعی: {str(e)[:100]}..."
+        degraded = True
+    
+    # Generate consultation ID for feedback
+    print("🔍 DEBUG: Generating consultation ID...")
+    try:
+        consultation_id = generate_consultation_id(user_id, pet_id, "health_analysis")
+        print(f"🔍 DEBUG: Consultation ID generated: {consultation_id}")
+    except Exception as e:
+        print(f"❌ DEBUG: Error generating consultation ID: {e}")
+        consultation_id = "error_id"
+    
+    # Store analysis for learning
+    print("🔍 DEBUG: Storing analysis for learning...")
+    try:
+        await store_analysis_for_learning(pet_id, ai_analysis, correlations, consultation_id)
+        print("🔍 DEBUG: Analysis stored successfully")
+    except Exception as e:
+        print(f"❌ DEBUG: Error storing analysis: {e}")
+    
+    # Create enhanced analysis text
+    print("🔍 DEBUG: Creating analysis text...")
+    try:
+        analysis_text = f"""🧠 **تحلیل هوشمند سلامت {selected_pet[2]}**
+
+🤖 **تحلیل هوش مصنوعی با یادگیری**:
+{ai_analysis}
+
+🔗 **ارتباطات شناسایی شده**:
+{format_correlations(correlations)}
+
+🎯 **علل ریشه‌ای احتمالی**:
+{format_root_causes(root_causes)}
+
+📈 **تحلیل روندها**:
+{trends}
+
+⚠️ **هشدارهای هوشمند**:
+{chr(10).join(f'• {alert}' for alert in alerts[:3]) if alerts else '• هیچ هشدار خاصی نیست'}
+
+💡 **توصیه‌های تخصصی**:
+{generate_smart_recommendations(correlations, root_causes)}
+
+📊 **آمار**: {english_to_persian_numbers(str(len(health_logs)))} ثبت | 🧠 {len(learning_patterns)} الگو یادگیری
+        """
+        print("🔍 DEBUG: Analysis text created successfully")
+    except Exception as e:
+        print(f"❌ DEBUG: Error creating analysis text: {e}")
+        analysis_text = f"❌ خطا در تولید متن تحلیل: {str(e)}"
+        degraded = True
+    
+    return {"text": analysis_text, "consultation_id": consultation_id, "degraded": degraded}
+    
+
 def calculate_simple_health_score(health_logs):
     """Calculate simple health score for free users"""
     if not health_logs:
@@ -516,6 +551,15 @@ def get_health_emoji(score):
     else:
         return "🔴"
 
+def format_local_health_analysis(score, alerts, trends):
+    """Rule-based stand-in for the AI analysis while the AI service is unavailable"""
+    analysis = f"1. ارزیابی کلی سلامت (امتیاز 0-100): {get_health_emoji(score)} {score}/100\n\n"
+    analysis += f"{trends}\n\n"
+    if alerts:
+        analysis += "\n".join(f"• {alert}" for alert in alerts[:5]) + "\n\n"
+    analysis += "⏳ تحلیل هوش مصنوعی موقتاً در دسترس نیست؛ این نتیجه از محاسبات داخلی ربات است. چند دقیقه دیگر دوباره تلاش کنید."
+    return analysis
+
 def get_health_text(score):
     """Get text for health score"""
     if score >= 80:
@@ -536,8 +580,7 @@ async def show_pet_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pet_id = int(query.data.split("_")[-1])
         user_id = update.effective_user.id
         
-        pets = db.get_user_pets(user_id)
-        selected_pet = next((pet for pet in pets if pet[0] == pet_id), None)
+        selected_pet = await async_db.get_user_pet(user_id, pet_id)
         
         if not selected_pet:
             await query.edit_message_text(
@@ -546,7 +589,7 @@ async def show_pet_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        health_logs = db.get_pet_health_logs(pet_id, 10)
+        health_logs = await async_db.get_pet_health_logs(pet_id, 10)
         
         if not health_logs:
             await query.edit_message_text(
@@ -834,13 +877,15 @@ async def get_enhanced_ai_analysis(pet_info, health_logs, correlations, learning
         
         ai_response = await analyze_health(enhanced_prompt, pet_context, use_reasoning=True)
         
-        if ai_response and len(ai_response.strip()) > 50:
+        # analyze_health reports errors as text; raise so the report is marked degraded and not cached
+        if ai_response and len(ai_response.strip()) > 50 and not ai_response.startswith(HEALTH_ANALYSIS_ERROR):
             return ai_response
         else:
-            return "تحلیل AI با موفقیت انجام نشد - لطفاً دوباره تلاش کنید"
+            raise ValueError("تحلیل AI با موفقیت انجام نشد - لطفاً دوباره تلاش کنید")
             
     except Exception as e:
-        return f"خطا در تحلیل AI: {str(e)[:100]}..."
+        print(f"❌ DEBUG: Enhanced AI analysis failed: {e}")
+        raise
 
 def format_correlations(correlations):
     """📊 Format correlations for display"""
@@ -929,7 +974,7 @@ async def store_analysis_for_learning(pet_id, ai_analysis, correlations, consult
                     "confidence": trigger["confidence"],
                     "consultation_id": consultation_id
                 }
-                db.store_ai_learning_pattern(
+                await async_db.store_ai_learning_pattern(
                     pet_id, 
                     "health_trigger", 
                     json.dumps(pattern_data, ensure_ascii=False),
@@ -943,7 +988,7 @@ async def store_analysis_for_learning(pet_id, ai_analysis, correlations, consult
                 "analysis_date": datetime.now().isoformat(),
                 "consultation_id": consultation_id
             }
-            db.store_ai_learning_pattern(
+            await async_db.store_ai_learning_pattern(
                 pet_id,
                 "diet_mood_correlation",
                 json.dumps(pattern_data, ensure_ascii=False),
@@ -1010,7 +1055,7 @@ async def process_star_feedback(query, user_id, consultation_id, rating):
     """Process star rating feedback"""
     try:
         # Store feedback in database
-        db.store_ai_feedback_enhanced(
+        await async_db.store_ai_feedback_enhanced(
             user_id=user_id,
             pet_id=0,  # Will be extracted from consultation_id if needed
             consultation_id=consultation_id,
@@ -1045,7 +1090,7 @@ async def process_useful_feedback(query, user_id, consultation_id, is_useful):
         rating = 5 if is_useful else 1
         
         # Store feedback
-        db.store_ai_feedback_enhanced(
+        await async_db.store_ai_feedback_enhanced(
             user_id=user_id,
             pet_id=0,
             consultation_id=consultation_id,
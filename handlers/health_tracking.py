@@ -1,6 +1,6 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from utils.database import db
+from utils.database import async_db
 from utils.keyboards import *
 from utils.persian_utils import *
 from utils.analytics import analytics
@@ -16,7 +16,7 @@ async def start_health_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     if not pets:
         await query.edit_message_text(
@@ -48,8 +48,7 @@ async def select_pet_for_health(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Get pet info
         user_id = update.effective_user.id
-        pets = db.get_user_pets(user_id)
-        selected_pet = next((pet for pet in pets if pet[0] == pet_id), None)
+        selected_pet = await async_db.get_user_pet(user_id, pet_id)
         
         if selected_pet:
             pet_name = selected_pet[2]
@@ -343,7 +342,7 @@ async def handle_image_upload(update: Update, context: ContextTypes.DEFAULT_TYPE
         user_id = update.effective_user.id
         
         # Check if user has premium for image uploads
-        if is_premium_feature_blocked(user_id, 'image_upload'):
+        if await is_premium_feature_blocked(user_id, 'image_upload'):
             await show_premium_blocked_feature(update, context, "آپلود تصاویر")
             return NOTES_LOG
         
@@ -483,7 +482,7 @@ async def get_notes_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Save to database
     pet_id = context.user_data['health_pet_id']
-    db.add_health_log(pet_id, health_data)
+    await async_db.add_health_log(pet_id, health_data)
     
     # Log health action
     user_id = update.effective_user.id
@@ -549,7 +548,7 @@ async def show_my_pets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     if not pets:
         await query.edit_message_text(
@@ -575,8 +574,7 @@ async def show_pet_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if query.data.startswith("select_pet_"):
         pet_id = int(query.data.split("_")[-1])
         user_id = update.effective_user.id
-        pets = db.get_user_pets(user_id)
-        selected_pet = next((pet for pet in pets if pet[0] == pet_id), None)
+        selected_pet = await async_db.get_user_pet(user_id, pet_id)
         
         if selected_pet:
             pet_data = selected_pet
@@ -621,7 +619,7 @@ async def finish_health_log(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Save to database
     pet_id = context.user_data.get('health_pet_id')
     if pet_id:
-        db.add_health_log(pet_id, health_data)
+        await async_db.add_health_log(pet_id, health_data)
         
         # Log health action
         user_id = update.effective_user.id
@@ -1,6 +1,6 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from utils.database import db
+from utils.database import async_db
 from utils.keyboards import *
 from utils.persian_utils import *
 from utils.analytics import analytics
@@ -18,8 +18,8 @@ async def start_add_pet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Check if user has premium for multiple pets
-    if is_premium_feature_blocked(user_id, 'multiple_pets'):
-        existing_pets = db.get_user_pets(user_id)
+    if await is_premium_feature_blocked(user_id, 'multiple_pets'):
+        existing_pets = await async_db.get_user_pets(user_id)
         if len(existing_pets) >= 1:
             await show_premium_blocked_feature(update, context, "افزودن حیوان خانگی دوم")
             return ConversationHandler.END
@@ -282,10 +282,10 @@ async def get_pet_vaccines(update: Update, context: ContextTypes.DEFAULT_TYPE):
         username = update.effective_user.username or update.effective_user.first_name
         
         # Add user if not exists
-        db.add_user(user_id, username)
+        await async_db.add_user(user_id, username)
         
         # Add pet
-        pet_id = db.add_pet(user_id, context.user_data['pet_data'])
+        pet_id = await async_db.add_pet(user_id, context.user_data['pet_data'])
         
         # Log pet addition
         analytics.log_pet_action(user_id, username, "add_pet", {
@@ -348,7 +348,7 @@ async def show_my_pets(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     if not pets:
         await query.edit_message_text(
@@ -493,7 +493,7 @@ async def delete_pet(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Check premium access
-    if is_premium_feature_blocked(user_id, 'delete_pets'):
+    if await is_premium_feature_blocked(user_id, 'delete_pets'):
         await show_premium_blocked_feature(update, context, "حذف حیوان خانگی")
         return
     
@@ -518,8 +518,7 @@ async def pet_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pet_id = int(query.data.split("_")[-1])
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
-    pet = next((p for p in pets if p[0] == pet_id), None)
+    pet = await async_db.get_user_pet(user_id, pet_id)
     
     if not pet:
         await query.edit_message_text(
@@ -567,8 +566,7 @@ async def show_pet_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pet_id = int(query.data.split("_")[-1])
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
-    pet = next((p for p in pets if p[0] == pet_id), None)
+    pet = await async_db.get_user_pet(user_id, pet_id)
     
     if not pet:
         await query.edit_message_text(
@@ -610,8 +608,7 @@ async def show_pet_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pet_id = int(query.data.split("_")[-1])
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
-    pet = next((p for p in pets if p[0] == pet_id), None)
+    pet = await async_db.get_user_pet(user_id, pet_id)
     
     if not pet:
         await query.edit_message_text(
@@ -621,7 +618,7 @@ async def show_pet_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Get health logs
-    health_logs = db.get_pet_health_logs(pet_id, 10)
+    health_logs = await async_db.get_pet_health_logs(pet_id, 10)
     
     history_text = f"📋 **تاریخچه سلامت {pet[2]}**\n\n"
     
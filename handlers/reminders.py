@@ -1,6 +1,6 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from utils.database import db
+from utils.database import async_db
 from utils.keyboards import *
 from utils.persian_utils import *
 import config
@@ -13,7 +13,7 @@ async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     if not pets:
         await query.edit_message_text(
@@ -27,7 +27,7 @@ async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Get today's reminders with real-time logic
-    today_reminders = get_smart_reminders(pets)
+    today_reminders = await get_smart_reminders(pets)
     
     reminder_text = "⏰ **یادآورهای هوشمند**\n\n"
     
@@ -40,7 +40,7 @@ async def show_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reminder_text += "✅ همه کارها انجام شده!\n\n"
     
     # Show streaks
-    streaks = get_care_streaks(pets)
+    streaks = await get_care_streaks(pets)
     if streaks:
         reminder_text += "🔥 **رکوردهای مراقبت:**\n"
         for streak in streaks:
@@ -207,7 +207,7 @@ async def medication_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     # Check which pets need medication
     pets_with_meds = [pet for pet in pets if pet[11] and pet[11] != "ندارد"]
@@ -228,8 +228,8 @@ async def medication_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     for pet in pets_with_meds:
         pet_id = pet[0]
-        last_med = db.get_last_task(pet_id, "medication")
-        streak = db.get_task_streak(pet_id, "medication")
+        last_med = await async_db.get_last_task(pet_id, "medication")
+        streak = await async_db.get_task_streak(pet_id, "medication")
         
         med_text += f"🐾 **{pet[2]} ({pet[3]})**\n"
         med_text += f"💊 دارو: {pet[11]}\n"
@@ -299,7 +299,7 @@ async def test_med_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     pets_with_meds = [pet for pet in pets if pet[11] and pet[11] != "ندارد"]
     
     if pets_with_meds:
@@ -349,7 +349,7 @@ async def weekly_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     schedule_text = "📅 **برنامه هوشمند هفتگی**\n\n"
     
@@ -379,7 +379,7 @@ async def weekly_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
         schedule_text += "---\n"
     
     # Show completion status for today
-    today_tasks = get_today_task_status(pets)
+    today_tasks = await get_today_task_status(pets)
     if today_tasks:
         schedule_text += "\n✅ **وضعیت امروز:**\n"
         for task in today_tasks:
@@ -429,15 +429,14 @@ async def med_given(update: Update, context: ContextTypes.DEFAULT_TYPE):
     pet_id = int(query.data.split("_")[-1])
     
     # Log the medication task
-    db.log_task(pet_id, "medication", "دارو داده شد")
+    await async_db.log_task(pet_id, "medication", "دارو داده شد")
     
     # Get pet info
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
-    pet = next((p for p in pets if p[0] == pet_id), None)
+    pet = await async_db.get_user_pet(user_id, pet_id)
     
     if pet:
-        streak = db.get_task_streak(pet_id, "medication")
+        streak = await async_db.get_task_streak(pet_id, "medication")
         
         await query.edit_message_text(
             f"✅ **دارو {pet[2]} داده شد**\n\n"
@@ -453,13 +452,15 @@ async def daily_task_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     # Log daily care for all pets
     for pet in pets:
-        db.log_task(pet[0], "daily_care", "مراقبت روزانه")
+        await async_db.log_task(pet[0], "daily_care", "مراقبت روزانه")
     
-    total_streak = sum(db.get_task_streak(pet[0], "daily_care") for pet in pets)
+    total_streak = 0
+    for pet in pets:
+        total_streak += await async_db.get_task_streak(pet[0], "daily_care")
     avg_streak = total_streak // len(pets) if pets else 0
     
     await query.edit_message_text(
@@ -482,7 +483,7 @@ async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
     
     for user_id in notification_users.union(daily_med_users):
         try:
-            pets = db.get_user_pets(user_id)
+            pets = await async_db.get_user_pets(user_id)
             if pets:
                 pets_with_meds = [pet for pet in pets if pet[11] and pet[11] != "ندارد"]
                 if pets_with_meds:
@@ -491,7 +492,7 @@ async def send_daily_reminders(context: ContextTypes.DEFAULT_TYPE):
             print(f"Failed to send daily reminder to {user_id}: {e}")
 
 # Utility functions
-def get_smart_reminders(pets):
+async def get_smart_reminders(pets):
     """Generate smart reminders based on real-time data"""
     reminders = []
     
@@ -501,12 +502,12 @@ def get_smart_reminders(pets):
         
         # Check medication
         if pet[11] and pet[11] != "ندارد":
-            last_med = db.get_last_task(pet_id, "medication")
+            last_med = await async_db.get_last_task(pet_id, "medication")
             if not last_med or get_hours_since(last_med) > 20:  # More than 20 hours
                 reminders.append(f"💊 دارو {pet_name}")
         
         # Check health logging
-        health_logs = db.get_pet_health_logs(pet_id, 1)
+        health_logs = await async_db.get_pet_health_logs(pet_id, 1)
         if not health_logs:
             reminders.append(f"📊 ثبت سلامت {pet_name}")
         else:
@@ -520,7 +521,7 @@ def get_smart_reminders(pets):
     
     return reminders
 
-def get_care_streaks(pets):
+async def get_care_streaks(pets):
     """Get care streaks for display"""
     streaks = []
     
@@ -530,18 +531,18 @@ def get_care_streaks(pets):
         
         # Medication streak
         if pet[11] and pet[11] != "ندارد":
-            med_streak = db.get_task_streak(pet_id, "medication")
+            med_streak = await async_db.get_task_streak(pet_id, "medication")
             if med_streak > 0:
                 streaks.append(f"💊 {pet_name}: {english_to_persian_numbers(str(med_streak))} روز دارو")
         
         # Daily care streak
-        care_streak = db.get_task_streak(pet_id, "daily_care")
+        care_streak = await async_db.get_task_streak(pet_id, "daily_care")
         if care_streak > 0:
             streaks.append(f"🏆 {pet_name}: {english_to_persian_numbers(str(care_streak))} روز مراقبت")
     
     return streaks
 
-def get_today_task_status(pets):
+async def get_today_task_status(pets):
     """Get today's task completion status"""
     status = []
     
@@ -551,12 +552,12 @@ def get_today_task_status(pets):
         
         # Check if medication given today
         if pet[11] and pet[11] != "ندارد":
-            last_med = db.get_last_task(pet_id, "medication")
+            last_med = await async_db.get_last_task(pet_id, "medication")
             if last_med and get_hours_since(last_med) < 24:
                 status.append(f"💊 {pet_name} - دارو داده شد")
         
         # Check if daily care done
-        last_care = db.get_last_task(pet_id, "daily_care")
+        last_care = await async_db.get_last_task(pet_id, "daily_care")
         if last_care and get_hours_since(last_care) < 24:
             status.append(f"🏆 {pet_name} - مراقبت انجام شد")
     
@@ -599,7 +600,7 @@ async def vaccine_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    pets = db.get_user_pets(user_id)
+    pets = await async_db.get_user_pets(user_id)
     
     vaccine_text = "💉 **یادآور واکسن**\n\n"
     
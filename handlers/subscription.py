@@ -6,21 +6,56 @@ Real database-backed subscription system with premium features
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from datetime import datetime, timedelta
+import asyncio
 import random
-from utils.database import db
+import config
+from utils.cache import TTLCache
+from utils.database import async_db
+from utils.quota import quota
 from utils.keyboards import main_menu_keyboard
 from utils.persian_utils import persian_number
 
 # Subscription states
 CHECK_SUBSCRIPTION, PAYMENT_METHOD, CONFIRM_PAYMENT = range(3)
 
-def check_user_subscription(user_id):
-    """Check if user has active premium subscription - REAL DATABASE"""
-    return db.get_user_subscription(user_id)
+# Entitlement cache: user_id -> subscription dict, so premium checks skip the database
+entitlements = TTLCache(maxsize=config.ENTITLEMENT_CACHE_SIZE, ttl=config.ENTITLEMENT_CACHE_TTL)
 
-def is_premium_feature_blocked(user_id, feature_type):
+def entitlement_expired(subscription):
+    """True once a cached premium entitlement has passed its end date"""
+    end_date = subscription.get('end_date')
+    if not subscription['is_premium'] or not end_date:
+        return False
+    return datetime.now() > datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
+
+def invalidate_entitlement(user_id):
+    """Drop cached entitlement after any subscription change"""
+    entitlements.invalidate(user_id)
+
+async def check_user_subscription(user_id):
+    """Check if user has active premium subscription - cached, REAL DATABASE on miss"""
+    subscription = entitlements.get(user_id)
+    if subscription is None or entitlement_expired(subscription):
+        subscription = await async_db.get_user_subscription(user_id)
+        entitlements.set(user_id, subscription)
+    return subscription
+
+async def subscription_expiry_sweep(interval=config.SUBSCRIPTION_SWEEP_INTERVAL):
+    """Background loop that downgrades expired subscriptions outside the read path"""
+    while True:
+        try:
+            expired_users = await async_db.expire_subscriptions()
+            for user_id in expired_users:
+                invalidate_entitlement(user_id)
+            if expired_users:
+                print(f"💎 Downgraded {len(expired_users)} expired subscriptions")
+        except Exception as e:
+            print(f"Subscription sweep error: {e}")
+        await asyncio.sleep(interval)
+
+async def is_premium_feature_blocked(user_id, feature_type):
     """Check if feature is blocked for free users - REAL DATABASE"""
-    subscription = check_user_subscription(user_id)
+    subscription = await check_user_subscription(user_id)
     
     if subscription['is_premium']:
         return False
@@ -43,7 +78,7 @@ async def show_subscription_status(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     
     user_id = update.effective_user.id
-    subscription = check_user_subscription(user_id)
+    subscription = await check_user_subscription(user_id)
     
     if subscription['is_premium']:
         # Calculate days remaining
@@ -116,7 +151,7 @@ async def show_premium_upgrade(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     
     user_id = update.effective_user.id
-    subscription = check_user_subscription(user_id)
+    subscription = await check_user_subscription(user_id)
     
     # Check if user already has trial
     trial_used = subscription['is_trial'] or subscription['subscription_type'] == 'trial'
@@ -166,7 +201,7 @@ async def start_free_trial(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    subscription = check_user_subscription(user_id)
+    subscription = await check_user_subscription(user_id)
     
     # Check if trial already used
     if subscription['is_trial'] or subscription['subscription_type'] == 'trial':
@@ -181,7 +216,8 @@ async def start_free_trial(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Start trial in database
-    db.start_trial(user_id)
+    await async_db.start_trial(user_id)
+    invalidate_entitlement(user_id)
     
     trial_end = (datetime.now() + timedelta(days=7)).strftime('%Y/%m/%d')
     
@@ -285,7 +321,8 @@ async def confirm_mock_payment(update: Update, context: ContextTypes.DEFAULT_TYP
     payment_ref = f"PM{random.randint(100000, 999999)}"
     
     # Upgrade user to premium in database
-    db.upgrade_to_premium(user_id, payment_ref, info['months'])
+    await async_db.upgrade_to_premium(user_id, payment_ref, info['months'])
+    invalidate_entitlement(user_id)
     
     # Calculate end date
     end_date = (datetime.now() + timedelta(days=30 * info['months'])).strftime('%Y/%m/%d')
@@ -367,35 +404,36 @@ def add_premium_upsell_button(keyboard_rows):
     keyboard_rows.append([InlineKeyboardButton("💎 ارتقاء به پریمیوم", callback_data="upgrade_premium")])
     return keyboard_rows
 
-# Daily usage limits for free users - REAL DATABASE
-def check_daily_ai_limit(user_id):
-    """Check if user has exceeded daily AI chat limit - REAL DATABASE"""
-    subscription = check_user_subscription(user_id)
+# Daily usage limits for free users - in-memory quota, persisted write-behind
+async def check_daily_ai_limit(user_id):
+    """Check if user has exceeded daily AI chat limit (read-only; quota.try_consume claims a message atomically)"""
+    subscription = await check_user_subscription(user_id)
     
     # Premium users have no limits
     if subscription['is_premium']:
         return False
     
-    # Free users limited to 3 messages per day
-    usage_count = db.get_ai_usage(user_id)
-    return usage_count >= 3
+    # Free users limited to FREE_DAILY_AI_MESSAGES per day
+    return quota.remaining(user_id) == 0
 
-def get_ai_usage_count(user_id):
-    """Get current AI usage count for today - REAL DATABASE"""
-    return db.get_ai_usage(user_id)
+async def get_ai_usage_count(user_id):
+    """Get current AI usage count for today"""
+    return quota.used(user_id)
 
-def increment_ai_usage(user_id):
-    """Increment AI usage count - REAL DATABASE"""
-    db.increment_ai_usage(user_id)
+async def increment_ai_usage(user_id):
+    """Increment AI usage count, returning the remaining quota"""
+    return quota.consume(user_id)
 
 # Manual premium activation for testing
 async def activate_premium_manually(user_id, months=1):
     """Manually activate premium for testing"""
     payment_ref = f"MANUAL_{random.randint(100000, 999999)}"
-    db.upgrade_to_premium(user_id, payment_ref, months)
+    await async_db.upgrade_to_premium(user_id, payment_ref, months)
+    invalidate_entitlement(user_id)
     return f"Premium activated for user {user_id} for {months} months. Reference: {payment_ref}"
 
 async def deactivate_premium_manually(user_id):
     """Manually deactivate premium for testing"""
-    db.update_subscription(user_id, is_premium=False, subscription_type='free', end_date=None)
+    await async_db.update_subscription(user_id, is_premium=False, subscription_type='free', end_date=None)
+    invalidate_entitlement(user_id)
     return f"Premium deactivated for user {user_id}"
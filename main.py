@@ -1,4 +1,5 @@
 import logging
+import asyncio
 from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler, ContextTypes
 import config
@@ -27,8 +28,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = user.username or user.first_name
     
     # Add user to database
-    from utils.database import db
-    db.add_user(user.id, username)
+    from utils.database import async_db
+    await async_db.add_user(user.id, username)
     
     # Log user action
     analytics.log_user_action(user.id, username, "start_bot")
@@ -114,10 +115,52 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Log errors"""
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
+async def on_startup(application: Application):
+    """Reload in-memory state and start background maintenance tasks"""
+    from utils.quota import quota
+    await quota.load()
+    analytics.start()
+    
+    # Refit the local intent classifier and the semantic cache's IDF on logged chat messages
+    from utils.database import async_db
+    from utils.intents import refresh_intents
+    from utils.semantic_cache import semantic_cache
+    sessions = await async_db.get_ai_session_messages(config.INTENT_TRAINING_LIMIT)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, refresh_intents, sessions)
+    await loop.run_in_executor(None, semantic_cache.fit_idf, [session[1] for session in sessions if session[1]])
+    
+    application.bot_data['background_tasks'] = [
+        asyncio.create_task(subscription_expiry_sweep()),
+        asyncio.create_task(quota.run_flusher()),
+        asyncio.create_task(analytics.run_retention())
+    ]
+
+async def on_shutdown(application: Application):
+    """Stop background tasks and release shared resources when the bot stops"""
+    for task in application.bot_data.get('background_tasks', []):
+        task.cancel()
+    
+    from utils.quota import quota
+    await quota.flush()
+    await analytics.stop()
+    
+    from utils.session_memory import session_memory
+    await session_memory.stop()
+    
+    from utils.openai_client import close_client
+    await close_client()
+    
+    from utils.response_cache import response_cache
+    response_cache.close()
+    
+    from utils.database import async_db
+    async_db.close()
+
 def main():
     """Main function to run the bot"""
     # Create application
-    application = Application.builder().token(config.BOT_TOKEN).build()
+    application = Application.builder().token(config.BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
     
     # Add pet management conversation handler
     pet_conv_handler = ConversationHandler(
@@ -315,6 +358,10 @@ def main():
     print(f"📱 Bot token configured: {config.BOT_TOKEN[:10]}...")
     print(f"🗄️ Database path: {config.DATABASE_PATH}")
     print(f"🤖 OpenAI configured: {'Yes' if config.OPENAI_API_KEY else 'No'}")
+    
+    from utils.database import db
+    for label, details in db.check_query_plans():
+        print(f"⚠️ Query plan regression in '{label}': {'; '.join(details)}")
     print("🚀 Bot is running! Press Ctrl+C to stop.")
     
     application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# config refuses to import without credentials; tests never reach the real APIs
+os.environ.setdefault("BOT_TOKEN", "test-bot-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+
+# Importing utils.database opens data/*.db relative to the working directory (run_bot.py creates it),
+# so run the suite from a scratch directory instead of the checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="petbot-tests-"))
+os.makedirs("data", exist_ok=True)
@@ -0,0 +1,45 @@
+import pytest
+
+from utils.analytics_store import AnalyticsStore
+
+DAY = "2026-01-05"
+
+def action(user_id, name, hour="10", is_premium=False):
+    return ("user_actions", {
+        "timestamp": f"{DAY}T{hour}:00:00",
+        "user_id": user_id,
+        "action": name,
+        "is_premium": is_premium
+    })
+
+@pytest.fixture
+def store(tmp_path):
+    store = AnalyticsStore(str(tmp_path / "analytics.db"))
+    yield store
+    store.close()
+
+def test_clear_empties_events_and_rollups(store):
+    store.insert_events([action(1, "menu"), action(2, "menu", hour="11"), ("ai_chats", {
+        "timestamp": f"{DAY}T12:00:00", "user_id": 1, "ai_type": "chat"
+    })])
+    assert store.active_users(DAY, DAY) == 2
+    
+    store.clear()
+    assert store.function_popularity(DAY, DAY) == {}
+    assert store.active_users(DAY, DAY) == 0
+    assert store.ai_volume(DAY, DAY, by='hour') == []
+
+def test_replace_day_completes_a_partial_import(store):
+    # One event was already stored (a crashed backfill, or a live write before the backfill ran)
+    store.insert_events([action(1, "menu")])
+    assert not store.is_backfilled(DAY, "user_actions")
+    
+    store.replace_day(DAY, "user_actions", [action(1, "menu"), action(2, "diet", is_premium=True)])
+    assert store.is_backfilled(DAY, "user_actions")
+    assert store.function_popularity(DAY, DAY) == {"menu": 1, "diet": 1}
+    assert store.active_users(DAY, DAY) == 2
+    assert store.active_users(DAY, DAY, premium_only=True) == 1
+    
+    # Replacing again is idempotent
+    store.replace_day(DAY, "user_actions", [action(1, "menu"), action(2, "diet", is_premium=True)])
+    assert store.function_popularity(DAY, DAY) == {"menu": 1, "diet": 1}
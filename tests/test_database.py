@@ -0,0 +1,10 @@
+import config
+from utils.database import Database
+
+def test_hot_queries_use_indexes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", str(tmp_path / "petmagix.db"))
+    db = Database()  # init_db runs the migrations and creates the managed indexes
+    try:
+        assert db.check_query_plans() == []
+    finally:
+        db.close()
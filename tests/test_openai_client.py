@@ -0,0 +1,311 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import aclosing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+import config
+from utils import openai_client
+from utils.openai_client import (
+    AIScheduler, AIUnavailableError, CircuitBreaker, OpenAIClientManager, TokenBucket,
+    create_completion, stream_completion
+)
+
+MODEL = "test-model"
+MESSAGES = [{"role": "user", "content": "سلام"}]
+
+def completion_body(content):
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}
+    }
+
+def stream_body(deltas):
+    """Server-sent events for a streamed completion, one chunk per delta"""
+    events = []
+    for delta in deltas:
+        chunk = {
+            "id": "chatcmpl-test",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": MODEL,
+            "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+        }
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode()
+
+def ok(content="پاسخ"):
+    return lambda request: httpx.Response(200, json=completion_body(content))
+
+def streamed(*deltas):
+    return lambda request: httpx.Response(
+        200, content=stream_body(deltas), headers={"content-type": "text/event-stream"}
+    )
+
+def status(code, headers=None):
+    return lambda request: httpx.Response(code, json={"error": {"message": f"status {code}"}}, headers=headers)
+
+class MockOpenAI:
+    """Serves queued handlers in order (the last one repeats) and counts requests"""
+    
+    def __init__(self, *handlers):
+        self.handlers = list(handlers)
+        self.requests = 0
+    
+    def serve(self, *handlers):
+        self.handlers = list(handlers)
+    
+    def __call__(self, request):
+        self.requests += 1
+        handler = self.handlers.pop(0) if len(self.handlers) > 1 else self.handlers[0]
+        return handler(request)
+
+@pytest.fixture
+def api(monkeypatch):
+    """AsyncOpenAI over an httpx.MockTransport, with a fresh breaker and scheduler and no backoff sleeps"""
+    mock = MockOpenAI(ok())
+    
+    def client():
+        return AsyncOpenAI(
+            api_key="test",
+            base_url="https://openai.test/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(mock))
+        )
+    
+    monkeypatch.setattr(openai_client.client_manager, "get", lambda: mock.client)
+    monkeypatch.setattr(openai_client, "breaker", CircuitBreaker(failure_threshold=3, reset_timeout=30.0))
+    monkeypatch.setattr(openai_client, "scheduler", AIScheduler(
+        {}, {"concurrency": 8, "rpm": 600, "tpm": 100000}, aging=config.OPENAI_PRIORITY_AGING
+    ))
+    monkeypatch.setattr(config, "OPENAI_BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(config, "OPENAI_MAX_RETRIES", 3)
+    mock.client = client()
+    return mock
+
+def complete():
+    return create_completion(MESSAGES, max_tokens=20, temperature=0, model=MODEL)
+
+async def collect(stream):
+    return "".join([delta async for delta in stream])
+
+def expire_cooldown(breaker):
+    """Jump past the reset timeout so the next allow() is the half-open trial"""
+    breaker.opened_at -= breaker.reset_timeout
+
+def test_token_bucket_refills_continuously(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(openai_client.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(per_minute=60)
+    
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    now[0] += 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.wait_time(1) == 0.0
+    # Oversized requests wait for a full bucket rather than forever
+    assert bucket.wait_time(500) == pytest.approx(59.0)
+
+def test_scheduler_spaces_requests_when_rpm_bucket_is_empty(api):
+    async def scenario():
+        openai_client.scheduler._lane(MODEL).requests.tokens = 0  # 600 rpm: one request per 0.1 s
+        started = time.monotonic()
+        await asyncio.gather(complete(), complete(), complete())
+        return time.monotonic() - started
+    
+    elapsed = asyncio.run(scenario())
+    assert api.requests == 3
+    assert elapsed >= 0.25
+    assert openai_client.scheduler.stats()[MODEL]["granted"] == 3
+
+def test_retries_429_without_tripping_the_breaker(api):
+    api.serve(status(429, {"retry-after": "0"}), status(429), ok("بعد از تلاش مجدد"))
+    
+    response = asyncio.run(complete())
+    assert response.choices[0].message.content == "بعد از تلاش مجدد"
+    assert api.requests == 3
+    assert openai_client.breaker.failures == 0
+
+def test_retries_5xx_until_success(api):
+    api.serve(status(500), status(503), ok())
+    
+    asyncio.run(complete())
+    assert api.requests == 3
+    assert openai_client.breaker.state == "closed"
+    assert openai_client.breaker.failures == 0
+
+def test_gives_up_after_max_retries(api, monkeypatch):
+    monkeypatch.setattr(openai_client, "breaker", CircuitBreaker(failure_threshold=10, reset_timeout=30.0))
+    api.serve(status(502))
+    
+    with pytest.raises(AIUnavailableError):
+        asyncio.run(complete())
+    assert api.requests == config.OPENAI_MAX_RETRIES + 1
+
+def test_client_errors_are_not_retried(api):
+    api.serve(status(400))
+    
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(complete())
+    assert api.requests == 1
+    assert openai_client.breaker.failures == 0
+
+def test_breaker_opens_half_opens_and_closes(api, monkeypatch):
+    monkeypatch.setattr(config, "OPENAI_MAX_RETRIES", 2)
+    breaker = openai_client.breaker
+    api.serve(status(500))
+    
+    # Three consecutive provider failures open the circuit
+    with pytest.raises(AIUnavailableError):
+        asyncio.run(complete())
+    assert breaker.state == "open"
+    
+    # While open, calls fail fast without reaching the API
+    requests = api.requests
+    with pytest.raises(AIUnavailableError):
+        asyncio.run(complete())
+    assert api.requests == requests
+    
+    # A failed half-open trial restarts the cool-down
+    expire_cooldown(breaker)
+    assert breaker.state == "half_open"
+    with pytest.raises(AIUnavailableError):
+        asyncio.run(complete())
+    assert api.requests == requests + 1
+    assert breaker.state == "open"
+    
+    # A successful trial closes it again
+    expire_cooldown(breaker)
+    api.serve(ok())
+    asyncio.run(complete())
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+def test_stream_retries_before_the_first_delta(api):
+    api.serve(status(503), streamed("سلام", " دوست", " من"))
+    
+    text = asyncio.run(collect(stream_completion(MESSAGES, max_tokens=20, temperature=0, model=MODEL)))
+    assert text == "سلام دوست من"
+    assert api.requests == 2
+    assert openai_client.breaker.failures == 0
+
+def test_stream_closed_early_frees_the_half_open_trial(api):
+    breaker = openai_client.breaker
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = time.monotonic()
+    expire_cooldown(breaker)
+    api.serve(streamed("اول", " دوم", " سوم"))
+    
+    async def read_first_delta():
+        async with aclosing(stream_completion(MESSAGES, max_tokens=20, temperature=0, model=MODEL)) as stream:
+            async for delta in stream:
+                return delta
+    
+    assert asyncio.run(read_first_delta()) == "اول"
+    # The trial neither succeeded nor failed, so another caller may run it
+    assert not breaker.trial_running
+    assert breaker.state == "half_open"
+    assert openai_client.scheduler.stats()[MODEL]["active"] == 0
+    
+    assert asyncio.run(collect(stream_completion(MESSAGES, max_tokens=20, temperature=0, model=MODEL))) == "اول دوم سوم"
+    assert breaker.state == "closed"
+
+HANDSHAKE_DELAY = 0.05  # Seconds each new connection costs, standing in for TCP + TLS setup
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat endpoint over HTTP/1.1 keep-alive; one instance per connection"""
+    protocol_version = "HTTP/1.1"
+    
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        time.sleep(HANDSHAKE_DELAY)
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps(completion_body("پاسخ")).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def local_server(monkeypatch):
+    """Local mock OpenAI server; AsyncOpenAI picks it up from OPENAI_BASE_URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def manager():
+    return OpenAIClientManager(
+        "test", pool_size=4, keepalive_connections=2, keepalive_expiry=30.0, timeout=12.0, connect_timeout=3.0
+    )
+
+def test_client_manager_reuses_one_configured_client(local_server):
+    clients = manager()
+    
+    async def scenario():
+        client = clients.get()
+        assert clients.get() is client
+        assert client.max_retries == 0
+        assert client.timeout == httpx.Timeout(12.0, connect=3.0)
+        pool = client._client._transport._pool
+        assert (pool._max_connections, pool._max_keepalive_connections, pool._keepalive_expiry) == (4, 2, 30.0)
+        
+        await clients.close()
+        assert client.is_closed()
+        replacement = clients.get()
+        assert replacement is not client
+        await clients.close()
+    
+    asyncio.run(scenario())
+
+def test_shared_client_reuses_connections_and_cuts_latency(local_server):
+    calls = 5
+    messages = dict(model=MODEL, messages=MESSAGES, max_tokens=20)
+    
+    async def shared():
+        clients = manager()
+        started = time.monotonic()
+        for _ in range(calls):
+            await clients.get().chat.completions.create(**messages)
+        elapsed = time.monotonic() - started
+        await clients.close()
+        return elapsed
+    
+    async def client_per_call():
+        started = time.monotonic()
+        for _ in range(calls):
+            clients = manager()
+            await clients.get().chat.completions.create(**messages)
+            await clients.close()
+        return time.monotonic() - started
+    
+    shared_elapsed = asyncio.run(shared())
+    assert local_server.connections == 1
+    
+    per_call_elapsed = asyncio.run(client_per_call())
+    assert local_server.connections == 1 + calls
+    # Every fresh client pays the connection setup again
+    assert per_call_elapsed - shared_elapsed >= (calls - 1) * HANDSHAKE_DELAY * 0.8
@@ -0,0 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.quota import QuotaService
+
+def test_try_consume_stops_at_the_limit():
+    quota = QuotaService(daily_limit=3)
+    
+    assert [quota.try_consume(7) for _ in range(4)] == [True, True, True, False]
+    assert quota.remaining(7) == 0
+    
+    quota.refund(7)
+    assert quota.remaining(7) == 1
+    assert quota.try_consume(7)
+
+def test_concurrent_claims_on_the_last_message_admit_one():
+    quota = QuotaService(daily_limit=3)
+    for _ in range(2):
+        quota.try_consume(7)
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claims = list(pool.map(lambda _: quota.try_consume(7), range(8)))
+    assert claims.count(True) == 1
+    assert quota.used(7) == 3
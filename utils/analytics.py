@@ -1,12 +1,301 @@
 import json
 import os
+import glob
+import gzip
+import asyncio
+import time
+import atexit
+import threading
 from datetime import datetime, date, timedelta
 from collections import defaultdict
+import config
+from utils.cache import TTLCache
+from utils.analytics_store import AnalyticsStore
+from utils.sketches import HyperLogLog, SpaceSaving
+from utils.retention import RetentionPolicy, day_segments, parse_segment, rotate_if_needed
+
+class JsonlWriter:
+    """Buffered append-only writer for newline-delimited JSON records"""
+    
+    def __init__(self, max_buffer=100, flush_interval=5.0, max_file_bytes=0):
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self._buffers = defaultdict(list)  # path -> pending lines
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+    
+    def write(self, path, record):
+        """Queue one record; flushes when the buffer is full or stale"""
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffers[path].append(line)
+            self._pending += 1
+            due = (self._pending >= self.max_buffer or
+                   time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+    
+    def flush(self):
+        """Append all buffered lines to their files"""
+        with self._lock:
+            buffers, self._buffers = self._buffers, defaultdict(list)
+            self._pending = 0
+            self._last_flush = time.monotonic()
+            for path, lines in buffers.items():
+                try:
+                    rotate_if_needed(path, self.max_file_bytes)
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write("\n".join(lines) + "\n")
+                except Exception as e:
+                    print(f"Analytics write error ({path}): {e}")
+
+class AnalyticsSink:
+    """Bounded asyncio queue drained by a background task that appends records in batches"""
+    
+    def __init__(self, writer, store=None, capacity=10000, batch_size=100, flush_interval=5.0):
+        self.writer = writer
+        self.store = store
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = None
+        self._task = None
+    
+    def put(self, kind, path, record):
+        """Enqueue without blocking; writes synchronously when no task is running"""
+        if self._task is None:
+            self._write_batch([(kind, path, record)])
+            return
+        try:
+            self._queue.put_nowait((kind, path, record))
+        except asyncio.QueueFull:
+            # Drop the newest event rather than stall the handler
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"Analytics queue full, dropped {self.dropped} events so far")
+    
+    def start(self):
+        """Start the writer task on the running event loop"""
+        self._queue = asyncio.Queue(maxsize=self.capacity)
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the writer task once it has persisted everything queued, including its partial batch"""
+        if self._task is None:
+            return
+        # Events logged from here on are written synchronously
+        task, self._task = self._task, None
+        # The sentinel queues behind every pending event, so the task drains them before exiting
+        await self._queue.put(None)
+        await task
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            event = await self._queue.get()
+            if event is None:
+                break
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+            try:
+                await loop.run_in_executor(None, self._write_batch, batch)
+            except Exception as e:
+                print(f"Analytics sink error: {e}")
+    
+    def _write_batch(self, batch):
+        for kind, path, record in batch:
+            self.writer.write(path, record)
+        if self.store is not None:
+            try:
+                self.store.insert_events([(kind, record) for kind, path, record in batch])
+            except Exception as e:
+                print(f"Analytics store error: {e}")
+        self.writer.flush()
+    
+    def stats(self):
+        """Queue depth and drop counter"""
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'dropped': self.dropped
+        }
+
+def read_jsonl(path):
+    """Stream records from a JSONL file (plain or gzipped), skipping torn or blank lines"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def convert_legacy_files(analytics_dir="analytics"):
+    """One-shot conversion of legacy JSON-array logs to JSONL; returns files converted"""
+    converted = 0
+    for legacy_file in sorted(glob.glob(os.path.join(analytics_dir, "*.json"))):
+        if os.path.basename(legacy_file).startswith("daily_summary_"):
+            continue  # Summaries are single documents, not event logs
+        
+        jsonl_file = legacy_file + "l"
+        tmp_file = jsonl_file + ".tmp"
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            
+            # Legacy records are older, so they go before anything already in JSONL
+            with open(tmp_file, 'w', encoding='utf-8') as out:
+                for record in records:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if os.path.exists(jsonl_file):
+                    with open(jsonl_file, 'r', encoding='utf-8') as existing:
+                        for line in existing:
+                            out.write(line)
+            
+            os.replace(tmp_file, jsonl_file)
+            os.remove(legacy_file)
+            converted += 1
+        except Exception as e:
+            print(f"Conversion error ({legacy_file}): {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return converted
+
+class DailyRollup:
+    """Running counters and fixed-size sketches for one day of events"""
+    
+    def __init__(self, day, closed=False):
+        self.day = day
+        self.closed = closed
+        self.users = HyperLogLog(config.ANALYTICS_HLL_PRECISION)
+        self.premium_users = HyperLogLog(config.ANALYTICS_HLL_PRECISION)
+        self.total_actions = 0
+        # Action names come from code, so an exact breakdown stays small
+        self.action_breakdown = defaultdict(int)
+        self.most_active_users = SpaceSaving(config.ANALYTICS_TOP_K)
+        self.counts = defaultdict(int)  # kind -> events
+    
+    def apply(self, kind, entry):
+        """Fold one event into the rollup"""
+        user_id = entry.get("user_id")
+        if kind == "user_actions":
+            self.users.add(user_id)
+            self.total_actions += 1
+            self.action_breakdown[entry["action"]] += 1
+            self.most_active_users.add(user_id)
+        elif kind == "ai_chats":
+            self.counts[kind] += 1
+            self.users.add(user_id)
+            if entry.get("is_premium"):
+                self.premium_users.add(user_id)
+        elif kind in ("pet_actions", "health_actions"):
+            self.counts[kind] += 1
+            self.users.add(user_id)
+        elif kind == "premium_actions":
+            self.counts[kind] += 1
+            self.users.add(user_id)
+            if entry["action"] in ["upgrade_to_premium", "start_trial"]:
+                self.premium_users.add(user_id)
+    
+    def summary(self):
+        """Dashboard view of the rollup"""
+        return {
+            "date": self.day,
+            "total_users": self.users.count(),
+            "total_actions": self.total_actions,
+            "action_breakdown": dict(self.action_breakdown),
+            "ai_chats": self.counts["ai_chats"],
+            "pet_actions": self.counts["pet_actions"],
+            "health_actions": self.counts["health_actions"],
+            "premium_actions": self.counts["premium_actions"],
+            "new_users": 0,
+            "premium_users": self.premium_users.count(),
+            "top_users": dict(self.most_active_users.top(5))
+        }
+    
+    def merge(self, other):
+        """Fold another day's rollup into this one (for weekly/monthly views)"""
+        self.users.merge(other.users)
+        self.premium_users.merge(other.premium_users)
+        self.total_actions += other.total_actions
+        for action, count in other.action_breakdown.items():
+            self.action_breakdown[action] += count
+        self.most_active_users.merge(other.most_active_users)
+        for kind, count in other.counts.items():
+            self.counts[kind] += count
+        return self
+    
+    def to_dict(self):
+        data = self.summary()
+        data["rollup"] = {
+            "closed": self.closed,
+            "users_hll": self.users.to_dict(),
+            "premium_users_hll": self.premium_users.to_dict(),
+            "most_active_users": self.most_active_users.to_dict(),
+            "counts": dict(self.counts)
+        }
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        state = data["rollup"]
+        rollup = cls(data["date"], closed=state["closed"])
+        rollup.users = HyperLogLog.from_dict(state["users_hll"])
+        rollup.premium_users = HyperLogLog.from_dict(state["premium_users_hll"])
+        rollup.total_actions = data["total_actions"]
+        rollup.action_breakdown.update(data["action_breakdown"])
+        rollup.most_active_users = SpaceSaving.from_dict(state["most_active_users"])
+        rollup.counts.update(state["counts"])
+        return rollup
+
+# Event kinds that feed the daily rollups
+ROLLUP_KINDS = ["user_actions", "ai_chats", "pet_actions", "health_actions", "premium_actions"]
 
 class Analytics:
     def __init__(self):
         self.analytics_dir = "analytics"
         self.ensure_analytics_dir()
+        self.writer = JsonlWriter(
+            max_buffer=config.ANALYTICS_BUFFER_SIZE,
+            flush_interval=config.ANALYTICS_FLUSH_INTERVAL,
+            max_file_bytes=config.ANALYTICS_MAX_FILE_BYTES
+        )
+        self.closed_rollups = TTLCache(maxsize=config.ANALYTICS_ROLLUP_CACHE_DAYS, ttl=86400)
+        # Today's rollup is rebuilt once from raw events, then kept current as events arrive
+        self.rollup = self.build_rollup(date.today().isoformat())
+        self.store = AnalyticsStore(config.ANALYTICS_DB_PATH)
+        self.retention = RetentionPolicy(
+            self.analytics_dir,
+            raw_days=config.ANALYTICS_RAW_RETENTION_DAYS,
+            archive_days=config.ANALYTICS_ARCHIVE_RETENTION_DAYS,
+            store=self.store
+        )
+        self.sink = AnalyticsSink(
+            self.writer,
+            store=self.store,
+            capacity=config.ANALYTICS_QUEUE_SIZE,
+            batch_size=config.ANALYTICS_BUFFER_SIZE,
+            flush_interval=config.ANALYTICS_FLUSH_INTERVAL
+        )
         
     def ensure_analytics_dir(self):
         """Create analytics directory if it doesn't exist"""
@@ -16,7 +305,7 @@ class Analytics:
     def log_user_action(self, user_id, username, action, details=None):
         """Log user action to daily file"""
         today = date.today().isoformat()
-        log_file = f"{self.analytics_dir}/user_actions_{today}.json"
+        log_file = f"{self.analytics_dir}/user_actions_{today}.jsonl"
         
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -26,25 +315,12 @@ class Analytics:
             "details": details or {}
         }
         
-        # Append to daily log file
-        try:
-            if os.path.exists(log_file):
-                with open(log_file, 'r', encoding='utf-8') as f:
-                    logs = json.load(f)
-            else:
-                logs = []
-            
-            logs.append(log_entry)
-            
-            with open(log_file, 'w', encoding='utf-8') as f:
-                json.dump(logs, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Analytics logging error: {e}")
+        self.record("user_actions", log_file, log_entry)
     
     def log_ai_chat(self, user_id, username, message, response, is_premium=False):
         """Log AI chat interactions"""
         today = date.today().isoformat()
-        chat_file = f"{self.analytics_dir}/ai_chats_{today}.json"
+        chat_file = f"{self.analytics_dir}/ai_chats_{today}.jsonl"
         
         chat_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -57,24 +333,12 @@ class Analytics:
             "response_length": len(response)
         }
         
-        try:
-            if os.path.exists(chat_file):
-                with open(chat_file, 'r', encoding='utf-8') as f:
-                    chats = json.load(f)
-            else:
-                chats = []
-            
-            chats.append(chat_entry)
-            
-            with open(chat_file, 'w', encoding='utf-8') as f:
-                json.dump(chats, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Chat logging error: {e}")
+        self.record("ai_chats", chat_file, chat_entry)
     
     def log_pet_action(self, user_id, username, pet_action, pet_data=None):
         """Log pet-related actions"""
         today = date.today().isoformat()
-        pet_file = f"{self.analytics_dir}/pet_actions_{today}.json"
+        pet_file = f"{self.analytics_dir}/pet_actions_{today}.jsonl"
         
         pet_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -84,24 +348,12 @@ class Analytics:
             "pet_data": pet_data or {}
         }
         
-        try:
-            if os.path.exists(pet_file):
-                with open(pet_file, 'r', encoding='utf-8') as f:
-                    pets = json.load(f)
-            else:
-                pets = []
-            
-            pets.append(pet_entry)
-            
-            with open(pet_file, 'w', encoding='utf-8') as f:
-                json.dump(pets, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Pet logging error: {e}")
+        self.record("pet_actions", pet_file, pet_entry)
     
     def log_health_action(self, user_id, username, health_action, health_data=None):
         """Log health tracking actions"""
         today = date.today().isoformat()
-        health_file = f"{self.analytics_dir}/health_actions_{today}.json"
+        health_file = f"{self.analytics_dir}/health_actions_{today}.jsonl"
         
         health_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -111,24 +363,12 @@ class Analytics:
             "health_data": health_data or {}
         }
         
-        try:
-            if os.path.exists(health_file):
-                with open(health_file, 'r', encoding='utf-8') as f:
-                    health = json.load(f)
-            else:
-                health = []
-            
-            health.append(health_entry)
-            
-            with open(health_file, 'w', encoding='utf-8') as f:
-                json.dump(health, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Health logging error: {e}")
+        self.record("health_actions", health_file, health_entry)
     
     def log_premium_action(self, user_id, username, premium_action, details=None):
         """Log premium/subscription actions"""
         today = date.today().isoformat()
-        premium_file = f"{self.analytics_dir}/premium_actions_{today}.json"
+        premium_file = f"{self.analytics_dir}/premium_actions_{today}.jsonl"
         
         premium_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -138,125 +378,163 @@ class Analytics:
             "details": details or {}
         }
         
+        self.record("premium_actions", premium_file, premium_entry)
+    
+    def iter_records(self, kind, target_date):
+        """Stream one day's records of a kind: legacy JSON, archived and rotated segments, then the live file"""
+        self.writer.flush()
+        legacy_file = f"{self.analytics_dir}/{kind}_{target_date}.json"
+        
+        if os.path.exists(legacy_file):
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                yield from json.load(f)
+        for log_file in day_segments(self.analytics_dir, kind, target_date):
+            yield from read_jsonl(log_file)
+    
+    def flush(self):
+        """Write buffered records and today's rollup to disk (queued sink events land on its next batch)"""
+        self.writer.flush()
+        self.save_rollup(self.rollup)
+    
+    def start(self):
+        """Move logging onto the background sink; call from the running event loop"""
+        self.sink.start()
+    
+    async def stop(self):
+        """Drain the sink and flush everything to disk"""
+        await self.sink.stop()
+        self.flush()
+    
+    def record(self, kind, log_file, entry):
+        """Update the live rollup and hand the event to the sink"""
+        day = entry["timestamp"][:10]
+        if day != self.rollup.day:
+            self.close_rollup()
+        self.rollup.apply(kind, entry)
+        self.sink.put(kind, log_file, entry)
+    
+    def rollup_file(self, target_date):
+        return f"{self.analytics_dir}/daily_summary_{target_date}.json"
+    
+    def save_rollup(self, rollup):
+        """Persist a rollup as the day's summary file"""
         try:
-            if os.path.exists(premium_file):
-                with open(premium_file, 'r', encoding='utf-8') as f:
-                    premium = json.load(f)
-            else:
-                premium = []
-            
-            premium.append(premium_entry)
-            
-            with open(premium_file, 'w', encoding='utf-8') as f:
-                json.dump(premium, f, ensure_ascii=False, indent=2)
+            with open(self.rollup_file(rollup.day), 'w', encoding='utf-8') as f:
+                json.dump(rollup.to_dict(), f, ensure_ascii=False, indent=2)
         except Exception as e:
-            print(f"Premium logging error: {e}")
+            print(f"Rollup save error: {e}")
     
-    def generate_daily_summary(self, target_date=None):
-        """Generate daily analytics summary"""
-        if target_date is None:
-            target_date = date.today().isoformat()
-        
-        summary = {
-            "date": target_date,
-            "total_users": set(),
-            "total_actions": 0,
-            "action_breakdown": defaultdict(int),
-            "ai_chats": 0,
-            "pet_actions": 0,
-            "health_actions": 0,
-            "premium_actions": 0,
-            "new_users": 0,
-            "premium_users": set(),
-            "most_active_users": defaultdict(int)
-        }
-        
-        # Analyze user actions
-        user_file = f"{self.analytics_dir}/user_actions_{target_date}.json"
-        if os.path.exists(user_file):
-            with open(user_file, 'r', encoding='utf-8') as f:
-                actions = json.load(f)
-                for action in actions:
-                    summary["total_users"].add(action["user_id"])
-                    summary["total_actions"] += 1
-                    summary["action_breakdown"][action["action"]] += 1
-                    summary["most_active_users"][action["user_id"]] += 1
-        
-        # Analyze AI chats
-        chat_file = f"{self.analytics_dir}/ai_chats_{target_date}.json"
-        if os.path.exists(chat_file):
-            with open(chat_file, 'r', encoding='utf-8') as f:
-                chats = json.load(f)
-                summary["ai_chats"] = len(chats)
-                for chat in chats:
-                    summary["total_users"].add(chat["user_id"])
-                    if chat.get("is_premium"):
-                        summary["premium_users"].add(chat["user_id"])
-        
-        # Analyze pet actions
-        pet_file = f"{self.analytics_dir}/pet_actions_{target_date}.json"
-        if os.path.exists(pet_file):
-            with open(pet_file, 'r', encoding='utf-8') as f:
-                pets = json.load(f)
-                summary["pet_actions"] = len(pets)
-                for pet in pets:
-                    summary["total_users"].add(pet["user_id"])
-        
-        # Analyze health actions
-        health_file = f"{self.analytics_dir}/health_actions_{target_date}.json"
-        if os.path.exists(health_file):
-            with open(health_file, 'r', encoding='utf-8') as f:
-                health = json.load(f)
-                summary["health_actions"] = len(health)
-                for h in health:
-                    summary["total_users"].add(h["user_id"])
-        
-        # Analyze premium actions
-        premium_file = f"{self.analytics_dir}/premium_actions_{target_date}.json"
-        if os.path.exists(premium_file):
-            with open(premium_file, 'r', encoding='utf-8') as f:
-                premium = json.load(f)
-                summary["premium_actions"] = len(premium)
-                for p in premium:
-                    summary["total_users"].add(p["user_id"])
-                    if p["action"] in ["upgrade_to_premium", "start_trial"]:
-                        summary["premium_users"].add(p["user_id"])
+    def close_rollup(self):
+        """Freeze the current day's rollup and start a fresh one for today"""
+        self.rollup.closed = True
+        self.save_rollup(self.rollup)
+        self.closed_rollups.set(self.rollup.day, self.rollup)
+        self.rollup = DailyRollup(date.today().isoformat())
+    
+    def build_rollup(self, target_date):
+        """One-time rebuild of a day's rollup by streaming its raw events"""
+        rollup = DailyRollup(target_date, closed=target_date < date.today().isoformat())
+        for kind in ROLLUP_KINDS:
+            for entry in self.iter_records(kind, target_date):
+                rollup.apply(kind, entry)
+        return rollup
+    
+    def get_rollup(self, target_date):
+        """Rollup for a day: live for today, immutable and cached for closed days"""
+        if target_date == self.rollup.day:
+            return self.rollup
         
-        # Convert sets to counts
-        summary["total_users"] = len(summary["total_users"])
-        summary["premium_users"] = len(summary["premium_users"])
+        rollup = self.closed_rollups.get(target_date)
+        if rollup is not None:
+            return rollup
         
-        # Get top 5 most active users
-        summary["top_users"] = dict(sorted(summary["most_active_users"].items(), 
-                                         key=lambda x: x[1], reverse=True)[:5])
+        summary_file = self.rollup_file(target_date)
+        if os.path.exists(summary_file):
+            with open(summary_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Summaries written before sketch rollups existed lack state and are rebuilt
+            state = data.get("rollup", {})
+            if state.get("closed") and "users_hll" in state:
+                rollup = DailyRollup.from_dict(data)
         
-        # Save summary
-        summary_file = f"{self.analytics_dir}/daily_summary_{target_date}.json"
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+        if rollup is None:
+            rollup = self.build_rollup(target_date)
+            if rollup.closed:
+                self.save_rollup(rollup)
         
-        return summary
+        if rollup.closed:
+            self.closed_rollups.set(target_date, rollup)
+        return rollup
+    
+    def apply_retention(self):
+        """Archive and expire raw analytics per the retention policy"""
+        self.writer.flush()
+        stats = self.retention.apply()
+        if stats["archived"] or stats["expired"] or stats["pruned_events"]:
+            print(f"📦 Analytics retention: {stats}")
+        return stats
+    
+    async def run_retention(self, interval=config.ANALYTICS_RETENTION_INTERVAL):
+        """Background loop applying the retention policy off the event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.apply_retention)
+            except Exception as e:
+                print(f"Analytics retention error: {e}")
+            await asyncio.sleep(interval)
+    
+    def reset_rollups(self):
+        """Forget all rollups after the raw analytics data was cleared"""
+        self.closed_rollups.clear()
+        self.rollup = DailyRollup(date.today().isoformat())
+    
+    def generate_daily_summary(self, target_date=None):
+        """Generate daily analytics summary from the incremental rollups"""
+        if target_date is None:
+            target_date = date.today().isoformat()
+        return self.get_rollup(target_date).summary()
+    
+    def generate_period_summary(self, days=7):
+        """Summary for the last N days, merged from the daily sketches"""
+        today = date.today()
+        period = DailyRollup(f"{(today - timedelta(days=days - 1)).isoformat()}..{today.isoformat()}")
+        for i in range(days):
+            period.merge(self.get_rollup((today - timedelta(days=i)).isoformat()))
+        return period.summary()
     
     def get_function_popularity(self, days=7):
         """Get most popular functions over last N days"""
-        function_counts = defaultdict(int)
-        
-        for i in range(days):
-            target_date = (date.today() - timedelta(days=i)).isoformat()
-            user_file = f"{self.analytics_dir}/user_actions_{target_date}.json"
-            
-            if os.path.exists(user_file):
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    actions = json.load(f)
-                    for action in actions:
-                        function_counts[action["action"]] += 1
-        
-        return dict(sorted(function_counts.items(), key=lambda x: x[1], reverse=True))
+        end_day = date.today()
+        start_day = end_day - timedelta(days=days - 1)
+        return self.store.function_popularity(start_day.isoformat(), end_day.isoformat())
+    
+    def get_active_users(self, start_date, end_date, premium_only=False):
+        """Distinct active users between two ISO dates, inclusive"""
+        return self.store.active_users(start_date, end_date, premium_only)
+    
+    def get_ai_volume(self, start_date, end_date, by='day'):
+        """AI chat counts per day (or hour) between two ISO dates, inclusive"""
+        return self.store.ai_volume(start_date, end_date, by)
+    
+    def backfill_store(self):
+        """Import JSONL days not yet fully imported into the store; returns events imported"""
+        imported = 0
+        days = sorted({parse_segment(name)[:2] for name in os.listdir(self.analytics_dir)
+                       if parse_segment(name) and name.endswith(".jsonl")})
+        for kind, target_date in days:
+            if self.store.is_backfilled(target_date, kind):
+                continue
+            # The JSONL files hold every event of the day, so they replace whatever part is already stored
+            batch = [(kind, record) for record in self.iter_records(kind, target_date)]
+            self.store.replace_day(target_date, kind, batch)
+            imported += len(batch)
+        return imported
     
     def log_ai_performance(self, user_id, ai_type, performance_data):
         """Log AI performance metrics"""
         today = date.today().isoformat()
-        perf_file = f"{self.analytics_dir}/ai_performance_{today}.json"
+        perf_file = f"{self.analytics_dir}/ai_performance_{today}.jsonl"
         
         perf_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -269,24 +547,12 @@ class Analytics:
             "model": performance_data.get("model")
         }
         
-        try:
-            if os.path.exists(perf_file):
-                with open(perf_file, 'r', encoding='utf-8') as f:
-                    perfs = json.load(f)
-            else:
-                perfs = []
-            
-            perfs.append(perf_entry)
-            
-            with open(perf_file, 'w', encoding='utf-8') as f:
-                json.dump(perfs, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"AI performance logging error: {e}")
+        self.record("ai_performance", perf_file, perf_entry)
     
     def log_ai_error(self, user_id, ai_type, error_message):
         """Log AI errors"""
         today = date.today().isoformat()
-        error_file = f"{self.analytics_dir}/ai_errors_{today}.json"
+        error_file = f"{self.analytics_dir}/ai_errors_{today}.jsonl"
         
         error_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -295,24 +561,12 @@ class Analytics:
             "error_message": error_message
         }
         
-        try:
-            if os.path.exists(error_file):
-                with open(error_file, 'r', encoding='utf-8') as f:
-                    errors = json.load(f)
-            else:
-                errors = []
-            
-            errors.append(error_entry)
-            
-            with open(error_file, 'w', encoding='utf-8') as f:
-                json.dump(errors, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"AI error logging error: {e}")
+        self.record("ai_errors", error_file, error_entry)
     
     def update_ai_satisfaction(self, consultation_id, rating):
         """Update AI satisfaction rating"""
         today = date.today().isoformat()
-        satisfaction_file = f"{self.analytics_dir}/ai_satisfaction_{today}.json"
+        satisfaction_file = f"{self.analytics_dir}/ai_satisfaction_{today}.jsonl"
         
         satisfaction_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -320,24 +574,12 @@ class Analytics:
             "rating": rating
         }
         
-        try:
-            if os.path.exists(satisfaction_file):
-                with open(satisfaction_file, 'r', encoding='utf-8') as f:
-                    ratings = json.load(f)
-            else:
-                ratings = []
-            
-            ratings.append(satisfaction_entry)
-            
-            with open(satisfaction_file, 'w', encoding='utf-8') as f:
-                json.dump(ratings, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"AI satisfaction logging error: {e}")
+        self.record("ai_satisfaction", satisfaction_file, satisfaction_entry)
     
     def log_abuse_alert(self, user_id, usage_amount, limit):
         """Log abuse alerts"""
         today = date.today().isoformat()
-        abuse_file = f"{self.analytics_dir}/abuse_alerts_{today}.json"
+        abuse_file = f"{self.analytics_dir}/abuse_alerts_{today}.jsonl"
         
         abuse_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -347,19 +589,13 @@ class Analytics:
             "alert_type": "token_limit_exceeded"
         }
         
-        try:
-            if os.path.exists(abuse_file):
-                with open(abuse_file, 'r', encoding='utf-8') as f:
-                    alerts = json.load(f)
-            else:
-                alerts = []
-            
-            alerts.append(abuse_entry)
-            
-            with open(abuse_file, 'w', encoding='utf-8') as f:
-                json.dump(alerts, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Abuse alert logging error: {e}")
+        self.record("abuse_alerts", abuse_file, abuse_entry)
 
 # Global analytics instance
 analytics = Analytics()
+
+if __name__ == "__main__":
+    # One-shot conversion: python -m utils.analytics
+    analytics.flush()
+    print(f"Converted {convert_legacy_files(analytics.analytics_dir)} legacy analytics files to JSONL")
+    print(f"Imported {analytics.backfill_store()} events into the analytics database")
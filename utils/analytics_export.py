@@ -0,0 +1,83 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+import config
+from utils.analytics import read_jsonl
+
+def iter_days(start_day, end_day):
+    """ISO dates from start_day to end_day, inclusive"""
+    current = date.fromisoformat(start_day)
+    last = date.fromisoformat(end_day)
+    while current <= last:
+        yield current.isoformat()
+        current += timedelta(days=1)
+
+def csv_value(value):
+    """Flatten nested values so each record stays one CSV row"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+def write_records(records, out, fmt="jsonl"):
+    """Stream records into a text file object as JSONL or CSV; returns records written"""
+    count = 0
+    writer = None
+    for record in records:
+        if fmt == "csv":
+            if writer is None:
+                # Each kind is written by a single log method, so the first record's keys cover the rest
+                writer = csv.DictWriter(out, fieldnames=list(record), restval="", extrasaction="ignore")
+                writer.writeheader()
+            writer.writerow({key: csv_value(value) for key, value in record.items()})
+        else:
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        count += 1
+    return count
+
+def build_export(records, fmt="jsonl", compress=False):
+    """Spool an export to a temp file (in memory only while small); returns (file rewound to 0, records)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=config.ANALYTICS_EXPORT_SPOOL_BYTES)
+    raw = gzip.GzipFile(fileobj=spool, mode="wb") if compress else spool
+    # utf-8-sig so spreadsheet apps detect the encoding of Persian text in CSV
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="")
+    try:
+        count = write_records(records, text, fmt)
+        text.flush()
+    finally:
+        text.detach()
+    if compress:
+        raw.close()  # Writes the gzip trailer; the spool stays open
+    spool.seek(0)
+    return spool, count
+
+def iter_file_records(path):
+    """Stream records from a raw, archived or legacy analytics file"""
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+    else:
+        yield from read_jsonl(path)
+
+def count_records(path):
+    """Count records in an analytics file without loading it"""
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            return len(json.load(f))  # Legacy arrays are only readable whole
+    opener = gzip.open if path.endswith(".gz") else open
+    count = 0
+    with opener(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                count += 1
+    return count
+
+def export_size(fileobj):
+    """Size in bytes of a rewound export file"""
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
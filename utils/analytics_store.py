@@ -0,0 +1,202 @@
+import json
+from collections import Counter
+from utils.database import ConnectionPool, retry_on_busy
+import config
+
+class AnalyticsStore:
+    """SQLite analytics backend: raw events plus hourly/daily rollups maintained on insert"""
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.pool = ConnectionPool(
+            db_path,
+            size=2,
+            cached_statements=config.DATABASE_STATEMENT_CACHE_SIZE,
+            pragmas=config.DATABASE_PRAGMAS
+        )
+        self.init_db()
+    
+    def init_db(self):
+        """Create analytics tables"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Raw events, one row per logged analytics record
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT,
+                    day TEXT,
+                    kind TEXT,
+                    user_id INTEGER,
+                    action TEXT,
+                    is_premium BOOLEAN,
+                    payload TEXT
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_day_kind ON events(day, kind)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_user_day ON events(user_id, day)')
+            
+            # Event counts per hour / day, kind and action
+            for table, bucket in (('hourly_rollups', 'hour'), ('daily_rollups', 'day')):
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        {bucket} TEXT,
+                        kind TEXT,
+                        action TEXT,
+                        events INTEGER DEFAULT 0,
+                        PRIMARY KEY ({bucket}, kind, action)
+                    )
+                ''')
+            
+            # Distinct users per day, for active-user counts over any range
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_users (
+                    day TEXT,
+                    user_id INTEGER,
+                    events INTEGER DEFAULT 0,
+                    is_premium BOOLEAN DEFAULT FALSE,
+                    PRIMARY KEY (day, user_id)
+                )
+            ''')
+            
+            # Days fully imported from the JSONL files by backfill
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS backfilled_days (
+                    day TEXT,
+                    kind TEXT,
+                    imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (day, kind)
+                )
+            ''')
+    
+    @retry_on_busy
+    def insert_events(self, events):
+        """Insert (kind, record) pairs and fold them into the rollups in one transaction"""
+        with self.pool.connection() as conn:
+            self._insert_events(conn.cursor(), events)
+    
+    def _insert_events(self, cursor, events):
+        rows = []
+        hourly = Counter()
+        daily = Counter()
+        users = {}
+        for kind, record in events:
+            timestamp = record.get("timestamp", "")
+            day, hour = timestamp[:10], timestamp[:13]
+            user_id = record.get("user_id")
+            action = record.get("action") or record.get("ai_type") or ""
+            is_premium = bool(record.get("is_premium"))
+            rows.append((timestamp, day, kind, user_id, action, is_premium,
+                         json.dumps(record, ensure_ascii=False, default=str)))
+            hourly[(hour, kind, action)] += 1
+            daily[(day, kind, action)] += 1
+            if user_id is not None:
+                count, premium = users.get((day, user_id), (0, False))
+                users[(day, user_id)] = (count + 1, premium or is_premium)
+        
+        if not rows:
+            return
+        cursor.executemany('''
+            INSERT INTO events (timestamp, day, kind, user_id, action, is_premium, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        for table, bucket, counts in (('hourly_rollups', 'hour', hourly), ('daily_rollups', 'day', daily)):
+            cursor.executemany(f'''
+                INSERT INTO {table} ({bucket}, kind, action, events) VALUES (?, ?, ?, ?)
+                ON CONFLICT({bucket}, kind, action) DO UPDATE SET events = events + excluded.events
+            ''', [key + (count,) for key, count in counts.items()])
+        cursor.executemany('''
+            INSERT INTO daily_users (day, user_id, events, is_premium) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, user_id) DO UPDATE SET
+                events = events + excluded.events,
+                is_premium = MAX(is_premium, excluded.is_premium)
+        ''', [(day, user_id, count, premium) for (day, user_id), (count, premium) in users.items()])
+    
+    @retry_on_busy
+    def replace_day(self, day, kind, events):
+        """Swap a day's stored events of one kind for events, in one transaction, and mark the day imported"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Write lock up front, so live inserts can't land between the reads and the deletes
+            cursor.execute('BEGIN IMMEDIATE')
+            # Take back what the rows being replaced (e.g. a partial import or live writes) added to the rollups
+            cursor.execute('''
+                SELECT user_id, COUNT(*) FROM events
+                WHERE day = ? AND kind = ? AND user_id IS NOT NULL
+                GROUP BY user_id
+            ''', (day, kind))
+            cursor.executemany('UPDATE daily_users SET events = events - ? WHERE day = ? AND user_id = ?',
+                               [(count, day, user_id) for user_id, count in cursor.fetchall()])
+            cursor.execute('DELETE FROM daily_users WHERE day = ? AND events <= 0', (day,))
+            cursor.execute('DELETE FROM daily_rollups WHERE day = ? AND kind = ?', (day, kind))
+            cursor.execute("DELETE FROM hourly_rollups WHERE hour LIKE ? || '%' AND kind = ?", (day, kind))
+            cursor.execute('DELETE FROM events WHERE day = ? AND kind = ?', (day, kind))
+            self._insert_events(cursor, events)
+            cursor.execute('INSERT OR REPLACE INTO backfilled_days (day, kind) VALUES (?, ?)', (day, kind))
+    
+    @retry_on_busy
+    def prune_events(self, before_day):
+        """Delete raw events older than before_day (rollup tables are kept); returns rows removed"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM events WHERE day < ?', (before_day,))
+            removed = cursor.rowcount
+        return removed
+    
+    @retry_on_busy
+    def clear(self):
+        """Delete all raw events and rollups in one transaction"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for table in ('events', 'hourly_rollups', 'daily_rollups', 'daily_users', 'backfilled_days'):
+                cursor.execute(f'DELETE FROM {table}')
+    
+    def is_backfilled(self, day, kind):
+        """True once replace_day has imported this day and kind completely"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM backfilled_days WHERE day = ? AND kind = ?', (day, kind))
+            found = cursor.fetchone() is not None
+        return found
+    
+    def function_popularity(self, start_day, end_day):
+        """{action: count} of user actions between two ISO dates, inclusive"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT action, SUM(events) AS total FROM daily_rollups
+                WHERE kind = 'user_actions' AND day BETWEEN ? AND ?
+                GROUP BY action ORDER BY total DESC
+            ''', (start_day, end_day))
+            popularity = dict(cursor.fetchall())
+        return popularity
+    
+    def active_users(self, start_day, end_day, premium_only=False):
+        """Distinct users seen between two ISO dates, inclusive"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT COUNT(DISTINCT user_id) FROM daily_users
+                WHERE day BETWEEN ? AND ? {'AND is_premium = TRUE' if premium_only else ''}
+            ''', (start_day, end_day))
+            count = cursor.fetchone()[0]
+        return count
+    
+    def ai_volume(self, start_day, end_day, by='day'):
+        """[(bucket, chats)] of AI chats per day or hour between two ISO dates, inclusive"""
+        table, bucket = ('hourly_rollups', 'hour') if by == 'hour' else ('daily_rollups', 'day')
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # '~' sorts after 'T', so the upper bound covers every hour of end_day
+            cursor.execute(f'''
+                SELECT {bucket}, SUM(events) FROM {table}
+                WHERE {bucket} BETWEEN ? AND ? AND kind = 'ai_chats'
+                GROUP BY {bucket} ORDER BY {bucket}
+            ''', (start_day, end_day + '~'))
+            volume = cursor.fetchall()
+        return volume
+    
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
@@ -0,0 +1,130 @@
+import config
+
+# Columns of the compact health table: (health_history key, header)
+HEALTH_COLUMNS = [
+    ("date", "تاریخ"),
+    ("weight", "وزن"),
+    ("mood", "حالت"),
+    ("appetite", "اشتها"),
+    ("activity", "فعالیت"),
+    ("notes", "یادداشت"),
+]
+
+def count_tokens(text):
+    """Local token estimate that errs high: ~4 ASCII characters or ~2 Persian characters per token"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars + 1) // 2 + 1
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to fit max_tokens, marking the cut with an ellipsis"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ""
+    # Shrink proportionally, then trim until it fits
+    text = text[:max(1, len(text) * max_tokens // count_tokens(text))]
+    while text and count_tokens(text + "…") > max_tokens:
+        text = text[:-max(1, len(text) // 10)]
+    return text + "…" if text else ""
+
+def format_pet_profile(pet_info, max_tokens):
+    """One-line pet profile within the budget"""
+    if not pet_info:
+        return ""
+    fields = [
+        ("نوع", pet_info.get('species')),
+        ("نژاد", pet_info.get('breed')),
+        ("سن", f"{pet_info.get('age_years', 0)} سال و {pet_info.get('age_months', 0)} ماه"),
+        ("وزن", f"{pet_info['weight']} کیلوگرم" if pet_info.get('weight') else None),
+        ("جنسیت", pet_info.get('gender')),
+        ("بیماری‌ها", pet_info.get('diseases')),
+        ("داروها", pet_info.get('medications')),
+    ]
+    profile = f"{pet_info.get('name', 'حیوان خانگی')}: " + "، ".join(f"{label} {value}" for label, value in fields if value)
+    return truncate_to_tokens(profile, max_tokens)
+
+def compact_health_history(health_history, max_tokens, max_rows=None):
+    """Health logs (newest first) as a pipe-separated table, adding rows while they fit"""
+    if not health_history:
+        return ""
+    max_rows = max_rows or config.CHAT_HEALTH_ROWS
+    lines = ["|".join(header for _, header in HEALTH_COLUMNS)]
+    used = count_tokens(lines[0])
+    for log in health_history[:max_rows]:
+        cells = []
+        for key, _ in HEALTH_COLUMNS:
+            value = log.get(key)
+            value = f"{value:g}" if isinstance(value, float) else " ".join(str(value or "-").split())
+            if key == "notes":
+                value = truncate_to_tokens(value, config.CHAT_NOTE_TOKENS)
+            cells.append(value.replace("|", "/"))
+        row = "|".join(cells)
+        row_tokens = count_tokens(row) + 1
+        if used + row_tokens > max_tokens:
+            break
+        lines.append(row)
+        used += row_tokens
+    return "\n".join(lines) if len(lines) > 1 else ""
+
+def fit_dialogue(turns, max_tokens):
+    """Newest turns that fit the budget; older turns are folded into a one-line recap"""
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        turn_tokens = count_tokens(turn) + 1
+        if used + turn_tokens > max_tokens:
+            break
+        kept.append(turn)
+        used += turn_tokens
+    kept.reverse()
+    
+    dropped = turns[:len(turns) - len(kept)]
+    if dropped:
+        # Recap only what the user raised; while over budget, give up the oldest kept turn for it
+        topics = [turn.split(":", 1)[-1].strip() for turn in dropped if turn.startswith("کاربر:")]
+        recap = truncate_to_tokens("پیش‌تر کاربر گفته بود: " + " / ".join(topics), config.CHAT_RECAP_TOKENS) if topics else ""
+        while recap and kept and used + count_tokens(recap) + 1 > max_tokens:
+            used -= count_tokens(kept.pop(0)) + 1
+        if recap and used + count_tokens(recap) + 1 <= max_tokens:
+            kept.insert(0, recap)
+    return "\n".join(kept)
+
+def prompt_budget(max_tokens):
+    """Prompt tokens allowed for a call that may generate max_tokens"""
+    return min(config.CHAT_PROMPT_TOKENS, config.OPENAI_CONTEXT_WINDOW - max_tokens)
+
+def build_chat_context(user_message, pet_info, health_history, dialogue, budget, summary=""):
+    """Fit the variable parts of a chat prompt into budget tokens: user message, summary, pet profile, health, then dialogue"""
+    # The new message always goes in, but can't crowd out everything else
+    user_message = truncate_to_tokens(user_message, budget // 2)
+    remaining = budget - count_tokens(user_message)
+    
+    summary = truncate_to_tokens(summary or "", min(config.CHAT_SUMMARY_TOKENS, remaining // 2))
+    remaining -= count_tokens(summary)
+    
+    pet = format_pet_profile(pet_info, int(remaining * config.CHAT_PET_SHARE))
+    remaining -= count_tokens(pet)
+    
+    health = compact_health_history(health_history, int(remaining * config.CHAT_HEALTH_SHARE))
+    remaining -= count_tokens(health)
+    
+    # Dialogue takes whatever the other sections left unused
+    dialogue_text = fit_dialogue(dialogue, remaining)
+    return {
+        "user_message": user_message,
+        "summary": summary,
+        "pet": pet,
+        "health": health,
+        "dialogue": dialogue_text
+    }
+
+def trim_history(turns, max_tokens):
+    """Drop the oldest stored turns once the history exceeds max_tokens"""
+    total = sum(count_tokens(turn) for turn in turns)
+    start = 0
+    while total > max_tokens and start < len(turns) - 1:
+        total -= count_tokens(turns[start])
+        start += 1
+    return turns[start:]
@@ -1,280 +1,548 @@
 import sqlite3
+import json
 import asyncio
+import queue
+import random
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from utils.cache import TTLCache
 import config
 
-class Database:
-    def __init__(self):
-        self.db_path = config.DATABASE_PATH
-        self.init_db()
+def is_busy_error(error):
+    """True for SQLITE_BUSY / SQLITE_LOCKED failures worth retrying"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+def retry_on_busy(func):
+    """Retry a database write with exponential backoff while the file is locked"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(config.DATABASE_BUSY_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == config.DATABASE_BUSY_RETRIES:
+                    raise
+                delay = config.DATABASE_BUSY_BACKOFF * (2 ** attempt)
+                print(f"Database busy in {func.__name__}, retrying in {delay:.2f}s")
+                time.sleep(delay + random.uniform(0, delay))
+    return wrapper
+
+# Managed secondary indexes, matched to the WHERE / ORDER BY shape of each hot query
+# (ai_usage and subscriptions are already covered by their UNIQUE constraints)
+INDEXES = {
+    'idx_pets_user': 'pets(user_id)',
+    'idx_health_logs_pet_date': 'health_logs(pet_id, date)',
+    'idx_task_logs_pet_type_completed': 'task_logs(pet_id, task_type, completed_at)',
+    'idx_ai_performance_timestamp': 'ai_performance(timestamp)',
+    'idx_diet_plans_pet_created': 'diet_plans(pet_id, created_at)',
+    'idx_diet_plans_user_created': 'diet_plans(user_id, created_at)',
+    'idx_ai_learning_patterns_pet_updated': 'ai_learning_patterns(pet_id, last_updated)',
+    'idx_ai_feedback_pet': 'ai_feedback(pet_id)',
+    'idx_ai_insights_pet_date': 'ai_insights(pet_id, log_date)',
+    'idx_ai_sessions_pet_date': 'ai_sessions(pet_id, log_date)',
+}
+
+# Hot queries that must stay index-backed (label, sql, sample params)
+HOT_QUERIES = [
+    ('user pets', 'SELECT * FROM pets WHERE user_id = ?', (0,)),
+    ('pet health logs', 'SELECT * FROM health_logs WHERE pet_id = ? ORDER BY date DESC LIMIT ?', (0, 10)),
+    ('health log window', "SELECT * FROM health_logs WHERE pet_id = ? AND date >= date('now', ?) ORDER BY date DESC", (0, '-30 days')),
+    ('last task', 'SELECT completed_at FROM task_logs WHERE pet_id = ? AND task_type = ? ORDER BY completed_at DESC LIMIT 1', (0, '')),
+    ('ai usage', 'SELECT message_count FROM ai_usage WHERE user_id = ? AND usage_date = ?', (0, '')),
+    ('subscription', 'SELECT * FROM subscriptions WHERE user_id = ?', (0,)),
+    ('daily ai cost', "SELECT SUM(cost) FROM ai_performance WHERE timestamp >= DATE('now')", ()),
+    ('pet diet plans', 'SELECT * FROM diet_plans WHERE pet_id = ? ORDER BY created_at DESC LIMIT ?', (0, 5)),
+    ('active diet plan', 'SELECT * FROM diet_plans WHERE pet_id = ? AND is_active = TRUE ORDER BY created_at DESC LIMIT 1', (0,)),
+    ('user diet plans', 'SELECT * FROM diet_plans WHERE user_id = ? ORDER BY created_at DESC LIMIT ?', (0, 10)),
+    ('learning patterns', 'SELECT * FROM ai_learning_patterns WHERE pet_id = ? ORDER BY last_updated DESC', (0,)),
+]
+
+class ConnectionPool:
+    """Pool of long-lived SQLite connections shared by all Database calls"""
     
-    def init_db(self):
-        """Initialize database with tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Pets table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS pets (
-                pet_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                name TEXT NOT NULL,
-                species TEXT NOT NULL,
-                breed TEXT,
-                age_years INTEGER,
-                age_months INTEGER,
-                weight REAL,
-                gender TEXT,
-                is_neutered BOOLEAN,
-                diseases TEXT,
-                medications TEXT,
-                vaccine_status TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Enhanced Health logs table with learning capabilities
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS health_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            pet_id INTEGER,
-            date TEXT,
+    def __init__(self, db_path, size=5, cached_statements=128, pragmas=None):
+        self.db_path = db_path
+        self.size = size
+        self.cached_statements = cached_statements
+        self.pragmas = pragmas or {}
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._closed = False
+    
+    def _connect(self):
+        """Open a new connection; prepared statements are cached per connection"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+    
+    def acquire(self):
+        """Take an idle connection or open a new one when the pool is empty"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def release(self, conn):
+        """Return connection to the pool, closing it if the pool is full"""
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error"""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close all idle connections"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+def add_column_if_missing(cursor, table, column, definition):
+    """ALTER TABLE ADD COLUMN that tolerates databases which already have it"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def migrate_baseline_tables(cursor):
+    """Migration 1: core tables that used to be created by init_db"""
+    
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Pets table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pets (
+            pet_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            species TEXT NOT NULL,
+            breed TEXT,
+            age_years INTEGER,
+            age_months INTEGER,
             weight REAL,
-            food_type TEXT,
-            food_intake_notes TEXT,
-            diet_changes TEXT,
-            mood TEXT,
-            stool_info TEXT,
-            appetite TEXT,
-            water_intake TEXT,
-            activity_level TEXT,
-            activity_duration INTEGER,
-            activity_changes TEXT,
-            sleep_hours INTEGER,
-            sleep_quality TEXT,
+            gender TEXT,
+            is_neutered BOOLEAN,
+            diseases TEXT,
+            medications TEXT,
+            vaccine_status TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # Enhanced Health logs table with learning capabilities
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS health_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pet_id INTEGER,
+        date TEXT,
+        weight REAL,
+        food_type TEXT,
+        food_intake_notes TEXT,
+        diet_changes TEXT,
+        mood TEXT,
+        stool_info TEXT,
+        appetite TEXT,
+        water_intake TEXT,
+        activity_level TEXT,
+        activity_duration INTEGER,
+        activity_changes TEXT,
+        sleep_hours INTEGER,
+        sleep_quality TEXT,
+        notes TEXT,
+        symptoms TEXT,
+        medication_taken BOOLEAN,
+        temperature TEXT,
+        breathing TEXT,
+        blood_test_image TEXT,
+        vet_note_image TEXT,
+        pet_image TEXT,
+        ai_analysis TEXT,
+        risk_factors TEXT,
+        correlation_flags TEXT,
+        FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+    )
+    ''')
+    
+    # AI feedback table for learning
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_feedback (
+            feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            pet_id INTEGER,
+            consultation_id TEXT,
+            ai_type TEXT,
+            rating INTEGER,
+            feedback_type TEXT,
+            detailed_feedback TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+        )
+    ''')
+    
+    # AI learning patterns table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_learning_patterns (
+            pattern_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pet_id INTEGER,
+            pattern_type TEXT,
+            pattern_data TEXT,
+            confidence_score REAL,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+        )
+    ''')
+    
+    # Task tracking table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_logs (
+            task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pet_id INTEGER,
+            task_type TEXT NOT NULL,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             notes TEXT,
+            FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+        )
+    ''')
+    
+    # Subscriptions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            is_premium BOOLEAN DEFAULT FALSE,
+            subscription_type TEXT,
+            start_date TIMESTAMP,
+            end_date TIMESTAMP,
+            payment_reference TEXT,
+            is_trial BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # AI usage tracking table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_usage (
+            usage_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            usage_date DATE,
+            message_count INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            UNIQUE(user_id, usage_date)
+        )
+    ''')
+    
+    # Diet plans table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diet_plans (
+            plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            pet_id INTEGER,
+            diet_type TEXT,
+            goal TEXT,
+            allergies TEXT,
+            budget TEXT,
+            preference TEXT,
+            generated_plan TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+        )
+    ''')
+    
+    # AI insights table - stores AI analysis results
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_insights (
+            insight_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pet_id INTEGER,
+            log_date TEXT,
+            ai_summary TEXT,
+            extracted_tags TEXT,
+            risk_score INTEGER,
+            model_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+        )
+    ''')
+    
+    # AI chat sessions table - stores complete chat interactions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_sessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            pet_id INTEGER,
+            log_date TEXT,
+            user_message TEXT,
+            ai_response TEXT,
+            model_name TEXT,
+            session_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
+        )
+    ''')
+    
+    # AI performance table - token usage and cost per request
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_performance (
+            performance_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            ai_type TEXT,
+            consultation_id TEXT,
+            tokens_used INTEGER,
+            cost REAL,
+            response_time REAL,
+            model TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+def migrate_lazy_tables(cursor):
+    """Migration 2: tables and columns previously created inside write paths"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diagnosis_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pet_id INTEGER,
             symptoms TEXT,
-            medication_taken BOOLEAN,
-            temperature TEXT,
-            breathing TEXT,
-            blood_test_image TEXT,
-            vet_note_image TEXT,
-            pet_image TEXT,
-            ai_analysis TEXT,
-            risk_factors TEXT,
-            correlation_flags TEXT,
+            diagnosis TEXT,
+            treatment TEXT,
+            outcome TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
         )
-        ''')
-        
-        # AI feedback table for learning
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_feedback (
-                feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                pet_id INTEGER,
-                consultation_id TEXT,
-                ai_type TEXT,
-                rating INTEGER,
-                feedback_type TEXT,
-                detailed_feedback TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        
-        # AI learning patterns table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_learning_patterns (
-                pattern_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pet_id INTEGER,
-                pattern_type TEXT,
-                pattern_data TEXT,
-                confidence_score REAL,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        
-        # Task tracking table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS task_logs (
-                task_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pet_id INTEGER,
-                task_type TEXT NOT NULL,
-                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notes TEXT,
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        
-        # Subscriptions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE,
-                is_premium BOOLEAN DEFAULT FALSE,
-                subscription_type TEXT,
-                start_date TIMESTAMP,
-                end_date TIMESTAMP,
-                payment_reference TEXT,
-                is_trial BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # AI usage tracking table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_usage (
-                usage_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                usage_date DATE,
-                message_count INTEGER DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                UNIQUE(user_id, usage_date)
-            )
-        ''')
-        
-        # Diet plans table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diet_plans (
-                plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                pet_id INTEGER,
-                diet_type TEXT,
-                goal TEXT,
-                allergies TEXT,
-                budget TEXT,
-                preference TEXT,
-                generated_plan TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        
-        # AI insights table - stores AI analysis results
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_insights (
-                insight_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pet_id INTEGER,
-                log_date TEXT,
-                ai_summary TEXT,
-                extracted_tags TEXT,
-                risk_score INTEGER,
-                model_name TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        
-        # AI chat sessions table - stores complete chat interactions
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_sessions (
-                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                pet_id INTEGER,
-                log_date TEXT,
-                user_message TEXT,
-                ai_response TEXT,
-                model_name TEXT,
-                session_type TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id),
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+    ''')
     
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS abuse_alerts (
+            alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            usage_amount INTEGER,
+            daily_limit INTEGER,
+            alert_type TEXT DEFAULT 'token_limit_exceeded',
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    
+    # store_ai_feedback writes consultation_mode, which the baseline table lacked
+    add_column_if_missing(cursor, 'ai_feedback', 'consultation_mode', 'TEXT')
+
+def migrate_health_log_dates(cursor):
+    """Migration 3: log_date column used by the ML dataset joins"""
+    add_column_if_missing(cursor, 'health_logs', 'log_date', 'TEXT')
+    cursor.execute('UPDATE health_logs SET log_date = date WHERE log_date IS NULL')
+
+def migrate_session_memory(cursor):
+    """Migration 4: rolling chat memory (summary plus recent turns) per user and pet"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_session_memory (
+            user_id INTEGER,
+            pet_id INTEGER DEFAULT 0,
+            summary TEXT DEFAULT '',
+            recent_turns TEXT DEFAULT '[]',
+            summarized_turns INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, pet_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+# Ordered schema migrations (version, description, function); append only
+MIGRATIONS = [
+    (1, 'baseline tables', migrate_baseline_tables),
+    (2, 'tables created lazily by write paths', migrate_lazy_tables),
+    (3, 'health_logs.log_date with backfill', migrate_health_log_dates),
+    (4, 'ai_session_memory for rolling chat summaries', migrate_session_memory),
+]
+
+class Database:
+    def __init__(self):
+        self.db_path = config.DATABASE_PATH
+        self.pool = ConnectionPool(
+            self.db_path,
+            size=config.DATABASE_POOL_SIZE,
+            cached_statements=config.DATABASE_STATEMENT_CACHE_SIZE,
+            pragmas=config.DATABASE_PRAGMAS
+        )
+        # user_id -> (pets, {pet_id: pet}); invalidated whenever a user's pets change
+        self.pets_cache = TTLCache(maxsize=config.PETS_CACHE_SIZE, ttl=config.PETS_CACHE_TTL)
+        self.init_db()
+    
+    def connection(self):
+        """Context manager giving a pooled connection"""
+        return self.pool.connection()
+    
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
+    
+    def init_db(self):
+        """Run pending schema migrations once, then ensure the managed indexes"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+            current_version = cursor.fetchone()[0]
+            
+            for version, description, migrate in MIGRATIONS:
+                if version <= current_version:
+                    continue
+                # sqlite3 opens no implicit transaction for DDL; begin one so the schema changes
+                # and the version row commit together (an error rolls both back on the way out)
+                cursor.execute('BEGIN IMMEDIATE')
+                migrate(cursor)
+                cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                             (version, description))
+                conn.commit()
+                print(f"🗄️ Applied schema migration {version}: {description}")
+            
+            # Secondary indexes for hot query paths
+            for name, definition in INDEXES.items():
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+    
+    def check_query_plans(self):
+        """Return hot queries whose plan falls back to a table scan or temp sort"""
+        regressions = []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            for label, sql, params in HOT_QUERIES:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                details = [row[-1] for row in cursor.fetchall()]
+                bad = [d for d in details if d.startswith('SCAN') or 'TEMP B-TREE' in d]
+                if bad:
+                    regressions.append((label, bad))
+        return regressions
+    
+    @retry_on_busy
     def add_user(self, user_id, username):
         """Add new user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', 
-                      (user_id, username))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', 
+                          (user_id, username))
     
+    @retry_on_busy
     def add_pet(self, user_id, pet_data):
         """Add new pet"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO pets (user_id, name, species, breed, age_years, age_months, 
-                            weight, gender, is_neutered, diseases, medications, vaccine_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, pet_data['name'], pet_data['species'], pet_data['breed'],
-              pet_data['age_years'], pet_data['age_months'], pet_data['weight'],
-              pet_data['gender'], pet_data['is_neutered'], pet_data['diseases'],
-              pet_data['medications'], pet_data['vaccine_status']))
-        pet_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO pets (user_id, name, species, breed, age_years, age_months, 
+                                weight, gender, is_neutered, diseases, medications, vaccine_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, pet_data['name'], pet_data['species'], pet_data['breed'],
+                  pet_data['age_years'], pet_data['age_months'], pet_data['weight'],
+                  pet_data['gender'], pet_data['is_neutered'], pet_data['diseases'],
+                  pet_data['medications'], pet_data['vaccine_status']))
+            pet_id = cursor.lastrowid
+        self.invalidate_user_pets(user_id)
         return pet_id
     
+    def _load_user_pets(self, user_id):
+        """Read-through load of a user's pets and their pet_id index"""
+        cached = self.pets_cache.get(user_id)
+        if cached is None:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM pets WHERE user_id = ?', (user_id,))
+                pets = cursor.fetchall()
+            cached = (pets, {pet[0]: pet for pet in pets})
+            self.pets_cache.set(user_id, cached)
+        return cached
+    
     def get_user_pets(self, user_id):
         """Get all pets for user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM pets WHERE user_id = ?', (user_id,))
-        pets = cursor.fetchall()
-        conn.close()
-        return pets
+        return list(self._load_user_pets(user_id)[0])
+    
+    def get_user_pet(self, user_id, pet_id):
+        """Get one of the user's pets by id, or None if it isn't theirs"""
+        return self._load_user_pets(user_id)[1].get(pet_id)
+    
+    def invalidate_user_pets(self, user_id):
+        """Forget cached pets after any insert, edit or delete of the user's pets"""
+        self.pets_cache.invalidate(user_id)
     
+    @retry_on_busy
     def add_health_log(self, pet_id, health_data):
         """Add health log entry with image support"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO health_logs (pet_id, date, weight, food_type, food_intake_notes, diet_changes,
-                                   mood, stool_info, appetite, water_intake, activity_level, activity_duration,
-                                   activity_changes, sleep_hours, sleep_quality, notes, symptoms, 
-                                   medication_taken, temperature, breathing, blood_test_image, 
-                                   vet_note_image, pet_image)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            pet_id, 
-            datetime.now().strftime('%Y-%m-%d'), 
-            health_data.get('weight'), 
-            health_data.get('food_type', 'عادی'),
-            health_data.get('food_intake_notes', ''),
-            health_data.get('diet_changes', ''),
-            health_data.get('mood'), 
-            health_data.get('stool_info'), 
-            health_data.get('appetite', ''),
-            health_data.get('water_intake', ''),
-            health_data.get('activity_level'),
-            health_data.get('activity_duration', 0),
-            health_data.get('activity_changes', ''),
-            health_data.get('sleep_hours', 8), 
-            health_data.get('sleep_quality', ''),
-            health_data.get('notes', ''),
-            health_data.get('symptoms', 'ندارد'),
-            health_data.get('medication_taken', False),
-            health_data.get('temperature', ''),
-            health_data.get('breathing', ''),
-            health_data.get('blood_test_image', ''),
-            health_data.get('vet_note_image', ''),
-            health_data.get('pet_image', '')
-        ))
-        conn.commit()
-        conn.close()
+        log_date = datetime.now().strftime('%Y-%m-%d')
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO health_logs (pet_id, date, weight, food_type, food_intake_notes, diet_changes,
+                                       mood, stool_info, appetite, water_intake, activity_level, activity_duration,
+                                       activity_changes, sleep_hours, sleep_quality, notes, symptoms, 
+                                       medication_taken, temperature, breathing, blood_test_image, 
+                                       vet_note_image, pet_image, log_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                pet_id, 
+                log_date, 
+                health_data.get('weight'), 
+                health_data.get('food_type', 'عادی'),
+                health_data.get('food_intake_notes', ''),
+                health_data.get('diet_changes', ''),
+                health_data.get('mood'), 
+                health_data.get('stool_info'), 
+                health_data.get('appetite', ''),
+                health_data.get('water_intake', ''),
+                health_data.get('activity_level'),
+                health_data.get('activity_duration', 0),
+                health_data.get('activity_changes', ''),
+                health_data.get('sleep_hours', 8), 
+                health_data.get('sleep_quality', ''),
+                health_data.get('notes', ''),
+                health_data.get('symptoms', 'ندارد'),
+                health_data.get('medication_taken', False),
+                health_data.get('temperature', ''),
+                health_data.get('breathing', ''),
+                health_data.get('blood_test_image', ''),
+                health_data.get('vet_note_image', ''),
+                health_data.get('pet_image', ''),
+                log_date
+            ))
     
     def save_image(self, file_id, image_type, pet_id=None):
         """Save image file_id for later retrieval"""
@@ -283,80 +551,62 @@ class Database:
     
     def get_ml_training_data(self):
         """Get all health data for ML training"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT h.*, p.species, p.breed, p.age_years, p.weight as base_weight, p.gender
-            FROM health_logs h
-            JOIN pets p ON h.pet_id = p.pet_id
-            ORDER BY h.date DESC
-        ''')
-        data = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT h.*, p.species, p.breed, p.age_years, p.weight as base_weight, p.gender
+                FROM health_logs h
+                JOIN pets p ON h.pet_id = p.pet_id
+                ORDER BY h.date DESC
+            ''')
+            data = cursor.fetchall()
         return data
     
+    @retry_on_busy
     def add_diagnosis_record(self, pet_id, symptoms, diagnosis, treatment, outcome):
         """Add diagnosis record for ML training"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS diagnosis_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pet_id INTEGER,
-                symptoms TEXT,
-                diagnosis TEXT,
-                treatment TEXT,
-                outcome TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (pet_id) REFERENCES pets (pet_id)
-            )
-        ''')
-        cursor.execute('''
-            INSERT INTO diagnosis_records (pet_id, symptoms, diagnosis, treatment, outcome)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (pet_id, symptoms, diagnosis, treatment, outcome))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO diagnosis_records (pet_id, symptoms, diagnosis, treatment, outcome)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (pet_id, symptoms, diagnosis, treatment, outcome))
     
     def get_pet_health_logs(self, pet_id, limit=10):
         """Get recent health logs for pet"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM health_logs WHERE pet_id = ? ORDER BY date DESC LIMIT ?', 
-                      (pet_id, limit))
-        logs = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM health_logs WHERE pet_id = ? ORDER BY date DESC LIMIT ?', 
+                          (pet_id, limit))
+            logs = cursor.fetchall()
         return logs
     
+    @retry_on_busy
     def log_task(self, pet_id, task_type, notes=""):
         """Log completed task"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO task_logs (pet_id, task_type, notes) VALUES (?, ?, ?)',
-                      (pet_id, task_type, notes))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('INSERT INTO task_logs (pet_id, task_type, notes) VALUES (?, ?, ?)',
+                          (pet_id, task_type, notes))
     
     def get_last_task(self, pet_id, task_type):
         """Get last completion time for specific task"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT completed_at FROM task_logs WHERE pet_id = ? AND task_type = ? ORDER BY completed_at DESC LIMIT 1',
-                      (pet_id, task_type))
-        result = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT completed_at FROM task_logs WHERE pet_id = ? AND task_type = ? ORDER BY completed_at DESC LIMIT 1',
+                          (pet_id, task_type))
+            result = cursor.fetchone()
         return result[0] if result else None
     
     def get_task_streak(self, pet_id, task_type):
         """Get consecutive days of task completion"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''SELECT DATE(completed_at) as task_date FROM task_logs 
-                         WHERE pet_id = ? AND task_type = ? 
-                         ORDER BY completed_at DESC LIMIT 30''',
-                      (pet_id, task_type))
-        dates = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT DATE(completed_at) as task_date FROM task_logs 
+                             WHERE pet_id = ? AND task_type = ? 
+                             ORDER BY completed_at DESC LIMIT 30''',
+                          (pet_id, task_type))
+            dates = [row[0] for row in cursor.fetchall()]
         
         if not dates:
             return 0
@@ -378,35 +628,27 @@ class Database:
         return streak
     
     def get_user_subscription(self, user_id):
-        """Get user subscription status"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM subscriptions WHERE user_id = ?', (user_id,))
-        subscription = cursor.fetchone()
-        conn.close()
+        """Get user subscription status (read only; expiry is handled by expire_subscriptions)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM subscriptions WHERE user_id = ?', (user_id,))
+            subscription = cursor.fetchone()
+        
+        free = {
+            'is_premium': False,
+            'subscription_type': 'free',
+            'is_trial': False,
+            'end_date': None
+        }
         
         if not subscription:
-            # Create default free subscription
-            self.create_subscription(user_id, is_premium=False)
-            return {
-                'is_premium': False,
-                'subscription_type': 'free',
-                'is_trial': False,
-                'end_date': None
-            }
+            return free
         
-        # Check if subscription is still valid
+        # An expired row reads as free until the sweep downgrades it
         if subscription[5]:  # end_date exists
             end_date = datetime.strptime(subscription[5], '%Y-%m-%d %H:%M:%S')
             if datetime.now() > end_date:
-                # Subscription expired, downgrade to free
-                self.update_subscription(user_id, is_premium=False, subscription_type='free')
-                return {
-                    'is_premium': False,
-                    'subscription_type': 'free',
-                    'is_trial': False,
-                    'end_date': None
-                }
+                return free
         
         return {
             'is_premium': bool(subscription[2]),
@@ -416,41 +658,50 @@ class Database:
             'start_date': subscription[4]
         }
     
+    @retry_on_busy
+    def expire_subscriptions(self):
+        """Downgrade premium subscriptions past their end date; returns affected user ids"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id FROM subscriptions
+                WHERE is_premium = TRUE AND end_date IS NOT NULL AND end_date < ?
+            ''', (now,))
+            user_ids = [row[0] for row in cursor.fetchall()]
+            if user_ids:
+                cursor.execute(f'''
+                    UPDATE subscriptions SET is_premium = FALSE, subscription_type = 'free', updated_at = ?
+                    WHERE user_id IN ({", ".join("?" * len(user_ids))})
+                ''', [now] + user_ids)
+        return user_ids
+    
+    @retry_on_busy
     def create_subscription(self, user_id, is_premium=False, subscription_type='free', 
                           start_date=None, end_date=None, payment_reference=None, is_trial=False):
         """Create new subscription"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        self._create_subscription(user_id, is_premium, subscription_type, start_date, end_date,
+                                  payment_reference, is_trial)
+    
+    def _create_subscription(self, user_id, is_premium=False, subscription_type='free', 
+                           start_date=None, end_date=None, payment_reference=None, is_trial=False):
+        # Not retried itself: callers already run under retry_on_busy, and nesting would multiply the retries
         if start_date is None:
             start_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO subscriptions 
-            (user_id, is_premium, subscription_type, start_date, end_date, payment_reference, is_trial, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, is_premium, subscription_type, start_date, end_date, payment_reference, is_trial, 
-              datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO subscriptions 
+                (user_id, is_premium, subscription_type, start_date, end_date, payment_reference, is_trial, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, is_premium, subscription_type, start_date, end_date, payment_reference, is_trial, 
+                  datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     
+    @retry_on_busy
     def update_subscription(self, user_id, is_premium=None, subscription_type=None, 
                           end_date=None, payment_reference=None, is_trial=None):
         """Update existing subscription"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get current subscription
-        cursor.execute('SELECT * FROM subscriptions WHERE user_id = ?', (user_id,))
-        current = cursor.fetchone()
-        
-        if not current:
-            # Create new subscription if doesn't exist
-            self.create_subscription(user_id, is_premium or False, subscription_type or 'free')
-            conn.close()
-            return
-        
         # Update only provided fields
         updates = []
         values = []
@@ -480,16 +731,22 @@ class Database:
         
         values.append(user_id)
         
-        cursor.execute(f'UPDATE subscriptions SET {", ".join(updates)} WHERE user_id = ?', values)
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'UPDATE subscriptions SET {", ".join(updates)} WHERE user_id = ?', values)
+            updated = cursor.rowcount
+        
+        if not updated:
+            # Create new subscription if doesn't exist
+            self._create_subscription(user_id, is_premium or False, subscription_type or 'free')
     
+    @retry_on_busy
     def start_trial(self, user_id):
         """Start 7-day trial for user"""
         from datetime import timedelta
         
         end_date = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-        self.create_subscription(
+        self._create_subscription(
             user_id=user_id,
             is_premium=True,
             subscription_type='trial',
@@ -497,12 +754,13 @@ class Database:
             is_trial=True
         )
     
+    @retry_on_busy
     def upgrade_to_premium(self, user_id, payment_reference, duration_months=1):
         """Upgrade user to premium"""
         from datetime import timedelta
         
         end_date = (datetime.now() + timedelta(days=30 * duration_months)).strftime('%Y-%m-%d %H:%M:%S')
-        self.create_subscription(
+        self._create_subscription(
             user_id=user_id,
             is_premium=True,
             subscription_type='premium',
@@ -513,389 +771,434 @@ class Database:
     
     def get_ai_usage(self, user_id):
         """Get today's AI usage for user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('SELECT message_count FROM ai_usage WHERE user_id = ? AND usage_date = ?', 
-                      (user_id, today))
-        result = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            today = datetime.now().strftime('%Y-%m-%d')
+            cursor.execute('SELECT message_count FROM ai_usage WHERE user_id = ? AND usage_date = ?', 
+                          (user_id, today))
+            result = cursor.fetchone()
         
         return result[0] if result else 0
     
+    @retry_on_busy
     def increment_ai_usage(self, user_id):
         """Increment AI usage for today"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('''
-            INSERT OR REPLACE INTO ai_usage (user_id, usage_date, message_count)
-            VALUES (?, ?, COALESCE((SELECT message_count FROM ai_usage WHERE user_id = ? AND usage_date = ?), 0) + 1)
-        ''', (user_id, today, user_id, today))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            today = datetime.now().strftime('%Y-%m-%d')
+            cursor.execute('''
+                INSERT OR REPLACE INTO ai_usage (user_id, usage_date, message_count)
+                VALUES (?, ?, COALESCE((SELECT message_count FROM ai_usage WHERE user_id = ? AND usage_date = ?), 0) + 1)
+            ''', (user_id, today, user_id, today))
+    
+    def get_ai_usage_on(self, usage_date):
+        """Get {user_id: message_count} for one day"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id, message_count FROM ai_usage WHERE usage_date = ?', (usage_date,))
+            usage = dict(cursor.fetchall())
+        return usage
+    
+    @retry_on_busy
+    def save_ai_usage(self, rows):
+        """Batch upsert (user_id, usage_date, message_count) rows; counts never go down"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO ai_usage (user_id, usage_date, message_count) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, usage_date) DO UPDATE SET
+                    message_count = MAX(message_count, excluded.message_count)
+            ''', rows)
     
+    def get_session_memory(self, user_id, pet_id):
+        """Get (summary, recent turns, turns summarized so far) for a chat session"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT summary, recent_turns, summarized_turns FROM ai_session_memory
+                WHERE user_id = ? AND pet_id = ?
+            ''', (user_id, pet_id))
+            row = cursor.fetchone()
+        if not row:
+            return "", [], 0
+        return row[0] or "", json.loads(row[1] or "[]"), row[2] or 0
+    
+    @retry_on_busy
+    def save_session_memory(self, user_id, pet_id, summary, recent_turns, summarized_turns):
+        """Upsert a chat session's memory"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO ai_session_memory (user_id, pet_id, summary, recent_turns, summarized_turns, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id, pet_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    recent_turns = excluded.recent_turns,
+                    summarized_turns = excluded.summarized_turns,
+                    updated_at = excluded.updated_at
+            ''', (user_id, pet_id, summary, json.dumps(recent_turns, ensure_ascii=False), summarized_turns))
+    
+    @retry_on_busy
+    def clear_session_memory(self, user_id):
+        """Forget all chat sessions of a user"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM ai_session_memory WHERE user_id = ?', (user_id,))
+    
+    @retry_on_busy
     def store_ai_feedback(self, feedback_data):
         """Store AI feedback for improvement"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create AI feedback table if not exists
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_feedback (
-                feedback_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                consultation_id TEXT,
-                rating INTEGER,
-                detailed_feedback TEXT,
-                consultation_mode TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            INSERT INTO ai_feedback (user_id, consultation_id, rating, detailed_feedback, consultation_mode, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            feedback_data['user_id'],
-            feedback_data['consultation_id'], 
-            feedback_data['rating'],
-            feedback_data.get('detailed_feedback'),
-            feedback_data.get('consultation_mode'),
-            feedback_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO ai_feedback (user_id, consultation_id, rating, detailed_feedback, consultation_mode, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (
+                feedback_data['user_id'],
+                feedback_data['consultation_id'], 
+                feedback_data['rating'],
+                feedback_data.get('detailed_feedback'),
+                feedback_data.get('consultation_mode'),
+                feedback_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+            ))
     
     def get_ai_feedback_stats(self):
         """Get AI feedback statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                AVG(rating) as avg_rating,
-                COUNT(*) as total_feedback,
-                consultation_mode,
-                COUNT(CASE WHEN rating >= 4 THEN 1 END) as positive_feedback
-            FROM ai_feedback 
-            GROUP BY consultation_mode
-        ''')
-        
-        stats = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT 
+                    AVG(rating) as avg_rating,
+                    COUNT(*) as total_feedback,
+                    consultation_mode,
+                    COUNT(CASE WHEN rating >= 4 THEN 1 END) as positive_feedback
+                FROM ai_feedback 
+                GROUP BY consultation_mode
+            ''')
+            
+            stats = cursor.fetchall()
         return stats
     
+    @retry_on_busy
     def store_ai_performance(self, user_id, ai_type, performance_data):
         """Store AI performance metrics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create AI performance table if not exists
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ai_performance (
-                performance_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                ai_type TEXT,
-                consultation_id TEXT,
-                tokens_used INTEGER,
-                cost REAL,
-                response_time REAL,
-                model TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            INSERT INTO ai_performance (user_id, ai_type, consultation_id, tokens_used, cost, response_time, model, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            ai_type,
-            performance_data['consultation_id'],
-            performance_data['tokens_used'],
-            performance_data['cost'],
-            performance_data['response_time'],
-            performance_data['model'],
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO ai_performance (user_id, ai_type, consultation_id, tokens_used, cost, response_time, model, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id,
+                ai_type,
+                performance_data['consultation_id'],
+                performance_data['tokens_used'],
+                performance_data['cost'],
+                performance_data['response_time'],
+                performance_data['model'],
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
     
     def get_ai_cost_report(self, period='daily'):
         """Get AI cost reports"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if period == 'daily':
-            cursor.execute('''
-                SELECT 
-                    DATE(timestamp) as date,
-                    SUM(cost) as total_cost,
-                    SUM(tokens_used) as total_tokens,
-                    COUNT(*) as total_requests,
-                    ai_type,
-                    model
-                FROM ai_performance 
-                WHERE DATE(timestamp) = DATE('now')
-                GROUP BY DATE(timestamp), ai_type, model
-            ''')
-        elif period == 'weekly':
-            cursor.execute('''
-                SELECT 
-                    strftime('%Y-%W', timestamp) as week,
-                    SUM(cost) as total_cost,
-                    SUM(tokens_used) as total_tokens,
-                    COUNT(*) as total_requests,
-                    ai_type,
-                    model
-                FROM ai_performance 
-                WHERE timestamp >= datetime('now', '-7 days')
-                GROUP BY strftime('%Y-%W', timestamp), ai_type, model
-            ''')
-        
-        report = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            if period == 'daily':
+                cursor.execute('''
+                    SELECT 
+                        DATE(timestamp) as date,
+                        SUM(cost) as total_cost,
+                        SUM(tokens_used) as total_tokens,
+                        COUNT(*) as total_requests,
+                        ai_type,
+                        model
+                    FROM ai_performance 
+                    WHERE timestamp >= DATE('now')
+                    GROUP BY DATE(timestamp), ai_type, model
+                ''')
+            elif period == 'weekly':
+                cursor.execute('''
+                    SELECT 
+                        strftime('%Y-%W', timestamp) as week,
+                        SUM(cost) as total_cost,
+                        SUM(tokens_used) as total_tokens,
+                        COUNT(*) as total_requests,
+                        ai_type,
+                        model
+                    FROM ai_performance 
+                    WHERE timestamp >= datetime('now', '-7 days')
+                    GROUP BY strftime('%Y-%W', timestamp), ai_type, model
+                ''')
+            
+            report = cursor.fetchall()
         return report
     
+    @retry_on_busy
     def log_abuse_alert(self, user_id, usage_amount, limit):
         """Log potential API abuse"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create abuse alerts table if not exists
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS abuse_alerts (
-                alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                usage_amount INTEGER,
-                daily_limit INTEGER,
-                alert_type TEXT DEFAULT 'token_limit_exceeded',
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        cursor.execute('''
-            INSERT INTO abuse_alerts (user_id, usage_amount, daily_limit, timestamp)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, usage_amount, limit, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO abuse_alerts (user_id, usage_amount, daily_limit, timestamp)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, usage_amount, limit, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     
     def log_ai_insight(self, pet_id, log_date, ai_summary, extracted_tags, risk_score, model_name):
         """Log AI insight for ML training"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            self._insert_ai_insight(pet_id, log_date, ai_summary, extracted_tags, risk_score, model_name)
+            return True
+        except Exception as e:
+            print(f"AI insight logging error: {e}")
+            return False
+    
+    @retry_on_busy
+    def _insert_ai_insight(self, pet_id, log_date, ai_summary, extracted_tags, risk_score, model_name):
+        # Retried here, inside the best-effort wrapper, so busy errors reach retry_on_busy
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO ai_insights (pet_id, log_date, ai_summary, extracted_tags, risk_score, model_name)
                 VALUES (?, ?, ?, ?, ?, ?)
             ''', (pet_id, log_date, ai_summary, extracted_tags, risk_score, model_name))
-            conn.commit()
-            conn.close()
-            return True
-        except Exception as e:
-            print(f"AI insight logging error: {e}")
-            return False
     
     def log_ai_session(self, user_id, pet_id, log_date, user_message, ai_response, model_name, session_type):
         """Log complete AI chat session for ML training"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            self._insert_ai_session(user_id, pet_id, log_date, user_message, ai_response, model_name, session_type)
+            return True
+        except Exception as e:
+            print(f"AI session logging error: {e}")
+            return False
+    
+    @retry_on_busy
+    def _insert_ai_session(self, user_id, pet_id, log_date, user_message, ai_response, model_name, session_type):
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO ai_sessions (user_id, pet_id, log_date, user_message, ai_response, model_name, session_type)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, pet_id, log_date, user_message, ai_response, model_name, session_type))
-            conn.commit()
-            conn.close()
-            return True
-        except Exception as e:
-            print(f"AI session logging error: {e}")
-            return False
+    
+    def get_ai_session_messages(self, limit=5000):
+        """Newest logged chat exchanges as (session_id, user_message, ai_response, model_name)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT session_id, user_message, ai_response, model_name FROM ai_sessions
+                WHERE session_type = 'chat'
+                ORDER BY session_id DESC
+                LIMIT ?
+            ''', (limit,))
+            return cursor.fetchall()
     
     def get_complete_ml_dataset(self):
         """Export complete ML dataset with all joins for training"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                h.*,
-                p.name as pet_name, p.species, p.breed, p.age_years, p.age_months, 
-                p.weight as base_weight, p.gender, p.is_neutered, p.diseases, p.medications,
-                ai.ai_summary, ai.extracted_tags, ai.risk_score, ai.model_name as insight_model,
-                d.diagnosis, d.treatment, d.outcome,
-                s.user_message, s.ai_response, s.model_name as session_model, s.session_type
-            FROM health_logs h
-            JOIN pets p ON h.pet_id = p.pet_id
-            LEFT JOIN ai_insights ai ON h.pet_id = ai.pet_id AND h.log_date = ai.log_date
-            LEFT JOIN diagnosis_records d ON h.pet_id = d.pet_id
-            LEFT JOIN ai_sessions s ON h.pet_id = s.pet_id AND h.log_date = s.log_date
-            ORDER BY h.log_date DESC
-        ''')
-        data = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    h.*,
+                    p.name as pet_name, p.species, p.breed, p.age_years, p.age_months, 
+                    p.weight as base_weight, p.gender, p.is_neutered, p.diseases, p.medications,
+                    ai.ai_summary, ai.extracted_tags, ai.risk_score, ai.model_name as insight_model,
+                    d.diagnosis, d.treatment, d.outcome,
+                    s.user_message, s.ai_response, s.model_name as session_model, s.session_type
+                FROM health_logs h
+                JOIN pets p ON h.pet_id = p.pet_id
+                LEFT JOIN ai_insights ai ON h.pet_id = ai.pet_id AND h.log_date = ai.log_date
+                LEFT JOIN diagnosis_records d ON h.pet_id = d.pet_id
+                LEFT JOIN ai_sessions s ON h.pet_id = s.pet_id AND h.log_date = s.log_date
+                ORDER BY h.log_date DESC
+            ''')
+            data = cursor.fetchall()
         return data
     
+    @retry_on_busy
     def store_ai_feedback_enhanced(self, user_id, pet_id, consultation_id, ai_type, rating, feedback_type, detailed_feedback=None):
         """Store enhanced AI feedback for learning"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO ai_feedback (user_id, pet_id, consultation_id, ai_type, rating, feedback_type, detailed_feedback)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, pet_id, consultation_id, ai_type, rating, feedback_type, detailed_feedback))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO ai_feedback (user_id, pet_id, consultation_id, ai_type, rating, feedback_type, detailed_feedback)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, pet_id, consultation_id, ai_type, rating, feedback_type, detailed_feedback))
     
     def get_ai_learning_patterns(self, pet_id):
         """Get AI learning patterns for specific pet"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM ai_learning_patterns WHERE pet_id = ? ORDER BY last_updated DESC', (pet_id,))
-        patterns = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM ai_learning_patterns WHERE pet_id = ? ORDER BY last_updated DESC', (pet_id,))
+            patterns = cursor.fetchall()
         return patterns
     
+    @retry_on_busy
     def store_ai_learning_pattern(self, pet_id, pattern_type, pattern_data, confidence_score):
         """Store AI learning pattern"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO ai_learning_patterns (pet_id, pattern_type, pattern_data, confidence_score)
-            VALUES (?, ?, ?, ?)
-        ''', (pet_id, pattern_type, pattern_data, confidence_score))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO ai_learning_patterns (pet_id, pattern_type, pattern_data, confidence_score)
+                VALUES (?, ?, ?, ?)
+            ''', (pet_id, pattern_type, pattern_data, confidence_score))
     
     def get_correlation_data(self, pet_id, days=30):
         """Get correlation data for diet/activity/mood analysis"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT date, food_type, mood, stool_info, symptoms, weight, activity_level, notes
-            FROM health_logs 
-            WHERE pet_id = ? AND date >= date('now', '-{} days')
-            ORDER BY date DESC
-        '''.format(days), (pet_id,))
-        data = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT date, food_type, mood, stool_info, symptoms, weight, activity_level, notes
+                FROM health_logs 
+                WHERE pet_id = ? AND date >= date('now', ?)
+                ORDER BY date DESC
+            ''', (pet_id, f'-{int(days)} days'))
+            data = cursor.fetchall()
         return data
     
+    @retry_on_busy
     def update_health_log_with_ai_analysis(self, log_id, ai_analysis, risk_factors, correlation_flags):
         """Update health log with AI analysis results"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE health_logs 
-            SET ai_analysis = ?, risk_factors = ?, correlation_flags = ?
-            WHERE id = ?
-        ''', (ai_analysis, risk_factors, correlation_flags, log_id))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE health_logs 
+                SET ai_analysis = ?, risk_factors = ?, correlation_flags = ?
+                WHERE id = ?
+            ''', (ai_analysis, risk_factors, correlation_flags, log_id))
     
     def get_pet_historical_patterns(self, pet_id):
         """Get historical patterns for predictive analysis"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT 
-                h.*,
-                f.rating as feedback_rating,
-                f.feedback_type,
-                p.pattern_data,
-                p.confidence_score
-            FROM health_logs h
-            LEFT JOIN ai_feedback f ON h.pet_id = f.pet_id AND date(h.date) = date(f.timestamp)
-            LEFT JOIN ai_learning_patterns p ON h.pet_id = p.pet_id
-            WHERE h.pet_id = ?
-            ORDER BY h.date DESC
-            LIMIT 90
-        ''', (pet_id,))
-        data = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    h.*,
+                    f.rating as feedback_rating,
+                    f.feedback_type,
+                    p.pattern_data,
+                    p.confidence_score
+                FROM health_logs h
+                LEFT JOIN ai_feedback f ON h.pet_id = f.pet_id AND date(h.date) = date(f.timestamp)
+                LEFT JOIN ai_learning_patterns p ON h.pet_id = p.pet_id
+                WHERE h.pet_id = ?
+                ORDER BY h.date DESC
+                LIMIT 90
+            ''', (pet_id,))
+            data = cursor.fetchall()
         return data
     
+    @retry_on_busy
     def save_diet_plan(self, user_id, pet_id, diet_data, generated_plan):
         """Save generated diet plan to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Mark previous plans as inactive
-        cursor.execute('UPDATE diet_plans SET is_active = FALSE WHERE pet_id = ?', (pet_id,))
-        
-        # Insert new plan
-        cursor.execute('''
-            INSERT INTO diet_plans (user_id, pet_id, diet_type, goal, allergies, budget, preference, generated_plan)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            pet_id,
-            diet_data.get('diet_type', ''),
-            diet_data.get('goal', ''),
-            diet_data.get('allergies', ''),
-            diet_data.get('budget', ''),
-            diet_data.get('preference', ''),
-            generated_plan
-        ))
-        
-        plan_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Mark previous plans as inactive
+            cursor.execute('UPDATE diet_plans SET is_active = FALSE WHERE pet_id = ?', (pet_id,))
+            
+            # Insert new plan
+            cursor.execute('''
+                INSERT INTO diet_plans (user_id, pet_id, diet_type, goal, allergies, budget, preference, generated_plan)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id,
+                pet_id,
+                diet_data.get('diet_type', ''),
+                diet_data.get('goal', ''),
+                diet_data.get('allergies', ''),
+                diet_data.get('budget', ''),
+                diet_data.get('preference', ''),
+                generated_plan
+            ))
+            
+            plan_id = cursor.lastrowid
         return plan_id
     
     def get_pet_diet_plans(self, pet_id, limit=5):
         """Get diet plans for a pet"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM diet_plans 
-            WHERE pet_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (pet_id, limit))
-        plans = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM diet_plans 
+                WHERE pet_id = ? 
+                ORDER BY created_at DESC 
+                LIMIT ?
+            ''', (pet_id, limit))
+            plans = cursor.fetchall()
         return plans
     
     def get_active_diet_plan(self, pet_id):
         """Get active diet plan for a pet"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM diet_plans 
-            WHERE pet_id = ? AND is_active = TRUE 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (pet_id,))
-        plan = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM diet_plans 
+                WHERE pet_id = ? AND is_active = TRUE 
+                ORDER BY created_at DESC 
+                LIMIT 1
+            ''', (pet_id,))
+            plan = cursor.fetchone()
         return plan
     
     def get_user_diet_plans(self, user_id, limit=10):
         """Get all diet plans for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT dp.*, p.name as pet_name, p.species 
-            FROM diet_plans dp
-            JOIN pets p ON dp.pet_id = p.pet_id
-            WHERE dp.user_id = ? 
-            ORDER BY dp.created_at DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        plans = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT dp.*, p.name as pet_name, p.species 
+                FROM diet_plans dp
+                JOIN pets p ON dp.pet_id = p.pet_id
+                WHERE dp.user_id = ? 
+                ORDER BY dp.created_at DESC 
+                LIMIT ?
+            ''', (user_id, limit))
+            plans = cursor.fetchall()
         return plans
 
+class AsyncDatabase:
+    """Awaitable facade running Database calls on dedicated worker threads"""
+    
+    def __init__(self, database, workers=5):
+        self._db = database
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-worker")
+    
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+        if not callable(method):
+            return method
+        
+        @functools.wraps(method)
+        async def run(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(method, *args, **kwargs)
+            )
+        
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, run)
+        return run
+    
+    def close(self):
+        """Wait for pending queries, then close pooled connections"""
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
 # Global database instance
 db = Database()
+
+# Async access for handlers; one worker per pooled connection
+async_db = AsyncDatabase(db, workers=config.DATABASE_POOL_SIZE)
+
+if __name__ == "__main__":
+    # Query plan self-check, exits non-zero when a hot query regresses to a scan
+    import sys
+    problems = db.check_query_plans()
+    for label, details in problems:
+        print(f"Query plan regression in '{label}': {'; '.join(details)}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,393 @@
+import argparse
+import csv
+import math
+import time
+import zlib
+from collections import Counter, defaultdict
+from functools import lru_cache
+import config
+from utils.persian_utils import normalize_persian_text, format_age
+
+OTHER = "other"
+
+# Words too common to tell intents apart
+STOPWORDS = {
+    "من", "ما", "تو", "شما", "این", "اون", "آن", "که", "و", "یا", "به", "با", "از", "در", "برای", "را", "رو",
+    "هست", "است", "هستش", "چی", "چیه", "چیست", "باید", "میشه", "می", "ها", "های", "ام", "اش", "شه", "یه", "یک"
+}
+
+# Canned intents: keywords label logged messages; examples seed the classifier;
+# reply_keywords judge whether a logged model reply answered the same intent
+INTENTS = {
+    "vaccination": {
+        "keywords": ["واکسن", "واکسیناسیون", "vaccine", "vaccination"],
+        "reply_keywords": ["واکسن"],
+        "examples": [
+            "برنامه واکسن سگ چیه",
+            "برنامه واکسن گربه",
+            "کی باید واکسن بزنم",
+            "واکسن های توله سگ",
+            "بچه گربه کی واکسن میزنه",
+            "واکسیناسیون سگ چند ماهگی شروع میشه",
+            "واکسن هاری کی زده میشه",
+        ],
+    },
+    "feeding_frequency": {
+        "keywords": ["چند بار غذا", "چند وعده", "وعده غذا", "روزی چند بار", "چند بار در روز"],
+        "reply_keywords": ["وعده", "بار در روز"],
+        "examples": [
+            "روزی چند بار غذا بدم",
+            "گربه چند وعده غذا بخوره",
+            "سگ چند بار در روز غذا میخوره",
+            "توله سگ روزی چند وعده غذا بدم",
+            "چند بار در روز باید بهش غذا بدم",
+            "وعده غذایی بچه گربه",
+        ],
+    },
+    "pet_age": {
+        "keywords": ["چند سالشه", "چند سالش", "سنش", "چند ماهشه", "سن حیوان"],
+        "reply_keywords": ["سال", "ماه", "سن"],
+        "examples": [
+            "چند سالشه",
+            "سنش چقدره",
+            "حیوانم چند سالشه",
+            "سگم چند سالشه",
+            "گربم چند ماهشه",
+            "سن حیوان من",
+        ],
+    },
+    "deworming": {
+        "keywords": ["ضد انگل", "ضدانگل", "قرص انگل", "انگل زدایی"],
+        "reply_keywords": ["انگل"],
+        "examples": [
+            "ضد انگل کی بدم",
+            "هر چند وقت قرص ضد انگل بدم",
+            "برنامه ضد انگل سگ",
+            "ضدانگل گربه چند ماه یه بار",
+            "انگل زدایی توله سگ",
+        ],
+    },
+}
+
+# Questions the model should keep answering; they anchor the "other" class
+OTHER_EXAMPLES = [
+    "سگم استفراغ میکنه",
+    "گربه ام غذا نمیخوره",
+    "پای سگم لنگ میزنه",
+    "چشم گربه ام قرمز شده",
+    "بعد از واکسن بی حال شده",
+    "سگم اسهال داره چیکار کنم",
+    "گربه ام موهاش میریزه",
+    "غذای خشک بهتره یا خونگی",
+    "چرا سگم شب ها پارس میکنه",
+    "گربه ام خاک گربه رو استفاده نمیکنه",
+]
+
+# Cues that turn a routine question into a clinical one: symptoms, adverse events,
+# pregnancy/lactation, and "but / not / still / late" qualifiers. Any of them sends
+# the message to the model, however confident the classifier is.
+VETO_CUES = [
+    "استفراغ", "بالا آورد", "بالا اورد", "بالا میاره", "اسهال", "یبوست", "تب", "لاغر", "وزن کم", "خون",
+    "سرفه", "عطسه", "بی حال", "بیحال", "لنگ", "خارش", "درد", "زخم", "تشنج", "لرز", "ورم", "مسموم",
+    "عوارض", "واکنش", "حساسیت", "بعد از", "مریض", "بیمار",
+    "حامله", "باردار", "آبستن", "شیرده", "شیر میده", "زایمان",
+    "ولی", "اما", "نه", "نمی", "هنوز", "دیر", "عقب افتاده", "جا افتاده", "فراموش", "مشکل",
+]
+
+def other_cues():
+    """Words of the other-class examples that never occur in an intent's examples or keywords"""
+    intent_words = set()
+    for intent in INTENTS.values():
+        for text in intent["examples"] + intent["keywords"]:
+            intent_words.update(normalize_persian_text(text).split())
+    cues = set()
+    for text in OTHER_EXAMPLES:
+        for word in normalize_persian_text(text).split():
+            # Cues match as word prefixes, so skip any that would veto an intent word (غذای / غذایی)
+            if len(word) > 2 and word not in STOPWORDS and not any(other.startswith(word) for other in intent_words):
+                cues.add(word)
+    return sorted(cues)
+
+VETO_CUES += other_cues()
+
+# Species named in a message; colloquial forms included
+SPECIES_NAMES = {
+    "سگ": ["سگ"],
+    "گربه": ["گربه", "گربم"],
+    "خرگوش": ["خرگوش"],
+    "همستر": ["همستر"],
+    "پرنده": ["پرنده", "طوطی", "قناری"],
+    "ماهی": ["ماهی"],
+    "لاک پشت": ["لاک پشت"],
+}
+
+INTENT_FOOTER = "\n\n💡 برای جزئیات بیشتر، سوالت رو کامل‌تر بپرس."
+
+def features(text):
+    """Word and in-word character trigram counts of normalized text"""
+    words = [word for word in normalize_persian_text(text).split() if len(word) > 1 and word not in STOPWORDS]
+    counts = Counter(words)
+    for word in words:
+        # Trigrams survive suffixes like سالشه / سالش / ساله
+        padded = f"#{word}#"
+        counts.update("~" + padded[i:i + 3] for i in range(len(padded) - 2))
+    return counts
+
+@lru_cache(maxsize=1024)
+def keyword_prefix(keyword):
+    return f" {normalize_persian_text(keyword)}"
+
+def mentions(text, keywords):
+    """Whether normalized text has a word starting with any keyword (so واکسن matches واکسنش, not سن)"""
+    normalized = f" {normalize_persian_text(text)}"
+    return any(keyword_prefix(keyword) in normalized for keyword in keywords)
+
+def keyword_label(text):
+    """Intent whose keywords (and only that intent's) appear in text, else OTHER"""
+    hits = [name for name, intent in INTENTS.items() if mentions(text, intent["keywords"])]
+    return hits[0] if len(hits) == 1 else OTHER
+
+def named_species(user_message):
+    """Species the message itself talks about"""
+    return [species for species, names in SPECIES_NAMES.items() if mentions(user_message, names)]
+
+def pet_species(pet_info, user_message):
+    """سگ or گربه named in the message, else from the pet profile"""
+    named = named_species(user_message)
+    species = named[0] if len(named) == 1 else (pet_info or {}).get('species') if not named else None
+    return species if species in ("سگ", "گربه") else None
+
+def age_in_months(pet_info):
+    if not pet_info or (pet_info.get('age_years') is None and pet_info.get('age_months') is None):
+        return None
+    return (pet_info.get('age_years') or 0) * 12 + (pet_info.get('age_months') or 0)
+
+def answer_vaccination(pet_info, user_message):
+    species = pet_species(pet_info, user_message)
+    if species == "سگ":
+        return ("💉 برنامه معمول واکسن سگ:\n"
+                "• ۶ تا ۸ هفتگی: اولین واکسن چندگانه (دیستمپر، پاروو، هپاتیت)\n"
+                "• هر ۳ تا ۴ هفته تکرار تا ۱۶ هفتگی\n"
+                "• ۱۲ تا ۱۶ هفتگی: هاری\n"
+                "• یادآور یک سال بعد، سپس هر ۱ تا ۳ سال طبق نظر دامپزشک")
+    if species == "گربه":
+        return ("💉 برنامه معمول واکسن گربه:\n"
+                "• ۶ تا ۸ هفتگی: اولین واکسن سه‌گانه\n"
+                "• هر ۳ تا ۴ هفته تکرار تا ۱۶ هفتگی\n"
+                "• ۱۲ تا ۱۶ هفتگی: هاری\n"
+                "• یادآور یک سال بعد، سپس هر ۱ تا ۳ سال طبق نظر دامپزشک")
+    return None
+
+def answer_feeding_frequency(pet_info, user_message):
+    species = pet_species(pet_info, user_message)
+    months = age_in_months(pet_info)
+    if species == "سگ":
+        table = "• تا ۳ ماهگی: ۴ وعده\n• ۳ تا ۶ ماهگی: ۳ وعده\n• از ۶ ماهگی به بعد: ۲ وعده"
+        if months is not None:
+            meals = 4 if months < 3 else 3 if months < 6 else 2
+            return f"🍽️ برای سگی به سن {format_age(pet_info.get('age_years'), pet_info.get('age_months'))}، روزی {meals} وعده مناسبه.\n\n{table}"
+        return f"🍽️ تعداد وعده غذایی سگ در روز:\n{table}"
+    if species == "گربه":
+        table = "• تا ۶ ماهگی: ۳ تا ۴ وعده کوچک\n• بالغ: ۲ وعده، یا سهم روزانه پیمانه‌شده در چند نوبت"
+        if months is not None:
+            meals = "۳ تا ۴" if months < 6 else "۲"
+            return f"🍽️ برای گربه‌ای به سن {format_age(pet_info.get('age_years'), pet_info.get('age_months'))}، روزی {meals} وعده مناسبه.\n\n{table}"
+        return f"🍽️ تعداد وعده غذایی گربه در روز:\n{table}"
+    return None
+
+def answer_pet_age(pet_info, user_message):
+    months = age_in_months(pet_info)
+    if months is None:
+        return None  # Nothing on file; let the model ask
+    return f"🎂 طبق پروفایل، {pet_info.get('name', 'حیوان شما')} الان {format_age(pet_info.get('age_years'), pet_info.get('age_months'))} سن داره."
+
+def answer_deworming(pet_info, user_message):
+    if not pet_species(pet_info, user_message):
+        return None
+    return ("🪱 برنامه معمول ضد انگل:\n"
+            "• داخلی: تا ۱۲ هفتگی هر ۲ هفته، بعد ماهانه تا ۶ ماهگی، از آن به بعد هر ۳ ماه\n"
+            "• خارجی (کک و کنه): ماهانه یا طبق دستور محصول\n"
+            "دوز دارو به وزن حیوان بستگی داره.")
+
+# Answer templates; a template returns None when it can't answer without the model
+ANSWERS = {
+    "vaccination": answer_vaccination,
+    "feeding_frequency": answer_feeding_frequency,
+    "pet_age": answer_pet_age,
+    "deworming": answer_deworming,
+}
+
+def seed_documents():
+    """Hand-written examples for every intent plus the other class"""
+    documents = [(text, name) for name, intent in INTENTS.items() for text in intent["examples"]]
+    return documents + [(text, OTHER) for text in OTHER_EXAMPLES]
+
+def history_documents(sessions, max_words):
+    """Logged user messages, labelled by keywords only when the logged reply is on the same topic"""
+    documents = []
+    for _, user_message, ai_response, _ in sessions:
+        if not user_message:
+            continue
+        label = keyword_label(user_message)
+        if label != OTHER and not mentions(ai_response or "", INTENTS[label]["reply_keywords"]):
+            label = OTHER  # e.g. "تب بعد از واکسن" is about a symptom, not the schedule
+        if mentions(user_message, VETO_CUES):
+            label = OTHER
+        if len(normalize_persian_text(user_message).split()) > max_words:
+            label = OTHER  # Long messages stay with the model
+        documents.append((user_message, label))
+    return documents
+
+class IntentClassifier:
+    """Nearest-centroid TF-IDF classifier over normalized Persian text"""
+    
+    def __init__(self, min_confidence, max_words):
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.idf = {}
+        self.centroids = {}
+    
+    def fit(self, documents):
+        """Build IDF weights and one unit-length centroid per label from (text, label) pairs"""
+        counted = [(features(text), label) for text, label in documents]
+        doc_freq = Counter()
+        for counts, _ in counted:
+            doc_freq.update(counts.keys())
+        total = len(counted)
+        idf = {term: math.log((1 + total) / (1 + df)) + 1 for term, df in doc_freq.items()}
+        
+        sums = defaultdict(Counter)
+        for counts, label in counted:
+            for term, weight in self._weigh(counts, idf).items():
+                sums[label][term] += weight
+        # Swap in atomically so concurrent predict() calls see one model or the other
+        self.idf, self.centroids = idf, {label: self._unit(vector) for label, vector in sums.items()}
+        return self
+    
+    @staticmethod
+    def _unit(vector):
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+    
+    def _weigh(self, counts, idf):
+        return self._unit({term: (1 + math.log(count)) * idf[term] for term, count in counts.items() if term in idf})
+    
+    def predict(self, text):
+        """(best label, cosine similarity to its centroid)"""
+        vector = self._weigh(features(text), self.idf)
+        best, best_score = OTHER, 0.0
+        for label, centroid in self.centroids.items():
+            score = sum(weight * centroid.get(term, 0.0) for term, weight in vector.items())
+            if score > best_score:
+                best, best_score = label, score
+        return best, best_score
+    
+    def match(self, text):
+        """Intent name when confident enough to answer locally, else None"""
+        if not text or len(normalize_persian_text(text).split()) > self.max_words:
+            return None
+        if mentions(text, VETO_CUES):
+            return None  # Clinical detail; the model must answer
+        label, score = self.predict(text)
+        if label == OTHER or score < self.min_confidence:
+            return None
+        return label
+
+# Global intent classifier, seeded now and refit from chat history at startup
+intent_classifier = IntentClassifier(config.INTENT_MIN_CONFIDENCE, config.INTENT_MAX_WORDS).fit(seed_documents())
+
+def answer_locally(user_message, pet_info):
+    """(intent, canned answer) for a confident match with a usable template, else None"""
+    # A question about another animal than the profile's must not get the profile's schedule
+    profile_species = (pet_info or {}).get('species')
+    named = named_species(user_message)
+    if profile_species and named and profile_species not in named:
+        return None
+    intent = intent_classifier.match(user_message)
+    if not intent:
+        return None
+    answer = ANSWERS[intent](pet_info or {}, user_message)
+    if not answer:
+        return None
+    return intent, answer + INTENT_FOOTER
+
+def refresh_intents(sessions):
+    """Refit the global classifier on the seed examples plus logged chat messages"""
+    intent_classifier.fit(seed_documents() + history_documents(sessions, config.INTENT_MAX_WORDS))
+    return len(intent_classifier.centroids)
+
+def evaluate(sessions, folds=5, gold=None, min_confidence=None):
+    """Cross-validated precision of local answers against logged model sessions
+    
+    A local answer counts as correct when the session's gold label (if given) is the
+    predicted intent, otherwise when the logged model reply is on the intent's topic.
+    """
+    min_confidence = config.INTENT_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    # Sessions answered by a template would grade themselves
+    sessions = [session for session in sessions if session[1] and not (session[3] or "").startswith("intent:")]
+    predicted = Counter()
+    correct = Counter()
+    mistakes = []
+    elapsed = 0.0
+    for fold in range(folds):
+        in_fold = lambda session: zlib.crc32(str(session[0]).encode()) % folds == fold
+        train = [session for session in sessions if not in_fold(session)]
+        classifier = IntentClassifier(min_confidence, config.INTENT_MAX_WORDS)
+        classifier.fit(seed_documents() + history_documents(train, config.INTENT_MAX_WORDS))
+        for session in filter(in_fold, sessions):
+            session_id, user_message, ai_response, _ = session
+            started = time.perf_counter()
+            intent = classifier.match(user_message)
+            elapsed += time.perf_counter() - started
+            if not intent:
+                continue
+            predicted[intent] += 1
+            if gold and session_id in gold:
+                right = gold[session_id] == intent
+            else:
+                right = mentions(ai_response or "", INTENTS[intent]["reply_keywords"])
+            if right:
+                correct[intent] += 1
+            else:
+                mistakes.append((intent, user_message))
+    
+    return {
+        "sessions": len(sessions),
+        "answered_locally": sum(predicted.values()),
+        "coverage": sum(predicted.values()) / len(sessions) if sessions else 0.0,
+        "precision": sum(correct.values()) / sum(predicted.values()) if predicted else 0.0,
+        "per_intent": {name: (predicted[name], correct[name]) for name in INTENTS},
+        "avg_ms": elapsed * 1000 / len(sessions) if sessions else 0.0,
+        "mistakes": mistakes,
+    }
+
+def load_gold_labels(path):
+    """session_id,intent rows from a hand-labelled CSV"""
+    with open(path, newline='', encoding='utf-8') as f:
+        return {int(row["session_id"]): row["intent"] for row in csv.DictReader(f)}
+
+if __name__ == "__main__":
+    # Offline precision check: python -m utils.intents [--labels gold.csv] [--threshold 0.4]
+    from utils.database import db
+    parser = argparse.ArgumentParser(description="Measure local intent answers against logged AI sessions")
+    parser.add_argument("--labels", help="CSV with session_id,intent columns; overrides reply-based grading")
+    parser.add_argument("--threshold", type=float, help="Confidence threshold to evaluate")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=config.INTENT_TRAINING_LIMIT)
+    args = parser.parse_args()
+    
+    report = evaluate(
+        db.get_ai_session_messages(args.limit),
+        folds=args.folds,
+        gold=load_gold_labels(args.labels) if args.labels else None,
+        min_confidence=args.threshold
+    )
+    print(f"Sessions: {report['sessions']}")
+    print(f"Answered locally: {report['answered_locally']} ({report['coverage']:.1%})")
+    print(f"Precision: {report['precision']:.1%}")
+    print(f"Classifier time: {report['avg_ms']:.2f} ms per message")
+    for name, (predicted, correct) in report['per_intent'].items():
+        if predicted:
+            print(f"  {name}: {correct}/{predicted} ({correct / predicted:.1%})")
+    for intent, user_message in report['mistakes'][:20]:
+        print(f"  ✗ {intent}: {user_message}")
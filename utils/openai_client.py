@@ -1,25 +1,422 @@
 from openai import AsyncOpenAI
+import openai
+import httpx
+import asyncio
+import heapq
+import itertools
 import json
+import random
+import time
+from contextlib import aclosing, asynccontextmanager
+import config
 from config import OPENAI_API_KEY
+from utils.response_cache import cache_key, response_cache
+from utils.context_builder import build_chat_context, count_tokens, prompt_budget
 
-async def get_ai_chat_response(user_message, pet_info, health_history, is_premium=False, conversation_context=""):
-    """🤖 Conversational AI Chat - Natural & Human-like"""
-    try:
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        
-        # Detect if this is a greeting or first message
-        greetings = ["سلام", "hi", "hello", "درود", "صبح بخیر", "عصر بخیر", "شب بخیر"]
-        is_greeting = any(greeting in user_message.lower() for greeting in greetings)
-        
-        if is_greeting and not conversation_context:
-            # First interaction - friendly greeting
-            if pet_info and pet_info.get('name'):
-                return f"سلام! 😊\n\nمن دامپزشک هوشمند شما هستم. درباره {pet_info['name']} چه سوالی دارید؟\n\n💬 می‌تونید از من بپرسید:\n• مشکلات سلامتی\n• تغذیه و رژیم غذایی\n• رفتار و آموزش\n• مراقبت‌های روزانه\n\n📸 عکس هم می‌تونید بفرستید!"
+class OpenAIClientManager:
+    """One AsyncOpenAI client per process so TLS sessions and pooled connections are reused"""
+    
+    def __init__(self, api_key, pool_size, keepalive_connections, keepalive_expiry, timeout, connect_timeout):
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._client = None
+    
+    def get(self):
+        """Shared client, created on first use inside the running event loop"""
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                timeout=self.timeout,
+                max_retries=0,  # create_completion retries with its own backoff and circuit breaker
+                http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            )
+        return self._client
+    
+    async def close(self):
+        """Close pooled connections (call on shutdown)"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.close()
+
+# Global client manager
+client_manager = OpenAIClientManager(
+    OPENAI_API_KEY,
+    pool_size=config.OPENAI_POOL_SIZE,
+    keepalive_connections=config.OPENAI_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=config.OPENAI_KEEPALIVE_EXPIRY,
+    timeout=config.OPENAI_TIMEOUT,
+    connect_timeout=config.OPENAI_CONNECT_TIMEOUT
+)
+
+async def close_client():
+    """Close the shared OpenAI client"""
+    await client_manager.close()
+
+# Priority lanes: lower runs first; a lane's offset is how long it yields to the lanes above
+PRIORITY_PREMIUM = 0
+PRIORITY_FREE = 1
+PRIORITY_BACKGROUND = 2  # Work nobody is waiting on, e.g. chat summaries
+
+class TokenBucket:
+    """Budget of per_minute units refilling continuously"""
+    
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount):
+        """Seconds until amount is available (0 if it is now)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # Oversized requests wait for a full bucket, not forever
+        return max(0.0, (amount - self.tokens) / self.rate)
+    
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount  # May go negative when actual usage exceeds the estimate
+    
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class ModelLane:
+    """Concurrency cap, rate buckets and wait queue for one model"""
+    
+    def __init__(self, concurrency, rpm, tpm):
+        self.concurrency = concurrency
+        self.requests = TokenBucket(rpm)
+        self.token_budget = TokenBucket(tpm)
+        self.waiters = []  # heap of (deadline, seq, priority, estimated tokens, future, enqueued at)
+        self.active = 0
+        self.timer = None
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+class Lease:
+    """Granted slot; report actual token usage so the TPM bucket stays accurate"""
+    
+    def __init__(self, estimated_tokens):
+        self.estimated_tokens = estimated_tokens
+        self.actual_tokens = None
+    
+    def used(self, tokens):
+        self.actual_tokens = tokens
+
+class AIScheduler:
+    """Per-model concurrency caps plus RPM/TPM token buckets, with requests queued by priority lane"""
+    
+    def __init__(self, limits, default_limits, aging):
+        self.limits = limits
+        self.default_limits = default_limits
+        self.aging = aging
+        self.lanes = {}
+        self._seq = itertools.count()
+    
+    def _lane(self, model):
+        if model not in self.lanes:
+            self.lanes[model] = ModelLane(**self.limits.get(model, self.default_limits))
+        return self.lanes[model]
+    
+    @asynccontextmanager
+    async def slot(self, model, estimated_tokens, priority=PRIORITY_FREE):
+        """Wait for a slot on model; requests queue instead of failing"""
+        lane = self._lane(model)
+        future = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        # Lower lanes yield by a fixed offset, so a long-waiting free request still gets its turn
+        heapq.heappush(lane.waiters, (enqueued + priority * self.aging, next(self._seq), priority,
+                                      estimated_tokens, future, enqueued))
+        self._dispatch(model)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(model, Lease(estimated_tokens))  # Granted just as the caller gave up
+            raise
+        
+        lease = Lease(estimated_tokens)
+        try:
+            yield lease
+        finally:
+            self._release(model, lease)
+    
+    def _dispatch(self, model):
+        """Grant queued requests in order while the cap and both buckets allow"""
+        lane = self._lane(model)
+        if lane.timer is not None:
+            lane.timer.cancel()
+            lane.timer = None
+        while lane.waiters:
+            _, _, _, estimated_tokens, future, enqueued = lane.waiters[0]
+            if future.cancelled():
+                heapq.heappop(lane.waiters)
+                continue
+            if lane.active >= lane.concurrency:
+                return  # The next release dispatches again
+            
+            delay = max(lane.requests.wait_time(1), lane.token_budget.wait_time(estimated_tokens))
+            if delay > 0:
+                lane.timer = asyncio.get_running_loop().call_later(delay, self._dispatch, model)
+                return
+            
+            heapq.heappop(lane.waiters)
+            lane.requests.take(1)
+            lane.token_budget.take(estimated_tokens)
+            lane.active += 1
+            
+            waited = time.monotonic() - enqueued
+            lane.granted += 1
+            lane.total_wait += waited
+            lane.max_wait = max(lane.max_wait, waited)
+            future.set_result(None)
+    
+    def _release(self, model, lease):
+        lane = self._lane(model)
+        lane.active -= 1
+        if lease.actual_tokens is not None:
+            # Settle the estimate against what the API actually billed
+            difference = lease.estimated_tokens - lease.actual_tokens
+            if difference > 0:
+                lane.token_budget.refund(difference)
             else:
-                return "سلام! 😊\n\nمن دامپزشک هوشمند شما هستم. چطور می‌تونم کمکتون کنم؟\n\n💬 از من بپرسید:\n• سوالات سلامتی حیوان خانگی\n• مشاوره تغذیه\n• مشکلات رفتاری\n• مراقبت‌های روزانه\n\n📸 عکس هم می‌تونید بفرستید!"
-        
-        # Create conversational system prompt
-        system_prompt = """You are a friendly veterinarian chatbot speaking Persian. 
+                lane.token_budget.take(-difference)
+        self._dispatch(model)
+    
+    def stats(self):
+        """Per-model queue depth by lane, in-flight calls and wait times"""
+        report = {}
+        for model, lane in self.lanes.items():
+            queued = {}
+            for waiter in lane.waiters:
+                if not waiter[4].cancelled():
+                    queued[waiter[2]] = queued.get(waiter[2], 0) + 1
+            report[model] = {
+                'queued': sum(queued.values()),
+                'queued_premium': queued.get(PRIORITY_PREMIUM, 0),
+                'queued_free': queued.get(PRIORITY_FREE, 0),
+                'queued_background': queued.get(PRIORITY_BACKGROUND, 0),
+                'active': lane.active,
+                'granted': lane.granted,
+                'avg_wait': lane.total_wait / lane.granted if lane.granted else 0.0,
+                'max_wait': lane.max_wait
+            }
+        return report
+
+# Global AI scheduler
+scheduler = AIScheduler(
+    config.OPENAI_RATE_LIMITS,
+    config.OPENAI_DEFAULT_RATE_LIMITS,
+    aging=config.OPENAI_PRIORITY_AGING
+)
+
+class AIUnavailableError(Exception):
+    """The AI provider is down or kept failing; callers should fall back to a degraded response"""
+
+AI_UNAVAILABLE_MESSAGE = "⏳ دامپزشک هوشمند موقتاً در دسترس نیست. لطفاً چند دقیقه دیگر دوباره تلاش کنید."
+
+# Prefix of the error text analyze_health returns instead of raising
+HEALTH_ANALYSIS_ERROR = "❌ خطا در سیستم هوش مصنوعی"
+
+class CircuitBreaker:
+    """Opens after consecutive provider failures and fast-fails until a trial call succeeds"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Whether a call may go out now; half-open lets a single trial through"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_running or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"⚡ OpenAI circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()  # A failed trial restarts the cool-down
+        self.trial_running = False
+    
+    def abandon(self):
+        """The call ended without telling us whether the provider is healthy"""
+        self.trial_running = False
+
+# Global circuit breaker for the AI provider
+breaker = CircuitBreaker(config.OPENAI_BREAKER_THRESHOLD, config.OPENAI_BREAKER_RESET)
+
+def classify_error(error):
+    """Return (retryable, counts against the breaker, Retry-After seconds or None)"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True, True, None
+    if isinstance(error, openai.APIStatusError):
+        retry_after = None
+        try:
+            retry_after = float(error.response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+        if error.status_code == 429:
+            return True, False, retry_after  # Throttled, not down
+        if error.status_code >= 500:
+            return True, True, retry_after
+    return False, False, None
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff; a server's Retry-After is a floor"""
+    delay = random.uniform(0, min(config.OPENAI_BACKOFF_MAX, config.OPENAI_BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, config.OPENAI_BACKOFF_MAX))
+    return delay
+
+def estimate_tokens(messages, max_tokens):
+    """Upper bound on tokens for a request: prompt estimate, per-message framing and the completion"""
+    return sum(count_tokens(message["content"]) + 4 for message in messages) + max_tokens
+
+def handle_attempt_failure(error, attempt):
+    """Record a failed attempt on the breaker; returns the backoff delay, or raises if it must not be retried"""
+    retryable, provider_fault, retry_after = classify_error(error)
+    if provider_fault:
+        breaker.record_failure()
+    else:
+        breaker.abandon()
+    if not retryable:
+        raise error
+    if attempt == config.OPENAI_MAX_RETRIES:
+        raise AIUnavailableError(f"OpenAI failed after {attempt + 1} attempts: {error}") from error
+    delay = backoff_delay(attempt, retry_after)
+    print(f"OpenAI call failed ({error}), retry {attempt + 1} in {delay:.1f}s")
+    return delay
+
+async def create_completion(messages, max_tokens, temperature, priority=PRIORITY_FREE, model=None):
+    """Chat completion issued through the scheduler, retrying transient errors behind the circuit breaker"""
+    model = model or config.OPENAI_MODEL
+    estimated = estimate_tokens(messages, max_tokens)
+    for attempt in range(config.OPENAI_MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise AIUnavailableError("OpenAI circuit is open")
+        try:
+            async with scheduler.slot(model, estimated, priority) as lease:
+                response = await client_manager.get().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+                if response.usage:
+                    lease.used(response.usage.total_tokens)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception as e:
+            await asyncio.sleep(handle_attempt_failure(e, attempt))
+            continue
+        
+        breaker.record_success()
+        return response
+
+async def stream_completion(messages, max_tokens, temperature, priority=PRIORITY_FREE, model=None):
+    """Yield text deltas as they arrive; transient errors are retried only until the first delta"""
+    model = model or config.OPENAI_MODEL
+    estimated = estimate_tokens(messages, max_tokens)
+    for attempt in range(config.OPENAI_MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise AIUnavailableError("OpenAI circuit is open")
+        produced = ""
+        settled = False  # Whether this attempt was recorded on the breaker
+        try:
+            async with scheduler.slot(model, estimated, priority) as lease:
+                stream = await client_manager.get().chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        produced += delta
+                        yield delta
+                # Streamed responses carry no usage, so settle with the local estimate
+                lease.used(estimated - max_tokens + count_tokens(produced))
+            breaker.record_success()
+            settled = True
+        except Exception as e:
+            settled = True  # handle_attempt_failure records the outcome
+            if produced:
+                # Text already reached the user, so a retry would repeat it
+                handle_attempt_failure(e, config.OPENAI_MAX_RETRIES)
+            await asyncio.sleep(handle_attempt_failure(e, attempt))
+            continue
+        finally:
+            # Cancelled, or the consumer stopped early (break, aclose, its own error):
+            # free a half-open trial instead of wedging the breaker
+            if not settled:
+                breaker.abandon()
+        
+        return
+
+CHAT_MAX_TOKENS = 200  # Much shorter responses
+CHAT_PET_LABEL = "اطلاعات حیوان:"
+CHAT_HEALTH_LABEL = "تاریخچه سلامت اخیر (جدیدترین اول):"
+CHAT_SUMMARY_LABEL = "خلاصه گفتگوهای قبلی:"
+CHAT_PROMPT_TEMPLATE = """{summary_context}
+مکالمه قبلی:
+{dialogue}
+
+پیام جدید کاربر: {user_message}
+{pet_context}
+{health_context}
+
+پاسخ کوتاه، دوستانه و طبیعی بده. به مکالمه قبلی توجه کن. اگر کاربر درباره تاریخچه سلامت پرسید، از اطلاعات موجود استفاده کن.
+"""
+
+def build_chat_messages(user_message, pet_info, health_history, conversation_context="", summary=""):
+    """Return (canned greeting, None) for a first hello, else (None, messages for the model)"""
+    # Detect if this is a greeting or first message
+    greetings = ["سلام", "hi", "hello", "درود", "صبح بخیر", "عصر بخیر", "شب بخیر"]
+    is_greeting = any(greeting in user_message.lower() for greeting in greetings)
+    
+    if is_greeting and not conversation_context and not summary:
+        # First interaction - friendly greeting
+        if pet_info and pet_info.get('name'):
+            return f"سلام! 😊\n\nمن دامپزشک هوشمند شما هستم. درباره {pet_info['name']} چه سوالی دارید؟\n\n💬 می‌تونید از من بپرسید:\n• مشکلات سلامتی\n• تغذیه و رژیم غذایی\n• رفتار و آموزش\n• مراقبت‌های روزانه\n\n📸 عکس هم می‌تونید بفرستید!", None
+        else:
+            return "سلام! 😊\n\nمن دامپزشک هوشمند شما هستم. چطور می‌تونم کمکتون کنم؟\n\n💬 از من بپرسید:\n• سوالات سلامتی حیوان خانگی\n• مشاوره تغذیه\n• مشکلات رفتاری\n• مراقبت‌های روزانه\n\n📸 عکس هم می‌تونید بفرستید!", None
+    
+    # Create conversational system prompt
+    system_prompt = """You are a friendly veterinarian chatbot speaking Persian. 
 
 IMPORTANT RULES:
 - Answer ONLY what the user asks
@@ -42,70 +439,72 @@ User: "گربه‌م مریضه" → "چه علامتی دیدی؟ چند وقت
 User: "چند سالشه؟" → "کدوم حیوان؟ اگر بگی چه نوع حیوانیه بهتر می‌تونم کمک کنم."
 
 Keep it simple and natural!"""
-        
-        # Format pet context with full details
-        pet_context = ""
-        if pet_info:
-            pet_name = pet_info.get('name', 'حیوان خانگی شما')
-            pet_species = pet_info.get('species', '')
-            pet_age_years = pet_info.get('age_years', 0)
-            pet_age_months = pet_info.get('age_months', 0)
-            pet_breed = pet_info.get('breed', '')
-            pet_weight = pet_info.get('weight', '')
-            pet_gender = pet_info.get('gender', '')
-            
-            pet_context = f"""
-اطلاعات {pet_name}:
-- نوع: {pet_species}
-- نژاد: {pet_breed if pet_breed else 'نامشخص'}
-- سن: {pet_age_years} سال و {pet_age_months} ماه
-- وزن: {pet_weight} کیلوگرم
-- جنسیت: {pet_gender}
-"""
-        
-        # Format health history if available
-        health_context = ""
-        if health_history:
-            health_context = f"""
-تاریخچه سلامت اخیر:
-{json.dumps(health_history[-5:], ensure_ascii=False, indent=2)}
-"""
-        
-        user_prompt = f"""
-مکالمه قبلی:
-{conversation_context}
+    
+    # Summary, pet, health and dialogue sections are fitted to the prompt token budget
+    if isinstance(conversation_context, str):
+        conversation_context = [line for line in conversation_context.split("\n") if line.strip()]
+    overhead = (count_tokens(system_prompt) + count_tokens(CHAT_PET_LABEL + CHAT_HEALTH_LABEL + CHAT_SUMMARY_LABEL) +
+                count_tokens(CHAT_PROMPT_TEMPLATE.format(summary_context="", dialogue="", user_message="", pet_context="", health_context="")))
+    context = build_chat_context(
+        user_message, pet_info, health_history, conversation_context,
+        prompt_budget(CHAT_MAX_TOKENS) - overhead, summary=summary
+    )
+    
+    summary_context = f"\n{CHAT_SUMMARY_LABEL}\n{context['summary']}\n" if context['summary'] else ""
+    pet_context = f"\n{CHAT_PET_LABEL} {context['pet']}\n" if context['pet'] else ""
+    health_context = f"\n{CHAT_HEALTH_LABEL}\n{context['health']}\n" if context['health'] else ""
+    user_prompt = CHAT_PROMPT_TEMPLATE.format(
+        summary_context=summary_context,
+        dialogue=context['dialogue'],
+        user_message=context['user_message'],
+        pet_context=pet_context,
+        health_context=health_context
+    )
+    
+    return None, [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
 
-پیام جدید کاربر: {user_message}
-{pet_context}
-{health_context}
+async def stream_ai_chat_response(user_message, pet_info, health_history, is_premium=False, conversation_context="", summary=""):
+    """🤖 Conversational AI Chat, yielding text as the model writes it"""
+    greeting, messages = build_chat_messages(user_message, pet_info, health_history, conversation_context, summary)
+    if greeting:
+        yield greeting
+        return
+    
+    # Close the inner stream as soon as our consumer stops, so its breaker bookkeeping runs now
+    async with aclosing(stream_completion(
+        messages,
+        max_tokens=CHAT_MAX_TOKENS,
+        temperature=0.8,
+        priority=PRIORITY_PREMIUM if is_premium else PRIORITY_FREE
+    )) as stream:
+        async for delta in stream:
+            yield delta
 
-پاسخ کوتاه، دوستانه و طبیعی بده. به مکالمه قبلی توجه کن. اگر کاربر درباره تاریخچه سلامت پرسید، از اطلاعات موجود استفاده کن.
-        """
-        
-        response = await client.chat.completions.create(
-            model="gpt-4.1-nano-2025-04-14",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=200,  # Much shorter responses
-            temperature=0.8  # More natural/varied
-        )
-        
-        ai_response = response.choices[0].message.content
-        
-        return ai_response
-        
-    except Exception as e:
-        error_msg = f"❌ خطا در سیستم هوش مصنوعی: {str(e)}"
-        print(f"AI Chat Error: {e}")  # For debugging
-        return f"{error_msg}\n\n💡 لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
+SUMMARY_SYSTEM_PROMPT = """You maintain a running memory of a Persian conversation between a pet owner and a veterinarian chatbot.
+Merge the previous summary and the new turns into ONE short Persian summary.
+Keep: the pet's symptoms and their timeline, advice already given, medications, decisions and open questions.
+Drop greetings and small talk. Never invent facts. Plain text only, no headings."""
+
+async def summarize_conversation(previous_summary, turns):
+    """Fold chat turns into the running summary; runs in the background lane"""
+    prompt = f"خلاصه قبلی:\n{previous_summary or '-'}\n\nگفتگوهای جدید:\n" + "\n".join(turns)
+    response = await create_completion(
+        [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=config.MEMORY_SUMMARY_TOKENS,
+        temperature=0.2,
+        priority=PRIORITY_BACKGROUND
+    )
+    return (response.choices[0].message.content or "").strip()
 
 async def analyze_health(health_data, pet_info, use_reasoning=False):
     """Health Analysis for health tracking feature"""
     try:
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        
         # Create comprehensive system prompt
         system_prompt = """You are a professional veterinarian providing health analysis in Persian.
         
@@ -161,28 +560,64 @@ async def analyze_health(health_data, pet_info, use_reasoning=False):
 لطفاً تحلیل کاملی از وضعیت سلامت ارائه دهید.
         """
         
-        response = await client.chat.completions.create(
-            model="gpt-4.1-nano-2025-04-14",
-            messages=[
+        response = await create_completion(
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             max_tokens=1000,
-            temperature=0.4
+            temperature=0.4,
+            priority=PRIORITY_PREMIUM
         )
         
         return response.choices[0].message.content
         
+    except AIUnavailableError:
+        raise  # The handler falls back to the local health score
     except Exception as e:
-        error_msg = f"❌ خطا در سیستم هوش مصنوعی: {str(e)}"
+        error_msg = f"{HEALTH_ANALYSIS_ERROR}: {str(e)}"
         print(f"AI Error: {e}")  # For debugging
         return f"{error_msg}\n\n💡 لطفاً دوباره تلاش کنید یا با پشتیبانی تماس بگیرید."
 
+# Bump when the diet prompt changes so older cached plans stop matching
+DIET_PROMPT_VERSION = 1
+
+def normalize_input(value):
+    """Case- and whitespace-insensitive form of a prompt input"""
+    return " ".join(str(value or "").split()).lower()
+
+def weight_bucket(weight):
+    """Weight band in kg; plans are written for the band so pets within it share a cached plan"""
+    try:
+        weight = float(weight)
+    except (TypeError, ValueError):
+        return "نامشخص"
+    if weight <= 0:
+        return "نامشخص"
+    step = 0.5 if weight < 5 else 2.5 if weight < 20 else 5
+    low = int(weight / step) * step
+    return f"{low:g} تا {low + step:g} کیلوگرم"
+
+def age_bucket(years, months):
+    """Life-stage band; growing animals get two-month bands"""
+    try:
+        total_months = int(years or 0) * 12 + int(months or 0)
+    except (TypeError, ValueError):
+        return "نامشخص"
+    if total_months < 12:
+        low = total_months // 2 * 2
+        return f"{low} تا {low + 2} ماه"
+    if total_months < 24:
+        return "1 تا 2 سال"
+    if total_months < 84:
+        return "2 تا 7 سال (بالغ)"
+    if total_months < 120:
+        return "7 تا 10 سال (سالمند)"
+    return "بیش از 10 سال (سالمند)"
+
 async def generate_diet_plan(pet_details, diet_type, goal, allergies, budget, preference, health_logs):
     """Generate comprehensive diet plan using AI"""
     try:
-        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        
         # Create comprehensive system prompt for diet planning
         system_prompt = """You are a professional veterinary nutritionist creating detailed diet plans in Persian.
         
@@ -198,13 +633,14 @@ async def generate_diet_plan(pet_details, diet_type, goal, allergies, budget, pr
         Always consider the pet's complete health profile, allergies, and specific goals.
         Provide practical, actionable advice that owners can easily follow."""
         
-        # Format pet information
+        # Format pet information; name is left out and age/weight are banded so the plan can be cached
+        age_band = age_bucket(pet_details['age_years'], pet_details['age_months'])
+        weight_band = weight_bucket(pet_details['weight'])
         pet_info_text = f"""
-نام: {pet_details['name']}
 نوع: {pet_details['species']}
 نژاد: {pet_details['breed']}
-سن: {pet_details['age_years']} سال و {pet_details['age_months']} ماه
-وزن: {pet_details['weight']} کیلوگرم
+سن: {age_band}
+وزن: {weight_band}
 جنسیت: {pet_details['gender']}
 بیماری‌ها: {pet_details['diseases']}
 داروها: {pet_details['medications']}
@@ -252,17 +688,31 @@ async def generate_diet_plan(pet_details, diet_type, goal, allergies, budget, pr
 پاسخ را به فارسی و با فرمت زیبا ارائه دهید.
         """
         
-        response = await client.chat.completions.create(
-            model="gpt-4.1-nano-2025-04-14",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=1500,
-            temperature=0.3
-        )
-        
-        diet_plan = response.choices[0].message.content
+        key = cache_key("diet_plan", {
+            "version": DIET_PROMPT_VERSION,
+            "model": config.OPENAI_MODEL,
+            "pet": [normalize_input(pet_details[field]) for field in ("species", "breed", "gender", "diseases", "medications")],
+            "age": age_band,
+            "weight": weight_band,
+            "plan": [normalize_input(value) for value in (diet_type, goal, allergies, budget, preference)],
+            "health": normalize_input(health_info)
+        })
+        diet_plan = await response_cache.fetch(key)
+        
+        if diet_plan is None:
+            response = await create_completion(
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=1500,
+                temperature=0.3,
+                priority=PRIORITY_PREMIUM
+            )
+            
+            diet_plan = response.choices[0].message.content
+            if diet_plan and len(diet_plan.strip()) >= 100:
+                await response_cache.store(key, "diet_plan", diet_plan)
         
         # Add footer with disclaimer
         from datetime import datetime
@@ -276,6 +726,9 @@ async def generate_diet_plan(pet_details, diet_type, goal, allergies, budget, pr
         
         return diet_plan
         
+    except AIUnavailableError as e:
+        print(f"Diet Plan Generation unavailable: {e}")
+        return AI_UNAVAILABLE_MESSAGE
     except Exception as e:
         error_msg = f"❌ خطا در تولید برنامه غذایی: {str(e)}"
         print(f"Diet Plan Generation Error: {e}")  # For debugging
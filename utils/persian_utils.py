@@ -61,6 +61,26 @@ def clean_persian_input(text):
     
     return text
 
+# Arabic letter and digit variants folded to their Persian forms
+ARABIC_TO_PERSIAN = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ؤ': 'و',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9'
+})
+
+def normalize_persian_text(text):
+    """Fold spelling variants for matching: Arabic letters, digits, diacritics, ZWNJ, punctuation and case"""
+    if not text:
+        return ""
+    text = persian_to_english_numbers(text).translate(ARABIC_TO_PERSIAN)
+    # Diacritics and tatweel carry no meaning for matching
+    text = re.sub(r'[\u064B-\u065F\u0670\u0640]', '', text)
+    # Half-space joins suffixes (گربه‌ها); treat it as a word break
+    text = re.sub(r'[\u200c\u200d]', ' ', text)
+    text = re.sub(r'[^\w\s]|_', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
 def validate_persian_name(name):
     """Validate pet name - accepts Persian, English, and numbers"""
     if not name or len(name.strip()) < 1:
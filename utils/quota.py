@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from datetime import datetime
+import config
+from utils.database import async_db
+
+class QuotaService:
+    """Daily AI message counters kept in memory and written behind to ai_usage"""
+    
+    def __init__(self, daily_limit):
+        self.daily_limit = daily_limit
+        self._counts = {}  # (user_id, day) -> messages used
+        self._dirty = set()
+        self._lock = threading.Lock()
+    
+    def _today(self):
+        return datetime.now().strftime('%Y-%m-%d')
+    
+    def used(self, user_id):
+        """Messages used today"""
+        with self._lock:
+            return self._counts.get((user_id, self._today()), 0)
+    
+    def remaining(self, user_id):
+        """Messages left today, without any I/O"""
+        return max(0, self.daily_limit - self.used(user_id))
+    
+    def consume(self, user_id):
+        """Count one message and return the quota left afterwards"""
+        key = (user_id, self._today())
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            self._dirty.add(key)
+            return max(0, self.daily_limit - self._counts[key])
+    
+    def try_consume(self, user_id):
+        """Count one message unless today's limit is reached; the check and the count share one lock hold"""
+        key = (user_id, self._today())
+        with self._lock:
+            used = self._counts.get(key, 0)
+            if used >= self.daily_limit:
+                return False
+            self._counts[key] = used + 1
+            self._dirty.add(key)
+            return True
+    
+    def refund(self, user_id):
+        """Give back a message claimed by try_consume that ended up costing nothing"""
+        key = (user_id, self._today())
+        with self._lock:
+            if self._counts.get(key, 0) > 0:
+                self._counts[key] -= 1
+                self._dirty.add(key)
+    
+    async def load(self):
+        """Reload today's counters from the database (run once at startup)"""
+        today = self._today()
+        usage = await async_db.get_ai_usage_on(today)
+        with self._lock:
+            for user_id, count in usage.items():
+                key = (user_id, today)
+                self._counts[key] = max(self._counts.get(key, 0), count)
+        print(f"📊 Loaded AI quota counters for {len(usage)} users")
+    
+    async def flush(self):
+        """Persist changed counters in one batch and drop finished days"""
+        today = self._today()
+        with self._lock:
+            rows = [(user_id, day, self._counts[(user_id, day)]) for user_id, day in self._dirty]
+            self._dirty.clear()
+            for key in [key for key in self._counts if key[1] != today]:
+                del self._counts[key]
+        if not rows:
+            return
+        try:
+            await async_db.save_ai_usage(rows)
+        except Exception as e:
+            print(f"Quota flush error: {e}")
+            with self._lock:
+                for user_id, day, count in rows:
+                    key = (user_id, day)
+                    self._counts[key] = max(self._counts.get(key, 0), count)
+                    self._dirty.add(key)
+    
+    async def run_flusher(self, interval=config.QUOTA_FLUSH_INTERVAL):
+        """Background loop flushing counters every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+# Global quota service
+quota = QuotaService(config.FREE_DAILY_AI_MESSAGES)
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from utils.database import ConnectionPool, retry_on_busy
+import config
+
+def cache_key(namespace, inputs):
+    """Content address for a set of normalized inputs"""
+    payload = json.dumps(inputs, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(f"{namespace}:{payload}".encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """SQLite cache for AI responses with TTL expiry and a total-size cap (least recently used evicted first)"""
+    
+    def __init__(self, db_path, ttl, max_bytes):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.pool = ConnectionPool(
+            db_path,
+            size=2,
+            cached_statements=config.DATABASE_STATEMENT_CACHE_SIZE,
+            pragmas=config.DATABASE_PRAGMAS
+        )
+        self.init_db()
+    
+    def init_db(self):
+        """Create the cache table"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    namespace TEXT,
+                    response TEXT,
+                    size INTEGER,
+                    created_at REAL,
+                    last_used REAL,
+                    hits INTEGER DEFAULT 0
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache(last_used)')
+    
+    @retry_on_busy
+    def get(self, key):
+        """Cached response, or None if missing or older than the TTL"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT response FROM response_cache WHERE cache_key = ? AND created_at >= ?',
+                           (key, now - self.ttl))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('UPDATE response_cache SET last_used = ?, hits = hits + 1 WHERE cache_key = ?',
+                               (now, key))
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row[0] if row else None
+    
+    @retry_on_busy
+    def set(self, key, namespace, response):
+        """Store a response, then expire and evict down to the size cap"""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO response_cache (cache_key, namespace, response, size, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, namespace, response, size, now, now))
+            cursor.execute('DELETE FROM response_cache WHERE created_at < ?', (now - self.ttl,))
+            
+            cursor.execute('SELECT COALESCE(SUM(size), 0) FROM response_cache')
+            excess = cursor.fetchone()[0] - self.max_bytes
+            if excess > 0:
+                # Walk least recently used entries until enough bytes are freed
+                cursor.execute('SELECT cache_key, size FROM response_cache ORDER BY last_used')
+                evict = []
+                for old_key, old_size in cursor.fetchall():
+                    if excess <= 0:
+                        break
+                    evict.append((old_key,))
+                    excess -= old_size
+                cursor.executemany('DELETE FROM response_cache WHERE cache_key = ?', evict)
+    
+    async def fetch(self, key):
+        """get() off the event loop; a failing cache counts as a miss"""
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+        except Exception as e:
+            print(f"Response cache read error: {e}")
+            return None
+    
+    async def store(self, key, namespace, response):
+        """set() off the event loop; failures are logged, never raised"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.set, key, namespace, response)
+        except Exception as e:
+            print(f"Response cache write error: {e}")
+    
+    def stats(self):
+        """Hit/miss counters since startup plus current size"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache')
+            entries, size = cursor.fetchone()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+    
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
+
+# Global AI response cache
+response_cache = ResponseCache(
+    config.AI_CACHE_DB_PATH,
+    ttl=config.AI_CACHE_TTL,
+    max_bytes=config.AI_CACHE_MAX_BYTES
+)
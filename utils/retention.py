@@ -0,0 +1,99 @@
+import os
+import re
+import gzip
+import shutil
+from datetime import date, timedelta
+
+# <kind>_<YYYY-MM-DD>[.<segment>].jsonl[.gz]; segments are created by size rotation
+SEGMENT_PATTERN = re.compile(
+    r'^(?P<kind>[a-z_]+)_(?P<date>\d{4}-\d{2}-\d{2})(?:\.(?P<segment>\d{3}))?\.jsonl(?P<gz>\.gz)?$'
+)
+
+def parse_segment(filename):
+    """Return (kind, date, segment number) for a raw analytics file name, else None"""
+    match = SEGMENT_PATTERN.match(os.path.basename(filename))
+    if not match:
+        return None
+    return match.group('kind'), match.group('date'), int(match.group('segment') or 0)
+
+def day_segments(analytics_dir, kind, target_date):
+    """Raw and archived JSONL files for one kind and day, oldest segment first"""
+    paths = []
+    for directory in (os.path.join(analytics_dir, "archive"), analytics_dir):
+        if not os.path.exists(directory):
+            continue
+        segments = []
+        for name in os.listdir(directory):
+            parsed = parse_segment(name)
+            if parsed and parsed[:2] == (kind, target_date):
+                # Numbered segments were rotated out before the live (unnumbered) file
+                segments.append((parsed[2] == 0, parsed[2], name))
+        paths.extend(os.path.join(directory, name) for _, _, name in sorted(segments))
+    return paths
+
+def rotate_if_needed(path, max_bytes):
+    """Move a file that reached max_bytes aside as the next numbered segment"""
+    if not max_bytes or not os.path.exists(path) or os.path.getsize(path) < max_bytes:
+        return
+    base = path[:-len(".jsonl")]
+    segment = 1
+    while os.path.exists(f"{base}.{segment:03d}.jsonl"):
+        segment += 1
+    os.replace(path, f"{base}.{segment:03d}.jsonl")
+
+class RetentionPolicy:
+    """Compress old raw analytics into archive/, expire old archives, keep rollups forever"""
+    
+    def __init__(self, analytics_dir, raw_days, archive_days, store=None):
+        self.analytics_dir = analytics_dir
+        self.archive_dir = os.path.join(analytics_dir, "archive")
+        self.raw_days = raw_days
+        self.archive_days = archive_days
+        self.store = store
+    
+    def compress(self, path):
+        """gzip one raw file into the archive and remove the original"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        target = os.path.join(self.archive_dir, os.path.basename(path) + ".gz")
+        tmp_target = target + ".tmp"
+        with open(path, 'rb') as src, gzip.open(tmp_target, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_target, target)
+        os.remove(path)
+    
+    def apply(self, today=None):
+        """Run the policy once; returns counts of archived and expired files"""
+        today = today or date.today()
+        raw_cutoff = (today - timedelta(days=self.raw_days)).isoformat()
+        archive_cutoff = (today - timedelta(days=self.archive_days)).isoformat()
+        stats = {"archived": 0, "expired": 0, "pruned_events": 0}
+        
+        for name in os.listdir(self.analytics_dir):
+            parsed = parse_segment(name)
+            if parsed and parsed[1] < raw_cutoff:
+                try:
+                    self.compress(os.path.join(self.analytics_dir, name))
+                    stats["archived"] += 1
+                except Exception as e:
+                    print(f"Analytics archive error ({name}): {e}")
+        
+        if os.path.exists(self.archive_dir):
+            for name in os.listdir(self.archive_dir):
+                parsed = parse_segment(name)
+                if parsed and parsed[1] < archive_cutoff:
+                    os.remove(os.path.join(self.archive_dir, name))
+                    stats["expired"] += 1
+        
+        # Raw event rows follow the same window; hourly/daily rollup tables are kept
+        if self.store is not None:
+            stats["pruned_events"] = self.store.prune_events(raw_cutoff)
+        return stats
+    
+    def archived_segments(self):
+        """[(relative path, size in bytes)] of archived segments, oldest first"""
+        if not os.path.exists(self.archive_dir):
+            return []
+        return [
+            (f"archive/{name}", os.path.getsize(os.path.join(self.archive_dir, name)))
+            for name in sorted(os.listdir(self.archive_dir)) if parse_segment(name)
+        ]
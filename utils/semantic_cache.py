@@ -0,0 +1,125 @@
+import math
+import time
+import zlib
+import numpy as np
+import config
+from utils.intents import features, seed_documents
+from utils.persian_utils import normalize_persian_text
+
+# Near-identical wording can still be about a different animal; answers never cross species
+SPECIES_WORDS = ["سگ", "توله", "گربه", "خرگوش", "همستر", "پرنده", "طوطی", "قناری", "ماهی", "لاک پشت"]
+
+def species_key(text):
+    """Species words mentioned in text, as a comparable string"""
+    normalized = f" {normalize_persian_text(text)}"
+    return ",".join(word for word in SPECIES_WORDS if f" {word}" in normalized)
+
+class SemanticCache:
+    """Reuses model answers for near-duplicate standalone questions: hashed char n-gram TF-IDF, NumPy nearest neighbour"""
+    
+    def __init__(self, dim, max_entries, threshold, ttl):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.idf = np.ones(dim, dtype=np.float32)
+        # Raw term weights are kept so rows can be reweighted when the IDF is refit
+        self.raw = np.zeros((max_entries, dim), dtype=np.float32)
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.created_at = np.full(max_entries, -np.inf)
+        self.last_used = np.full(max_entries, -np.inf)
+        self.species = [None] * max_entries
+        self.answers = [None] * max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0  # Lookups whose best match had expired
+        self.evictions = 0
+        self.served_age = 0.0  # Total age of served answers, for average staleness
+    
+    def _raw(self, text):
+        """Sublinear term counts hashed into dim buckets"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term, count in features(text).items():
+            vector[zlib.crc32(term.encode('utf-8')) % self.dim] += 1 + math.log(count)
+        return vector
+    
+    def _weigh(self, raw):
+        weighted = raw * self.idf
+        norms = np.linalg.norm(weighted, axis=-1, keepdims=True)
+        return np.divide(weighted, norms, out=np.zeros_like(weighted), where=norms > 0)
+    
+    def fit_idf(self, questions):
+        """Bucket IDF from past user questions (e.g. ai_sessions) plus the intent seed examples, then reweigh cached rows"""
+        questions = [text for text, _ in seed_documents()] + list(questions)
+        doc_freq = np.zeros(self.dim, dtype=np.float32)
+        for question in questions:
+            doc_freq += self._raw(question) > 0
+        self.idf = (np.log((1 + len(questions)) / (1 + doc_freq)) + 1).astype(np.float32)
+        self.vectors = self._weigh(self.raw)
+    
+    def _alive(self, now):
+        return self.created_at >= now - self.ttl
+    
+    def lookup(self, question):
+        """Cached answer for a near-duplicate question about the same species, or None"""
+        now = time.time()
+        query = self._weigh(self._raw(question))
+        if not query.any():
+            self.misses += 1
+            return None
+        scores = self.vectors @ query
+        species = species_key(question)
+        for i in np.flatnonzero(scores >= self.threshold):
+            if self.species[i] != species:
+                scores[i] = -1.0
+        alive = self._alive(now)
+        best = int(np.argmax(np.where(alive, scores, -1.0)))
+        if not alive[best] or scores[best] < self.threshold:
+            if (scores[~alive] >= self.threshold).any():
+                self.stale += 1  # Would have hit if the answer were fresh
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.last_used[best] = now
+        self.served_age += float(now - self.created_at[best])
+        return self.answers[best]
+    
+    def add(self, question, answer):
+        """Remember an answer; reuses an expired slot, else evicts the least recently used"""
+        now = time.time()
+        expired = np.flatnonzero(~self._alive(now))
+        if len(expired):
+            slot = int(expired[0])
+            if self.answers[slot] is not None:
+                self.evictions += 1
+        else:
+            slot = int(np.argmin(self.last_used))
+            self.evictions += 1
+        self.raw[slot] = self._raw(question)
+        self.vectors[slot] = self._weigh(self.raw[slot])
+        self.created_at[slot] = now
+        self.last_used[slot] = now
+        self.species[slot] = species_key(question)
+        self.answers[slot] = answer
+    
+    def stats(self):
+        """Hit rate, staleness and occupancy for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'entries': int(self._alive(time.time()).sum()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'avg_age': self.served_age / self.hits if self.hits else 0.0
+        }
+
+# Global semantic answer cache; IDF starts from the seed examples and is refit from ai_sessions at startup
+semantic_cache = SemanticCache(
+    dim=config.SEMANTIC_CACHE_DIM,
+    max_entries=config.SEMANTIC_CACHE_SIZE,
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    ttl=config.SEMANTIC_CACHE_TTL
+)
+semantic_cache.fit_idf([])
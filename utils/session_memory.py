@@ -0,0 +1,89 @@
+import asyncio
+import config
+from utils.cache import TTLCache
+from utils.context_builder import count_tokens, trim_history
+from utils.database import async_db
+
+class SessionMemory:
+    """Per-session chat memory: a running summary plus recent turns verbatim, persisted in ai_session_memory"""
+    
+    def __init__(self, recent_turns, summarize_at_tokens, max_turn_tokens):
+        self.recent_turns = recent_turns
+        self.summarize_at_tokens = summarize_at_tokens
+        self.max_turn_tokens = max_turn_tokens
+        self._sessions = TTLCache(maxsize=config.MEMORY_CACHE_SIZE, ttl=config.MEMORY_CACHE_TTL)
+        self._tasks = {}  # (user_id, pet_id) -> running summarization task
+    
+    async def load(self, user_id, pet_id):
+        """(summary, recent turns) for a session, from memory or the database"""
+        key = (user_id, pet_id or 0)
+        session = self._sessions.get(key)
+        if session is None:
+            summary, turns, summarized = await async_db.get_session_memory(*key)
+            session = {'summary': summary, 'turns': turns, 'summarized': summarized}
+            self._sessions.set(key, session)
+        return session['summary'], list(session['turns'])
+    
+    async def append(self, user_id, pet_id, user_message, ai_response):
+        """Record one exchange and, once the verbatim tail grows too long, fold it down in the background"""
+        key = (user_id, pet_id or 0)
+        await self.load(*key)
+        session = self._sessions.get(key)
+        # Hard cap in case summaries keep failing (e.g. while the AI circuit is open)
+        session['turns'] = trim_history(
+            session['turns'] + [f"کاربر: {user_message}", f"دامپزشک: {ai_response}"],
+            self.max_turn_tokens
+        )
+        await self._save(key, session)
+        
+        turns_tokens = sum(count_tokens(turn) for turn in session['turns'])
+        if turns_tokens > self.summarize_at_tokens and len(session['turns']) > self.recent_turns and key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._summarize(key))
+    
+    async def _summarize(self, key):
+        """Fold every turn except the most recent ones into the running summary"""
+        from utils.openai_client import summarize_conversation
+        try:
+            session = self._sessions.get(key)
+            if session is None:
+                return
+            older = session['turns'][:-self.recent_turns]
+            summary = await summarize_conversation(session['summary'], older)
+            if not summary:
+                return
+            
+            # Turns may have been added (or the session cleared) while the summary was generated
+            session = self._sessions.get(key)
+            if session is None or session['turns'][:len(older)] != older:
+                return
+            session['summary'] = summary
+            session['turns'] = session['turns'][len(older):]
+            session['summarized'] += len(older)
+            await self._save(key, session)
+        except Exception as e:
+            print(f"Session summary error: {e}")
+        finally:
+            self._tasks.pop(key, None)
+    
+    async def _save(self, key, session):
+        await async_db.save_session_memory(*key, session['summary'], session['turns'], session['summarized'])
+    
+    async def clear(self, user_id):
+        """Forget a user's chat sessions (chat ended or cancelled)"""
+        for key in [key for key in self._tasks if key[0] == user_id]:
+            self._tasks.pop(key).cancel()
+        self._sessions.invalidate_where(lambda key: key[0] == user_id)
+        await async_db.clear_session_memory(user_id)
+    
+    async def stop(self):
+        """Cancel pending summaries on shutdown; their turns are already saved verbatim"""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+# Global session memory
+session_memory = SessionMemory(
+    recent_turns=config.MEMORY_RECENT_TURNS,
+    summarize_at_tokens=config.MEMORY_SUMMARIZE_AT_TOKENS,
+    max_turn_tokens=config.CHAT_HISTORY_TOKENS
+)
@@ -0,0 +1,46 @@
+import asyncio
+from utils.cache import TTLCache
+
+class SingleFlight:
+    """Runs one call per key at a time: concurrent callers share its result, which is then cached for ttl seconds"""
+    
+    def __init__(self, ttl, maxsize=1024):
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight = {}  # key -> task running the call
+        self.executions = 0
+        self.coalesced = 0
+    
+    async def run(self, key, factory, cacheable=None):
+        """Result of factory() for key; cacheable(result) decides whether it outlives the call"""
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        
+        task = self._inflight.get(key)
+        if task is None:
+            # A task, so one caller giving up (e.g. a cancelled update) doesn't cancel the others
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done, cacheable))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+    
+    def _finish(self, key, task, cacheable):
+        self._inflight.pop(key, None)
+        # Reading the exception also keeps asyncio from warning when every caller gave up
+        if task.cancelled() or task.exception() is not None:
+            return
+        if cacheable is None or cacheable(task.result()):
+            self.results.set(key, task.result())
+    
+    def stats(self):
+        """Calls executed vs. shared with one in flight, plus result cache counters"""
+        cache = self.results.stats()
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'cached': cache['hits'],
+            'cache_size': cache['size']
+        }
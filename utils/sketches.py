@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import heapq
+import math
+
+def hash64(item):
+    """Stable 64-bit hash (Python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(str(item).encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HyperLogLog:
+    """Fixed-memory distinct counter (2**precision one-byte registers), mergeable"""
+    
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+    
+    def add(self, item):
+        x = hash64(item)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def count(self):
+        """Estimated number of distinct items"""
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting is far more accurate for small cardinalities
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+    
+    def merge(self, other):
+        """Union with another sketch of the same precision (in place)"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs with different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+    
+    def to_dict(self):
+        return {
+            'precision': self.precision,
+            'registers': base64.b64encode(bytes(self.registers)).decode('ascii')
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = bytearray(base64.b64decode(data['registers']))
+        return sketch
+
+class SpaceSaving:
+    """Top-K heavy hitters in fixed memory (k counters), mergeable"""
+    
+    def __init__(self, k=50):
+        self.k = k
+        self.counters = {}  # item -> [count, overestimation error]
+    
+    def add(self, item, count=1):
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif len(self.counters) < self.k:
+            self.counters[item] = [count, 0]
+        else:
+            # Evict the smallest counter; the newcomer inherits its count as error
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + count, floor]
+    
+    def top(self, n=10):
+        """[(item, estimated count)] for the n heaviest items"""
+        heaviest = heapq.nlargest(n, self.counters.items(), key=lambda entry: entry[1][0])
+        return [(item, counts[0]) for item, counts in heaviest]
+    
+    def merge(self, other):
+        """Combine with another summary, keeping the k heaviest counters (in place)"""
+        for item, (count, error) in other.counters.items():
+            if item in self.counters:
+                self.counters[item][0] += count
+                self.counters[item][1] += error
+            else:
+                self.counters[item] = [count, error]
+        if len(self.counters) > self.k:
+            heaviest = heapq.nlargest(self.k, self.counters.items(), key=lambda entry: entry[1][0])
+            self.counters = dict(heaviest)
+        return self
+    
+    def to_dict(self):
+        return {
+            'k': self.k,
+            'counters': [[item, count, error] for item, (count, error) in self.counters.items()]
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        summary = cls(data['k'])
+        summary.counters = {item: [count, error] for item, count, error in data['counters']}
+        return summary
@@ -0,0 +1,52 @@
+import asyncio
+import time
+from telegram.error import BadRequest, RetryAfter
+import config
+
+# Telegram rejects message text longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+class ThrottledEditor:
+    """Edits one message with growing text, at most once per interval, to stay under Telegram's edit limits"""
+
+    def __init__(self, message, interval=config.STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.shown = None
+        self._next_edit = 0.0  # The first chunk is shown immediately
+
+    async def _edit(self, text, **kwargs):
+        text = text[:MAX_MESSAGE_LENGTH]
+        try:
+            await self.message.edit_text(text, **kwargs)
+            self.shown = text
+        except RetryAfter as e:
+            # Flood control: back off for as long as Telegram asks
+            self._next_edit = time.monotonic() + float(e.retry_after)
+            return False
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self._next_edit = time.monotonic() + self.interval
+        return True
+
+    async def update(self, text):
+        """Show text if the interval has passed; otherwise skip (a later update or finish covers it)"""
+        if text == self.shown or time.monotonic() < self._next_edit:
+            return
+        await self._edit(text)
+
+    async def finish(self, text, **kwargs):
+        """Final edit with formatting and keyboard; waits out any throttle instead of skipping"""
+        while True:
+            delay = self._next_edit - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                if await self._edit(text, **kwargs):
+                    return
+            except BadRequest:
+                if 'parse_mode' not in kwargs:
+                    raise
+                # Model output can break Markdown; fall back to plain text
+                kwargs.pop('parse_mode')